@@ -7,11 +7,16 @@ Game Commands:
 <P>     Pause Game
 <R>     Restart Game
 <S>     Toggle Sound On/Off
+<G>     Toggle Spatial Grid Collision Checks On/Off
+<F3>    Toggle Frame Time Profiler Overlay On/Off
+<F5>    Quick Save
+<F9>    Quick Load
+<BACKSPACE> Rewind (hold)
 
 <+>     Increase Game Speed
 <->     Decrease Game Speed
 
-<SPACE> Fire
+<SPACE> Fire (hold to keep firing)
 <LEFT>  Turn spaceship counter clockwise
 <RIGHT> Turn spaceship clockwise
 <UP>    Accelerate spaceship
@@ -32,8 +37,24 @@ Future improvements to code:
 
 import pygame, sys, time
 from pygame.locals import *
+from collections import deque
+import json
 import random
 import math
+from operator import attrgetter
+import struct
+import zlib
+import os
+import mmap
+import queue
+import threading
+import array
+import heapq
+
+try: # optional, only needed for the array backed world
+    import numpy as np
+except ImportError:
+    np = None
 
 WINDOWWIDTH = 800
 WINDOWHEIGHT = 600
@@ -45,30 +66,244 @@ YELLOW = (220, 220, 10)
 BLUE = (0, 0, 255)
 GREEN = (10, 250, 10)
 
-# okay to put media here?
-# load spaceship images
-ship = pygame.image.load ("media/spaceship0.png")
-ship_boost = pygame.image.load ("media/spaceship1.png")
-ship_hit = pygame.image.load ("media/spaceship_hit.png")
-
-# load asteroid images
-img_a0 = pygame.image.load ("media/a0.png")
-img_a1 = pygame.image.load ("media/a1.png")
-img_a2 = pygame.image.load ("media/a2.png")
+TICK_RATE = 25 # simulation steps per second of game time
+HIT_TIMEOUT = 1 # seconds of game time the ship can't be hit again
+LASER_LIFE = 100 # steps a laser flies
+LASER_SPEED = 15
+FIRE_INTERVAL = 5 # steps between shots while fire is held down
+
+STATE_MAGIC = b"PYAS"
+STATE_VERSION = 1
+# ticks, sim time, score, lifes, firing, next fire tick, ship (x, y, x speed, y speed, angle, x move, y move,
+# boost, turning left, turning right, hit, hit time), screen shake, world width and height, asteroid count,
+# laser count, star layers
+STATE_HEADER = struct.Struct ("<4sBIdiiBIdddddddBBBBdBIIIIB")
+ASTEROID_STATE = 7 # doubles per asteroid: x, y, x speed, y speed, size, angle, angle speed
+# per laser: x, y, x end, y end, x move, y move, angle, life, laser speed, ship x speed, ship y speed
+LASER_STATE = 11
+
+MEDIA_DIR = os.path.join (os.path.dirname (os.path.abspath (__file__)), "media")
+ASSET_CACHE_DIR = os.path.join (os.path.dirname (os.path.abspath (__file__)), ".asset_cache")
+
+
+# Loads images and sounds from the media directory on first use. Once a display exists
+# images are converted to its pixel format, otherwise every blit converts pixel by pixel.
+# With a cache directory the converted pixels, the rotation atlases and the decoded sounds
+# are written to disk once and memory-mapped on later starts instead of decoding the PNGs
+# and WAVs and rotating the sprites again.
+class AssetManager():
+    CACHE_VERSION = 1
+
+    images_files = {"ship": "spaceship0.png", "ship_boost": "spaceship1.png", "ship_hit": "spaceship_hit.png",
+                    "a0": "a0.png", "a1": "a1.png", "a2": "a2.png"}
+    sound_files = {"laser": "laser.wav", "rocket": "rocket.wav", "explosion": "explosion.wav", "crack": "crack.wav"}
+    music_file = "base.wav"
+
+    # images drawn rotated
+    rotated = ("a0", "a1", "a2", "ship", "ship_boost", "ship_hit")
+
+    def __init__(self, media_dir=MEDIA_DIR):
+        self.media_dir = media_dir
+        self.images = {}
+        self.sounds = {}
+        self.display = None # display the images were converted for
+        self.cache_dir = None
+        self.cache_key = None
+        self.cache_index = None # entries of a valid cache file, None if there is none
+        self.cache_map = None
+
+    def path(self, filename):
+        return os.path.join (self.media_dir, filename)
+
+    def image(self, name):
+        if self.display is not pygame.display.get_surface (): # new display, new pixel format
+            self.display = pygame.display.get_surface ()
+            self.images.clear ()
+        image = self.images.get (name)
+        if image is None:
+            image = self.cached_image (name)
+            if image is None:
+                image = pygame.image.load (self.path (self.images_files[name]))
+                if self.display is not None:
+                    image = image.convert_alpha ()
+            self.images[name] = image
+        return image
+
+    def sound(self, name):
+        sound = self.sounds.get (name)
+        if sound is None:
+            entry = self.cached ("sound:" + name)
+            if entry is not None:
+                sound = pygame.mixer.Sound (buffer=self.cache_bytes (entry))
+            else:
+                sound = pygame.mixer.Sound (self.path (self.sound_files[name]))
+            self.sounds[name] = sound
+        return sound
+
+    def music(self):
+        return self.path (self.music_file)
+
+    # rotation atlas of an image as stored by RotationCache, None if not cached
+    def rotations(self, name):
+        entry = self.cached ("rotations:" + name)
+        if entry is None:
+            return None
+        frames = [(self.surface_from_cache (frame), tuple (frame["draw_offset"])) for frame in entry["frames"]]
+        return entry["step"], frames
+
+    # the cache is only valid for the same media files, display and mixer format, rotation
+    # settings and pygame version it was written with
+    def use_cache(self, cache_dir, rotation_step, rotation_budget):
+        display = pygame.display.get_surface ()
+        if display is None or self.pixel_format (display.convert_alpha ()) is None:
+            return
+        self.cache_dir = cache_dir
+        media = dict ((name, [os.path.getsize (self.path (filename)), os.path.getmtime (self.path (filename))])
+                      for name, filename in list (self.images_files.items ()) + list (self.sound_files.items ()))
+        self.cache_key = {"version": self.CACHE_VERSION, "pygame": pygame.version.ver,
+                          "masks": list (display.convert_alpha ().get_masks ()),
+                          "mixer": list (pygame.mixer.get_init () or ()),
+                          "rotation": [rotation_step, rotation_budget], "media": media}
+        self.images.clear ()
+        self.sounds.clear ()
+        self.close_cache ()
+        try:
+            with open (os.path.join (cache_dir, "assets.json")) as f:
+                index = json.load (f)
+            if index["key"] != json.loads (json.dumps (self.cache_key)):
+                return
+            with open (os.path.join (cache_dir, "assets.bin"), "rb") as f:
+                self.cache_map = mmap.mmap (f.fileno (), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError, KeyError):
+            return
+        self.cache_index = index["entries"]
+
+    def cache_valid(self):
+        return self.cache_index is not None
+
+    def close_cache(self):
+        self.cache_index = None
+        self.cache_map = None # surfaces made from it keep it open as long as they need it
+
+    def cached(self, key):
+        if self.cache_index is None:
+            return None
+        return self.cache_index.get (key)
+
+    def cache_bytes(self, entry):
+        return memoryview (self.cache_map)[entry["offset"]:entry["offset"] + entry["length"]]
+
+    def cached_image(self, name):
+        entry = self.cached ("image:" + name)
+        if entry is None or self.display is None:
+            return None
+        return self.surface_from_cache (entry)
+
+    def surface_from_cache(self, entry):
+        return pygame.image.frombuffer (self.cache_bytes (entry), entry["size"], entry["format"])
+
+    @staticmethod
+    def pixel_format(surface):
+        return {(0xff0000, 0xff00, 0xff, 0xff000000): "BGRA",
+                (0xff, 0xff00, 0xff0000, 0xff000000): "RGBA"}.get (tuple (surface.get_masks ()))
+
+    # writes everything loaded so far plus the rotation atlases of rotation_cache
+    def write_cache(self, rotation_cache=None):
+        if self.cache_dir is None:
+            return
+        entries = {}
+        data = bytearray ()
+        def add(raw):
+            entry = {"offset": len (data), "length": len (raw)}
+            data.extend (raw)
+            return entry
+        def add_surface(surface):
+            format = self.pixel_format (surface)
+            entry = add (pygame.image.tobytes (surface, format))
+            entry.update (size=list (surface.get_size ()), format=format)
+            return entry
+
+        for name in self.images_files:
+            entries["image:" + name] = add_surface (self.image (name))
+            if rotation_cache is not None and self.image (name) in rotation_cache.entries:
+                step, frames = rotation_cache.entries[self.image (name)]
+                atlas = []
+                for surface, offset in frames:
+                    frame = add_surface (surface)
+                    frame["draw_offset"] = list (offset)
+                    atlas.append (frame)
+                entries["rotations:" + name] = {"step": step, "frames": atlas}
+        for name, sound in self.sounds.items ():
+            entries["sound:" + name] = add (sound.get_raw ())
+
+        os.makedirs (self.cache_dir, exist_ok=True)
+        for filename, content, mode in (("assets.bin", data, "wb"),
+                                        ("assets.json", json.dumps ({"key": self.cache_key, "entries": entries}), "w")):
+            path = os.path.join (self.cache_dir, filename)
+            with open (path + ".tmp", mode) as f:
+                f.write (content)
+            os.replace (path + ".tmp", path)
+
+
+assets = AssetManager ()
 
 
 # main Game class
 class AsteroidsGame():
 
-    def __init__ (self, asteroid_count=10, lifes=3, sound_on=True):
+    def __init__ (self, asteroid_count=10, lifes=3, sound_on=True, spatial_grid=True, array_world=False,
+                  rotation_step=3, rotation_budget=32*1024*1024, headless=False, dirty_rects=False,
+                  star_count=100, star_layers=1, seed=None, record_to=None, profile=False, profile_to=None,
+                  asset_cache=False, max_fps=60, laser_life=LASER_LIFE, laser_speed=LASER_SPEED, world_size=None,
+                  display_size=None, scaling="hardware", pixel_collisions=True, max_mask_tests=256,
+                  snapshot_interval=None, snapshot_memory=16*1024*1024, save_path="quicksave.sav", max_particles=20000,
+                  capture_to=None, capture_format="raw"):
 
         self.asteroids_count = asteroid_count
 
-        # lists for holding objects that will be drawn to screen
+        # the playfield is the screen, unless world_size (width, height) is bigger: then the view
+        # follows the ship and only the asteroids around it are simulated every step (see ChunkedWorld)
+        self.world = None
+        self.world_width = WINDOWWIDTH
+        self.world_height = WINDOWHEIGHT
+        if world_size is not None and tuple (world_size) != (WINDOWWIDTH, WINDOWHEIGHT):
+            self.world_width, self.world_height = world_size
+            if self.world_width < WINDOWWIDTH or self.world_height < WINDOWHEIGHT:
+                raise ValueError ("world_size can't be smaller than the screen")
+            self.world = ChunkedWorld (self.world_width, self.world_height)
+
+        # all randomness of a game comes from its own generator, so a seed and the
+        # key presses per tick are enough to replay a game exactly (see replay.py)
+        if seed is None:
+            seed = random.SystemRandom ().randrange (2**32)
+        self.seed = seed
+        self.rng = random.Random (seed)
+
+        # keep positions, speeds etc. of all entities in numpy arrays and update them
+        # in one vectorized step per frame, objects in the lists below are views on them
+        if array_world and np is None:
+            raise ImportError ("array_world needs numpy")
+        self.array_world = array_world
+
+        # lists for holding objects that will be drawn to screen, every object knows its
+        # index in the list (slot) so it can be removed in O(1) by moving the last one there
         self.asteroids = []
-        self.background_stars = []
         self.lasers_fired = []
 
+        # asteroids and lasers are reused instead of allocated for every split and shot
+        # (in a big world only the active ones are objects)
+        pooled = 4 * asteroid_count if self.world is None else 4 * min (asteroid_count, 256)
+        if array_world:
+            self.asteroid_pool = ObjectPool (ArrayAsteroid, pooled)
+            self.laser_pool = ObjectPool (ArrayLaser, 256)
+        else:
+            self.asteroid_pool = ObjectPool (Asteroid, pooled)
+            self.laser_pool = ObjectPool (Laser, 256)
+
+        # background stars are pre-rendered into one tile per parallax layer
+        self.star_count = star_count
+        self.star_layers = star_layers
+
         self.initial_lifes = lifes # number of lifes we start with
         self.lifes = self.initial_lifes # current in-game lifes
         self.score = 0
@@ -76,152 +311,721 @@ class AsteroidsGame():
         self.game_over = False
         self.game_run = True
         self.game_not_started = True
+        self.firing = False # fire held down, a laser is fired every FIRE_INTERVAL steps
+        self.next_fire_tick = 0
+        self.held_keys = set () # keys of held_key_actions that are down
         self.boost = False # indicates if we are accelerating
         self.screen_shake = False #used to shake the screen
 
-        self.fps = 25 # default animation speed
+        # physics runs at tick_rate steps per second of real time (<+>/<-> change the game speed),
+        # rendering as often as the display manages up to max_fps (0: no limit), objects are
+        # drawn interpolated between the last two physics steps
+        self.tick_rate = TICK_RATE
+        self.max_fps = max_fps
+        self.max_catch_up = 5 # steps per frame at most, a slow frame slows the game down instead of piling up
+        self.render_alpha = 1.0 # fraction of the next step that has elapsed when rendering
         self.low_fps = False
 
+        # the simulation advances in fixed steps of dt seconds of game time,
+        # independent of the wall clock and of the display
+        self.dt = 1.0 / TICK_RATE
+        self.ticks = 0
+        self.sim_time = 0.0
+        self.steps = 0 # calls of step (), unlike ticks never set back (replays count these)
+        self.clock = pygame.time.Clock ()
+
+        # snapshots of the game every snapshot_interval steps (0: none) to rewind to (hold <BACKSPACE>),
+        # the newest ones that fit into snapshot_memory bytes are kept (see SnapshotRing). By default
+        # every 5 steps, headless games (batch runs, training) take none.
+        # <F5> saves the game to save_path, <F9> loads it
+        if snapshot_interval is None:
+            snapshot_interval = 0 if headless else 5
+        self.snapshots = SnapshotRing (snapshot_interval, snapshot_memory) if snapshot_interval else None
+        self.rewinding = False
+        self.save_path = save_path
+
+        # broad phase for collision detection, set to False to compare against
+        # the plain all-against-all checks (toggle in game with <G>). It is rebuilt every step
+        # and only used in steps where that pays off (see prepare_collisions)
+        self.use_spatial_grid = spatial_grid
+        self.grid_min_asteroids = 100
+        self.grid_min_pairs = 3000 # asteroids times lasers
+        self.grid_active = False # used in this step
+        if self.world is None:
+            self.collision_grid = SpatialGrid ()
+        else: # only has to cover the active chunks
+            self.collision_grid = SpatialGrid (width=self.world.active_width, height=self.world.active_height)
+        self.max_asteroid_speed = 0
+
+        # circles around the sprites reject most pairs, the remaining ones are tested with the
+        # sprites' masks at their current rotation (see MaskCache), at most max_mask_tests per step,
+        # after that the plain circle tests are used. False: circle tests only
+        self.pixel_collisions = pixel_collisions
+        self.max_mask_tests = max_mask_tests
+        self.mask_tests = 0 # in the last step
+        self.mask_fallbacks = 0 # tests of the last step that didn't fit into the budget
+        self.mask_overhang = 0 # how far asteroid pixels reach beyond the asteroid size
+        if pixel_collisions:
+            self.mask_overhang = max (0, max (collision_masks.radius (assets.image (name)) - size
+                                              for name, size in (("a0", 8), ("a1", 16), ("a2", 32))))
+
+        self.laser_life = laser_life
+        self.laser_speed = laser_speed
+
+        # headless games have no window and no audio, they are driven by calling step()
+        self.headless = headless
+        self.screen = None
+
+        # the game is always drawn at WINDOWWIDTH x WINDOWHEIGHT (the units of all game coordinates)
+        # and scaled up to a display_size window, (0, 0) for fullscreen at the desktop resolution.
+        # scaling "hardware" lets SDL scale on the GPU, "integer", "fit" and "smooth" scale in
+        # software (see ScaledDisplay)
+        self.display_size = display_size
+        self.scaling = scaling
+        self.scaler = None
+
+        # only redraw and push the screen areas that changed (helps with software displays like VNC)
+        self.dirty_rects = dirty_rects
+        self.dirty_renderer = None
+        self.sound_on = sound_on and not headless
+        self.music_on = self.sound_on
+
+        # sound events of the simulation are collected per frame and played by a background thread
+        self.audio = AudioScheduler (None)
+
+        # explosions, debris, sparks and exhaust, at most max_particles at a time (0: none). Only
+        # games with a renderer have them, they need numpy (see ParticleSystem)
+        self.max_particles = max_particles
+        self.particles = None
+
+        # record every presented frame to the directory capture_to, as "raw" pixels or "png" files
+        # (see FrameCapture), the counts of written and dropped frames are printed when quitting
+        self.capture_to = capture_to
+        self.capture_format = capture_format
+        self.capture = None
+
+        if not headless:
+            self.init_display (rotation_step, rotation_budget, asset_cache)
+            self.init_sound ()
+            if asset_cache and not assets.cache_valid ():
+                assets.write_cache (self.rotation_cache)
+
+        # initiate game objects
+        self.init_objects()
+        if self.snapshots is not None:
+            self.take_snapshot ()
+
+        # record key presses to a replay file
+        self.recorder = None
+        if record_to is not None:
+            from replay import ReplayRecorder
+            self.recorder = ReplayRecorder (record_to, self)
+
+        # per phase frame timings (toggle in game with <F3>), written to profile_to
+        # (.csv or .json) when the game is quit
+        self.profiler = None
+        self.profile_to = profile_to
+        if profile or profile_to is not None:
+            self.enable_profiler ()
 
-        self.sound_on = sound_on
+        # run animation
+        if not headless:
+            self.run_game()
+
+
+    # asset_cache: True or a directory to keep preprocessed media in (see AssetManager)
+    def init_display(self, rotation_step, rotation_budget, asset_cache=False):
         pygame.mixer.pre_init (44100, -16, 1, 512)
-        self.music_on = sound_on
 
         # Set up pygame
         pygame.init ()
-        self.clock = pygame.time.Clock ()
 
         # Set up the window
-        self.screen = pygame.display.set_mode ((WINDOWWIDTH, WINDOWHEIGHT), 0, 32)
+        screen = self.init_window ()
         pygame.display.set_caption ("Asteroids")
 
+        # held keys are polled with pygame.key.get_pressed, the queue only needs key presses
+        pygame.event.set_blocked (None)
+        pygame.event.set_allowed ([QUIT, KEYDOWN, VIDEOEXPOSE])
+
+        if asset_cache:
+            assets.use_cache (ASSET_CACHE_DIR if asset_cache is True else asset_cache, rotation_step, rotation_budget)
+        self.init_renderer (screen, rotation_step, rotation_budget)
+
         # change mouse pointer
         #pygame.mouse.set_cursor (*pygame.cursors.diamond)
         pygame.mouse.set_visible (False)
 
+    # returns the surface the game is drawn to
+    def init_window(self):
+        if self.display_size is None:
+            return pygame.display.set_mode ((WINDOWWIDTH, WINDOWHEIGHT), 0, 32)
+        fullscreen = tuple (self.display_size) == (0, 0)
+
+        if self.scaling == "hardware":
+            screen = pygame.display.set_mode ((WINDOWWIDTH, WINDOWHEIGHT), SCALED | (FULLSCREEN if fullscreen else 0), 32)
+            if not fullscreen:
+                # SCALED picks the window size itself
+                try:
+                    from pygame._sdl2.video import Window
+                    Window.from_display_module ().size = self.display_size
+                except (ImportError, AttributeError, pygame.error):
+                    pass
+            return screen
+
+        if self.scaling not in ScaledDisplay.modes:
+            raise ValueError ("unknown scaling %r" % self.scaling)
+        display = pygame.display.set_mode (self.display_size, FULLSCREEN if fullscreen else 0, 32)
+        self.scaler = ScaledDisplay (display, (WINDOWWIDTH, WINDOWHEIGHT), self.scaling)
+        return pygame.Surface ((WINDOWWIDTH, WINDOWHEIGHT)).convert (display)
+
+    # show the drawn frame (or the changed areas of it) on the display
+    def present(self, rects=None):
+        if self.scaler is not None:
+            rects = self.scaler.present (self.screen, rects)
+        pygame.display.update (rects)
+
+    # set the surface render() draws to, headless games can attach an off-screen surface
+    # (drawing the HUD needs pygame.font to be initialized)
+    def init_renderer(self, screen, rotation_step=3, rotation_budget=32*1024*1024):
+        self.screen = screen
+
+        # pre-rotate sprites, drawing then only needs a lookup and a blit
+        # (rotation_step in degrees, rotation_budget in bytes, rotation_step=0 disables the cache)
+        self.rotation_cache = RotationCache (rotation_step, rotation_budget)
+        for name in assets.rotated:
+            cached = assets.rotations (name)
+            if cached is not None:
+                self.rotation_cache.put (assets.image (name), *cached)
+            else:
+                self.rotation_cache.add (assets.image (name))
+        # asteroids created before (e.g. by a headless game that is shown now) still have the images
+        # loaded for the previous display, the caches only know the new ones
+        for asteroid in self.asteroids:
+            asteroid.change_image ()
+
+        # fonts and rendered texts are cached, the HUD is only re-rendered when a value changes
+        self.hud = Hud ()
+
+        if self.dirty_rects:
+            self.dirty_renderer = DirtyRectRenderer (screen.get_size ())
+
+        if self.max_particles and np is not None:
+            self.particles = ParticleSystem (self.max_particles, seed=self.seed)
+
+        if self.capture_to is not None:
+            self.capture = FrameCapture (self.capture_to, screen, self.capture_format)
+
+    def init_sound(self):
+        # without an audio device the game runs silently
+        if not pygame.mixer.get_init ():
+            self.sound_on = self.music_on = False
+            return
+
         #pre-load sounds
-        self.laser_sound = pygame.mixer.Sound ("media/laser.wav")
-        self.rocket_sound = pygame.mixer.Sound ("media/rocket.wav")
-        self.explosion_sound = pygame.mixer.Sound ("media/explosion.wav")
-        self.crack_sound = pygame.mixer.Sound ("media/crack.wav")
+        try:
+            sounds = dict ((name, assets.sound (name)) for name in AudioScheduler.sound_settings)
+        except pygame.error:
+            self.sound_on = self.music_on = False
+            return
+        self.audio = AudioScheduler (sounds)
+        self.audio.enabled = self.sound_on
 
         if self.sound_on: #play background sound
-            pygame.mixer.music.load ('media/base.wav')
+            pygame.mixer.music.load (assets.music ())
             pygame.mixer.music.play (-1)
 
-        # initiate game objects
-        self.init_objects()
-
-        # run animation
-        self.run_game()
-
 
     def run_game(self):
 
         if self.game_not_started:
             self.game_start_up()
 
+        accumulator = 0.0
+        previous = time.perf_counter ()
         while not self.game_over:
+            profiler = self.profiler
+            frame_start = time.perf_counter ()
+            frame_time = frame_start - previous
+            previous = frame_start
 
             # HANDLE EVENTS
-            for event in pygame.event.get ():
-                #print(event)
+            # (paused and finished games wait for the next event instead of spinning)
+            if self.game_run:
+                events = pygame.event.get ()
+            else:
+                events = [pygame.event.wait ()] + pygame.event.get ()
+            for event in events:
                 if event.type == QUIT:
-                    pygame.quit ()
-                    sys.exit ()
-
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_ESCAPE:
-                        pygame.quit ()
-                        sys.exit ()
-
-                    # Reset Game
-                    if event.key == pygame.K_r:
-                        self.game_run = True
-                        self.restart_game()
-
-                    # toggle settings
-                    if event.key == pygame.K_s:
-                        self.toggle_sound ()
-                    if event.key == pygame.K_m:
-                        self.toggle_music ()
-
-                    # spaceship control
-                    if event.key == pygame.K_LEFT:
-                        self.myShip.turn_left()
-                    if event.key == pygame.K_RIGHT:
-                        self.myShip.turn_right ()
-                    if event.key == pygame.K_UP:
-                        self.myShip.accelerate()
-                        if self.sound_on and not self.myShip.has_been_hit:
-                            pygame.mixer.Sound.play (self.rocket_sound)
-
-                    # fire laser
-                    if event.key == pygame.K_SPACE:
-                        self.fire_laser ()
-
-                    if event.key == pygame.K_p: # pause animation
-                        if not self.game_run:
-                            self.game_run = True
-                        else:
-                            self.game_run = False
-                    if event.key == pygame.K_KP_PLUS: # increase anim speed
-                        if self.fps < 40:
-                            self.fps += 1
-                    if event.key == pygame.K_KP_MINUS: # decrease anim speed
-                        self.fps -= 1
-
-
-                if event.type == pygame.KEYUP:
-                    if event.key == pygame.K_UP:
-                       self.myShip.stop_accel ()
-                    if event.key == pygame.K_LEFT or event.key == pygame.K_RIGHT:
-                       self.myShip.stop_rotation ()
+                    self.quit_game ()
+                elif event.type == KEYDOWN:
+                    if event.key not in self.held_key_actions:
+                        self.input_key (KEYDOWN, event.key)
+                    elif event.key not in self.held_keys: # pressed and maybe already released again
+                        self.held_keys.add (event.key)
+                        self.input_key (KEYDOWN, event.key)
+                elif event.type == VIDEOEXPOSE:
+                    pygame.display.update ()
+            self.poll_keys ()
 
             # RUN / PAUSE GAME
             if self.game_run:
-                # Draw background
-                self.screen.fill (BLACK)
-
-                #collision detection
-                self.ship_asteroid_collision()
-                self.laser_asteroid_collision()
-
-                # Draw objects
-                self.draw_objects()
-
-                #draw Infos
-                self.draw_infos()
-
-                # draw red frame and shake screen when ship has been hit
-                if self.myShip.has_been_hit:
-                    pygame.draw.lines (self.screen, RED, True,
-                                       [(0, 0), (WINDOWWIDTH, 0), (WINDOWWIDTH, WINDOWHEIGHT), (0, WINDOWHEIGHT)], 5)
-                    self.shake_screen()
+                if profiler is not None:
+                    profiler.add ("events", time.perf_counter () - frame_start)
+
+                # advance the simulation by as many fixed steps as real time has passed
+                tick = 1.0 / self.tick_rate
+                accumulator += frame_time
+                steps = 0
+                while accumulator >= tick and steps < self.max_catch_up:
+                    self.step ()
+                    accumulator -= tick
+                    steps += 1
+                    # stop on the step that ends the game, like replay.play does
+                    if self.is_finished ():
+                        break
+                if accumulator >= tick: # too far behind, drop the rest
+                    accumulator = 0.0
+                self.render_alpha = accumulator / tick
+
+                # draw the state between the last two steps
+                changed_rects = self.render ()
 
                 # Draw the window onto the screen.
-                pygame.display.update ()
-
-                # move objects
-                self.update_all_objects ()
-
-                # detect low fps
-                if self.fps - self.clock.get_fps() > 2:
+                if profiler is not None:
+                    update_start = time.perf_counter ()
+                self.present (changed_rects)
+                if profiler is not None:
+                    profiler.add ("display update", time.perf_counter () - update_start)
+                if self.capture is not None:
+                    grab_time = self.capture.grab (self.screen, self.steps)
+                    if profiler is not None:
+                        profiler.add ("capture", grab_time)
+
+                # hand this frame's sound events to the audio thread
+                self.audio.flush ()
+
+                # detect low fps (not every physics step gets shown)
+                if self.tick_rate - self.clock.get_fps() > 2:
                     self.low_fps = True
                 else:
                     self.low_fps = False
 
-                self.clock.tick (self.fps)
+                self.clock.tick (self.max_fps)
+                if profiler is not None:
+                    profiler.end_frame ()
+            else:
+                accumulator = 0.0
+                previous = time.perf_counter ()
 
             if self.lifes < 1:
                 self.game_run = False
                 # game over screen
                 self.game_over_screen()
 
-            if len(self.asteroids) < 1:
+            if self.asteroids_left () < 1:
                 self.game_run = False
                 self.game_win_screen()
 
+    # key -> method handling it, held keys are polled once per frame (poll_keys) and their
+    # method gets True when the key goes down and False when it is released
+    # (rewind first: releasing it sets the other keys to the rewound state, see restore_held_keys)
+    held_key_actions = {pygame.K_BACKSPACE: "set_rewind",
+                        pygame.K_LEFT: "set_turn_left",
+                        pygame.K_RIGHT: "set_turn_right",
+                        pygame.K_UP: "set_thrust",
+                        pygame.K_SPACE: "set_fire"}
+    # the others are called on KEYDOWN
+    key_actions = {pygame.K_ESCAPE: "quit_game",
+                   pygame.K_r: "restart",
+                   pygame.K_s: "toggle_sound",
+                   pygame.K_m: "toggle_music",
+                   pygame.K_g: "toggle_grid",
+                   pygame.K_F3: "toggle_profiler",
+                   pygame.K_F5: "quick_save",
+                   pygame.K_F9: "quick_load",
+                   pygame.K_p: "toggle_pause",
+                   pygame.K_KP_PLUS: "speed_up",
+                   pygame.K_KP_MINUS: "slow_down"}
+    # quick save and load depend on the save file, replays get the loaded state instead (see load_game)
+    unrecorded_keys = (pygame.K_F5, pygame.K_F9)
+
+    # key events of the player, recorded for replays
+    def input_key(self, event_type, key):
+        if self.recorder is not None and key not in self.unrecorded_keys:
+            self.recorder.record_key (self.steps, event_type, key)
+        self.handle_key (event_type, key)
+
+    def poll_keys(self):
+        pressed = pygame.key.get_pressed ()
+        for key in self.held_key_actions:
+            if pressed[key]:
+                if key not in self.held_keys:
+                    self.held_keys.add (key)
+                    self.input_key (KEYDOWN, key)
+            elif key in self.held_keys:
+                self.held_keys.discard (key)
+                self.input_key (KEYUP, key)
+
+    def handle_key(self, event_type, key):
+        action = self.held_key_actions.get (key)
+        if action is not None:
+            getattr (self, action) (event_type == KEYDOWN)
+        elif event_type == KEYDOWN and key in self.key_actions:
+            getattr (self, self.key_actions[key]) ()
+
+    # spaceship control
+    def set_turn_left(self, down):
+        self.myShip.is_turning_left = down
+
+    def set_turn_right(self, down):
+        self.myShip.is_turning_right = down
+
+    def set_thrust(self, down):
+        if down:
+            self.myShip.accelerate()
+            if not self.myShip.has_been_hit:
+                self.audio.emit ("rocket")
+        else:
+            self.myShip.stop_accel ()
+
+    # fires right away, then every FIRE_INTERVAL steps while held down (see step)
+    def set_fire(self, down):
+        self.firing = down
+        if down:
+            self.fire_laser ()
+            self.next_fire_tick = self.ticks + FIRE_INTERVAL
+
+    # rewinds one snapshot per step while held, also out of a finished game
+    def set_rewind(self, down):
+        if self.snapshots is None:
+            return
+        self.rewinding = down
+        if down:
+            self.game_run = True
+        else:
+            self.restore_held_keys ()
+
+    def quick_save(self):
+        with open (self.save_path, "wb") as f:
+            f.write (self.save_state ())
+
+    def quick_load(self):
+        if not os.path.exists (self.save_path):
+            return
+        with open (self.save_path, "rb") as f:
+            self.load_game (f.read ())
+
+    # continues from a saved game (save_state), replays load the same data at the same step
+    def load_game(self, data):
+        if self.recorder is not None:
+            self.recorder.record_state (self.steps, data)
+        self.load_saved (data)
+        self.game_run = True
+        self.restore_held_keys ()
+
+    # after rewinding or loading the keys count as held the way the restored ship and fire flags
+    # are, so the next poll_keys releases the ones that are up now (and presses the others)
+    def restore_held_keys(self):
+        self.held_keys.clear ()
+        for key, down in ((pygame.K_LEFT, self.myShip.is_turning_left), (pygame.K_RIGHT, self.myShip.is_turning_right),
+                          (pygame.K_UP, self.myShip.boost), (pygame.K_SPACE, self.firing)):
+            if down:
+                self.held_keys.add (key)
+
+    def restart(self):
+        self.game_run = True
+        self.restart_game ()
+
+    def toggle_grid(self):
+        self.use_spatial_grid = not self.use_spatial_grid
+
+    def toggle_profiler(self):
+        if self.profiler is None:
+            self.enable_profiler ()
+        else:
+            self.disable_profiler ()
+
+    def toggle_pause(self):
+        self.game_run = not self.game_run
+
+    def speed_up(self):
+        if self.tick_rate < 40:
+            self.tick_rate += 1
+
+    def slow_down(self):
+        if self.tick_rate > 5:
+            self.tick_rate -= 1
+
+    def quit_game(self):
+        self.audio.close ()
+        if self.capture is not None:
+            stats = self.capture.close ()
+            print ("captured %(frames)d frames to %(path)s: %(written)d written, %(dropped)d dropped, "
+                   "%(grab_mean_ms).2f ms per frame on the game thread (max %(grab_max_ms).2f ms)" %
+                   dict (stats, path=self.capture_to), file=sys.stderr)
+            if stats["error"] is not None:
+                print ("capture stopped: %s" % stats["error"], file=sys.stderr)
+        if self.recorder is not None:
+            self.recorder.close ()
+        if self.profiler is not None and self.profile_to is not None:
+            self.profiler.export (self.profile_to)
+        pygame.quit ()
+        sys.exit ()
+
+    # The profiler times these methods by shadowing them with timed wrappers on the
+    # instance, so a disabled profiler doesn't cost anything.
+    profiled_methods = {"ship_asteroid_collision": "ship collision",
+                        "laser_asteroid_collision": "laser collision",
+                        "update_all_objects": "update objects",
+                        "take_snapshot": "snapshot",
+                        "draw_stars": "draw stars",
+                        "draw_objects": "draw objects",
+                        "draw_infos": "draw infos"}
+
+    def enable_profiler(self):
+        self.profiler = FrameProfiler ()
+        for method, phase in self.profiled_methods.items ():
+            setattr (self, method, self.profiler.wrap (phase, getattr (self, method)))
+
+    def disable_profiler(self):
+        if self.profiler is not None and self.profile_to is not None:
+            self.profiler.export (self.profile_to)
+        for method in self.profiled_methods:
+            delattr (self, method)
+        self.profiler = None
+
+    # One fixed time step of the game simulation (collisions, lifetimes, movement).
+    # Needs no display or audio, so headless games can call it in a tight loop.
+    def step(self):
+        self.steps += 1
+        if self.rewinding:
+            self.rewind_step ()
+            return
+
+        # fire held down
+        if self.firing and self.ticks >= self.next_fire_tick:
+            self.fire_laser ()
+            self.next_fire_tick = self.ticks + FIRE_INTERVAL
+
+        #collision detection
+        self.check_collisions()
+
+        # remove lasers at the end of their life
+        self.expire_lasers()
+
+        # shake screen when ship has been hit
+        if self.myShip.has_been_hit:
+            self.shake_screen()
+
+        # move objects
+        self.update_all_objects ()
+
+        self.ticks += 1
+        self.sim_time += self.dt
+
+        # wake up and put to sleep asteroids around the ship, advance some of the dormant ones
+        if self.world is not None:
+            self.world.update (self)
+
+        if self.snapshots is not None and self.ticks % self.snapshots.interval == 0:
+            self.take_snapshot ()
+
+    def take_snapshot(self):
+        self.snapshots.push (self)
+
+    # back to the previous snapshot, the oldest one is kept
+    def rewind_step(self):
+        sections = self.snapshots.rewind (self.ticks)
+        if sections is not None:
+            self.load_state (sections)
+            # the state is the newest snapshot again, no chunk changed since
+            if self.world is not None:
+                self.world.changed.clear ()
+
+    # checksum over the simulation state, used to verify replays
+    def state_checksum(self):
+        values = [self.ticks, self.score, self.lifes, self.myShip.x_pos, self.myShip.y_pos,
+                  self.myShip.x_speed, self.myShip.y_speed, self.myShip.angle]
+        for asteroid in self.asteroids:
+            values.extend ((asteroid.x_pos, asteroid.y_pos, asteroid.x_speed, asteroid.y_speed, asteroid.size, asteroid.angle))
+        for laser in self.lasers_fired:
+            values.extend ((laser.x_pos, laser.y_pos, laser.x_end_pos, laser.y_end_pos, laser.life))
+        if self.world is not None:
+            for rows in self.world.chunks:
+                values.extend (rows)
+        return zlib.crc32 (struct.pack ("<%dd" % len (values), *values))
+
+    # The game state as a list of bytes sections: header (see STATE_HEADER) with the starfield
+    # offsets, random generator, asteroids, lasers and in a big world its schedule and one section
+    # per chunk. Sections equal to the ones of previous (the sections of the last snapshot) are
+    # taken from it, chunks that didn't change since then aren't even serialized.
+    def state_sections(self, previous=None):
+        ship = self.myShip
+        header = STATE_HEADER.pack (STATE_MAGIC, STATE_VERSION, self.ticks, self.sim_time, self.score, self.lifes,
+                                    self.firing, self.next_fire_tick, ship.x_pos, ship.y_pos, ship.x_speed, ship.y_speed,
+                                    ship.angle, ship.x_move, ship.y_move, ship.boost, ship.is_turning_left,
+                                    ship.is_turning_right, ship.has_been_hit, ship.hit_time, self.screen_shake,
+                                    self.world_width, self.world_height, len (self.asteroids), len (self.lasers_fired),
+                                    len (self.starfield.offsets))
+        offsets = [value for offset in self.starfield.offsets for value in offset]
+        header += struct.pack ("<%dd" % len (offsets), *offsets)
+
+        version, internal, gauss_next = self.rng.getstate ()
+        rng = struct.pack ("<%dIBd" % len (internal), *internal, gauss_next is not None, gauss_next or 0.0)
+
+        asteroids = array.array ('d')
+        for asteroid in self.asteroids:
+            asteroids.extend ((asteroid.x_pos, asteroid.y_pos, asteroid.x_speed, asteroid.y_speed, asteroid.size,
+                               asteroid.angle, asteroid.angle_speed))
+        lasers = array.array ('d')
+        for laser in self.lasers_fired:
+            lasers.extend ((laser.x_pos, laser.y_pos, laser.x_end_pos, laser.y_end_pos, laser.x_move, laser.y_move,
+                            laser.angle, laser.life, laser.laser_speed, laser.ship_x_speed, laser.ship_y_speed))
+        sections = [header, rng, asteroids.tobytes (), lasers.tobytes ()]
+
+        if self.world is not None:
+            world = self.world
+            sections.append (world.state ())
+            first = len (sections)
+            changed = world.take_changed () if previous is not None else None
+            for index, rows in enumerate (world.chunks):
+                if changed is not None and index not in changed:
+                    sections.append (previous[first + index])
+                else:
+                    sections.append (rows.tobytes ())
+
+        if previous is not None:
+            for i, section in enumerate (sections):
+                if section is not previous[i] and section == previous[i]:
+                    sections[i] = previous[i]
+        return sections
+
+    def load_state(self, sections):
+        header = STATE_HEADER.unpack_from (sections[0])
+        if header[0] != STATE_MAGIC or header[1] != STATE_VERSION:
+            raise ValueError ("not a saved game")
+        ship = self.myShip
+        (magic, version, self.ticks, self.sim_time, self.score, self.lifes, firing, self.next_fire_tick,
+         ship.x_pos, ship.y_pos, ship.x_speed, ship.y_speed, ship.angle, ship.x_move, ship.y_move, boost,
+         turning_left, turning_right, hit, ship.hit_time, screen_shake, world_width, world_height, asteroid_count,
+         laser_count, star_layers) = header
+        if (world_width, world_height) != (self.world_width, self.world_height):
+            raise ValueError ("saved game has a different world size")
+        self.firing = bool (firing)
+        ship.boost = bool (boost)
+        ship.is_turning_left = bool (turning_left)
+        ship.is_turning_right = bool (turning_right)
+        ship.has_been_hit = bool (hit)
+        ship.ship_image = assets.image ("ship_hit" if hit else "ship_boost" if boost else "ship")
+        self.screen_shake = bool (screen_shake)
+        if star_layers == len (self.starfield.offsets):
+            offsets = struct.unpack_from ("<%dd" % (2 * star_layers), sections[0], STATE_HEADER.size)
+            self.starfield.offsets = [list (offsets[i:i + 2]) for i in range (0, len (offsets), 2)]
+
+        values = struct.unpack ("<%dIBd" % ((len (sections[1]) - 9) // 4), sections[1])
+        self.rng.setstate ((3, values[:-2], values[-1] if values[-2] else None))
+
+        # backwards, so that removing (which moves the last one into the gap) doesn't skip any
+        for i in range (len (self.asteroids) - 1, -1, -1):
+            self.remove_asteroid (self.asteroids[i])
+        for i in range (len (self.lasers_fired) - 1, -1, -1):
+            self.remove_laser (self.lasers_fired[i])
+
+        rows = array.array ('d', sections[2])
+        for i in range (0, len (rows), ASTEROID_STATE):
+            x_pos, y_pos, x_speed, y_speed, size, angle, angle_speed = rows[i:i + ASTEROID_STATE]
+            self.add_asteroid (self.new_asteroid (x_pos=x_pos, y_pos=y_pos, size=size, x_speed=x_speed, y_speed=y_speed,
+                                                  angle=angle, angle_speed=angle_speed))
+        rows = array.array ('d', sections[3])
+        for i in range (0, len (rows), LASER_STATE):
+            (x_pos, y_pos, x_end_pos, y_end_pos, x_move, y_move, angle, life, laser_speed,
+             ship_x_speed, ship_y_speed) = rows[i:i + LASER_STATE]
+            laser = self.new_laser (x_pos, y_pos, angle, ship_x_speed, ship_y_speed, life, laser_speed)
+            laser.x_end_pos = x_end_pos
+            laser.y_end_pos = y_end_pos
+            laser.x_move = x_move
+            laser.y_move = y_move
+            laser.life = int (life)
+            laser.slot = len (self.lasers_fired)
+            self.lasers_fired.append (laser)
+
+        if self.world is not None:
+            self.world.load (sections[4], sections[5:])
+
+        if self.dirty_renderer is not None:
+            self.dirty_renderer.invalidate ()
+
+    # the state as a zlib compressed file: section count, then per section its length and bytes
+    def save_state(self):
+        sections = self.state_sections ()
+        data = bytearray (struct.pack ("<I", len (sections)))
+        for section in sections:
+            data += struct.pack ("<I", len (section))
+            data += section
+        return zlib.compress (bytes (data))
+
+    def load_saved(self, data):
+        data = zlib.decompress (data)
+        count, = struct.unpack_from ("<I", data)
+        sections = []
+        pos = 4
+        for i in range (count):
+            size, = struct.unpack_from ("<I", data, pos)
+            sections.append (data[pos + 4:pos + 4 + size])
+            pos += 4 + size
+        self.load_state (sections)
+
+    # True once the game is lost or won
+    def is_finished(self):
+        return self.lifes < 1 or self.asteroids_left () < 1
+
+    # number of asteroids in the game, including the dormant ones of a big world
+    def asteroids_left(self):
+        if self.world is None:
+            return len (self.asteroids)
+        return len (self.asteroids) + self.world.dormant
+
+    # step a headless game until it is finished (or max_ticks have passed), returns the number of ticks
+    def simulate(self, max_ticks):
+        start = self.ticks
+        while not self.is_finished() and self.ticks - start < max_ticks:
+            self.step()
+        return self.ticks - start
+
+    # draw the current state to self.screen, returns the list of changed areas
+    # or None if the whole screen has been redrawn
+    def render(self):
+        if self.dirty_renderer is not None:
+            return self.dirty_renderer.render (self)
+
+        # Draw background (the opaque first star layer covers the whole screen)
+        self.draw_stars (self.screen)
+
+        # Draw objects
+        self.draw_objects()
+
+        #draw Infos
+        self.draw_infos()
+
+        # draw red frame when ship has been hit
+        if self.myShip.has_been_hit:
+            self.draw_hit_frame()
+
+        self.draw_overlays()
+        return None
+
+    # things drawn on top of everything else, returns the list of areas drawn to
+    def draw_overlays(self):
+        rects = []
+        if self.profiler is not None:
+            rects.append (self.profiler.draw (self.screen, self.hud.font (14)))
+        return rects
+
+    def draw_hit_frame(self):
+        pygame.draw.lines (self.screen, RED, True,
+                           [(0, 0), (WINDOWWIDTH, 0), (WINDOWWIDTH, WINDOWHEIGHT), (0, WINDOWHEIGHT)], 5)
+
     def shake_screen(self):
         if self.screen_shake:
             delta = 5
@@ -230,54 +1034,132 @@ class AsteroidsGame():
             delta = -5
             self.screen_shake = True
 
-        for asteroid in self.asteroids:
-            asteroid.x_pos += delta
-        for star in self.background_stars:
-            star.x_pos += delta
+        self.starfield.shift_x (delta)
+        if self.world is not None: # the view shakes, not the world
+            self.world.x_shake += delta
+            return
+        if self.array_world:
+            self.asteroid_arrays.shift_x (delta)
+        else:
+            for asteroid in self.asteroids:
+                asteroid.x_pos += delta
         self.myShip.x_pos+= delta
+        if self.particles is not None:
+            self.particles.shift_x (delta)
 
 
     def init_objects(self):
         self.myShip = SpaceShip()
 
-        for i in range(100):
-            star = Asteroid(color=WHITE, size=1, x_speed=0, y_speed=0)
-            self.background_stars.append(star)
+        if self.array_world:
+            self.asteroid_arrays = AsteroidArrays (width=self.world_width, height=self.world_height)
+            self.laser_arrays = LaserArrays ()
+
+        self.starfield = Starfield (self.star_count, self.star_layers, rng=self.rng)
+
+        if self.world is not None:
+            # the asteroids start dormant, the ones around the ship are woken up right away
+            self.myShip.x_pos = self.world_width / 2
+            self.myShip.y_pos = self.world_height / 2
+            self.world.clear ()
+            self.world.spawn (self.asteroids_count, self.myShip, self.rng, self.ticks)
+            self.world.update (self)
+            return
 
         for i in range(self.asteroids_count):
-            asteroid = Asteroid()
-            self.asteroids.append(asteroid)
+            asteroid = self.new_asteroid()
+            self.add_asteroid(asteroid)
+
+    # take asteroids and lasers from the pools, either as plain objects or as views on the entity arrays
+    def new_asteroid(self, **kwargs):
+        asteroid = self.asteroid_pool.acquire ()
+        if self.array_world:
+            asteroid.reset (self.asteroid_arrays, rng=self.rng, **kwargs)
+        else:
+            asteroid.reset (rng=self.rng, **kwargs)
+        return asteroid
+
+    def new_laser(self, *args):
+        laser = self.laser_pool.acquire ()
+        if self.array_world:
+            laser.reset (self.laser_arrays, *args)
+        else:
+            laser.reset (*args)
+        return laser
+
+    def remove_laser(self, laser):
+        swap_remove (self.lasers_fired, laser)
+        if self.array_world:
+            self.laser_arrays.remove (laser)
+        self.laser_pool.release (laser)
+
 
+    def expire_lasers(self):
+        # backwards, so that removing (which moves the last laser into the gap) doesn't skip any
+        lasers = self.lasers_fired
+        for i in range (len (lasers) - 1, -1, -1):
+            laser = lasers[i]
+            if laser.life > 0:
+                laser.life -= 1
+            else:
+                self.remove_laser (laser)
 
-    # Helper method  to turn a rectangle around its center
-    def rotate_image_center (self, image, rect, angle):
-        # Rotate the original image without modifying it.
-        new_image = pygame.transform.rotate (image, angle)
-        # Get a new rect with the center of the old rect.
-        rect = new_image.get_rect (center=rect.center)
-        return new_image, rect
+    def draw_stars(self, surface):
+        self.starfield.draw (surface)
 
+    # draw lasers, ship and asteroids, returns the list of areas drawn to
     def draw_objects(self):
-        # draw background stars
-        for star in self.background_stars:
-            pygame.draw.ellipse (self.screen, star.color,
-                                 [star.x_pos, star.y_pos, star.size, star.size])
+        rects = []
+
+        # objects are drawn at their position render_alpha of the way from the previous step
+        # to the current one, they moved by their speed in between
+        back = 1.0 - self.render_alpha
+
+        # in a big world the view is centered on the ship, objects are drawn relative to it
+        # (or not at all when they are outside of it)
+        world = self.world
+        ship_x = self.myShip.x_pos - self.myShip.x_move * back
+        ship_y = self.myShip.y_pos - self.myShip.y_move * back
+        if world is not None:
+            world.look_at (ship_x, ship_y)
+            ship_x, ship_y = world.view_position (ship_x, ship_y)
+
+        # particles below everything else
+        if self.particles is not None:
+            rects.extend (self.particles.draw (self.screen, back, world, self.dirty_renderer is not None))
+            if self.profiler is not None:
+                self.profiler.count ("particles", self.particles.count)
 
         # draw laser shots
         for laser in self.lasers_fired:
-            if laser.life > 0:
-                pygame.draw.line (self.screen, BLUE, (laser.x_pos, laser.y_pos), (laser.x_end_pos, laser.y_end_pos))
-            else:
-                self.lasers_fired.remove (laser)
-            laser.life -= 1
+            x_pos = laser.x_pos
+            y_pos = laser.y_pos
+            x_end_pos = laser.x_end_pos
+            y_end_pos = laser.y_end_pos
+            if back:
+                x_move = laser.x_move * back
+                y_move = laser.y_move * back
+                x_pos -= x_move
+                y_pos -= y_move
+                x_end_pos -= x_move
+                y_end_pos -= y_move
+            if world is not None:
+                position = world.view_position (x_pos, y_pos)
+                if position is None:
+                    continue
+                x_end_pos += position[0] - x_pos
+                y_end_pos += position[1] - y_pos
+                x_pos, y_pos = position
+            rects.append (pygame.draw.line (self.screen, BLUE, (x_pos, y_pos), (x_end_pos, y_end_pos)))
 
         # draw spaceship
+        ship_x = int (ship_x)
+        ship_y = int (ship_y)
         if self.myShip.has_been_hit:
-            pygame.draw.circle (self.screen, (10,10,10), [int(self.myShip.x_pos), int(self.myShip.y_pos)], int(self.myShip.size*7/4), 1)
+            rects.append (pygame.draw.circle (self.screen, (10,10,10), [ship_x, ship_y], int(self.myShip.size*7/4), 1))
         #pygame.draw.rect (self.screen, WHITE, [self.myShip.x_pos-self.myShip.size/2, self.myShip.y_pos-self.myShip.size/2, self.myShip.size, self.myShip.size])
-        rect = self.myShip.ship_image.get_rect (center=(self.myShip.x_pos, self.myShip.y_pos))
-        surf, rect = self.rotate_image_center (self.myShip.ship_image, rect, self.myShip.angle)
-        self.screen.blit (surf, rect)
+        surf, (x_offset, y_offset) = self.rotation_cache.get (self.myShip.ship_image, self.myShip.angle)
+        rects.append (self.screen.blit (surf, (ship_x + x_offset, ship_y + y_offset)))
 
         # draw asteroids
         for asteroid in self.asteroids:
@@ -285,210 +1167,482 @@ class AsteroidsGame():
             #pygame.draw.rect (self.screen, asteroid.color,[asteroid.x_pos-asteroid.size/2, asteroid.y_pos-asteroid.size/2, asteroid.size, asteroid.size])
 
             #pygame.draw.circle (self.screen, asteroid.color, [int(asteroid.x_pos), int(asteroid.y_pos)], int(asteroid.size), 1)
-            rect_ast = asteroid.image.get_rect (center=(asteroid.x_pos, asteroid.y_pos))
-            surf_ast, rect_ast = self.rotate_image_center (asteroid.image, rect_ast, asteroid.angle)
-            self.screen.blit (surf_ast, rect_ast)
+            x_pos = asteroid.x_pos - asteroid.x_speed * back
+            y_pos = asteroid.y_pos + asteroid.y_speed * back
+            if world is not None:
+                position = world.view_position (x_pos, y_pos)
+                if position is None:
+                    continue
+                x_pos, y_pos = position
+            surf_ast, (x_offset, y_offset) = self.rotation_cache.get (asteroid.image, asteroid.angle)
+            rects.append (self.screen.blit (surf_ast, (int (x_pos) + x_offset, int (y_pos) + y_offset)))
 
+        return rects
 
-    def draw_infos(self):
-        font = pygame.font.SysFont ("Serif", 18)
 
-        text = "Score: " + str(self.score)
-        renderText = font.render (text, True, WHITE)
-        self.screen.blit (renderText, (30, WINDOWHEIGHT - 50))
+    def draw_infos(self):
+        self.hud.set_line ("score", "Score: " + str(self.score), WHITE, (30, WINDOWHEIGHT - 50))
 
-        text = "Lifes: " + str(self.lifes)
         if self.myShip.has_been_hit:
             text_color=RED
         else:
             text_color=WHITE
-        renderText = font.render (text, True, text_color)
-        self.screen.blit (renderText, (30, WINDOWHEIGHT - 30))
+        self.hud.set_line ("lifes", "Lifes: " + str(self.lifes), text_color, (30, WINDOWHEIGHT - 30))
 
-        text = "fps: " + str(int (self.clock.get_fps ())) + " (" + str(self.fps) + ")"
+        text = "fps: " + str(int (self.clock.get_fps ())) + " (" + str(self.tick_rate) + ")"
         if self.low_fps:
             text_color = RED
         else:
             text_color = WHITE
-        renderText = font.render (text, True, text_color)
-        self.screen.blit (renderText, (WINDOWWIDTH-100, WINDOWHEIGHT-70))
+        self.hud.set_line ("fps", text, text_color, (WINDOWWIDTH-100, WINDOWHEIGHT-70))
 
         if self.sound_on:
             state = "On"
         else:
             state = "Off"
-        text = "Sound: " + state
-        renderText = font.render (text, True, WHITE)
-        self.screen.blit (renderText, (WINDOWWIDTH - 100, WINDOWHEIGHT - 50))
+        self.hud.set_line ("sound", "Sound: " + state, WHITE, (WINDOWWIDTH - 100, WINDOWHEIGHT - 50))
 
         if self.music_on:
             state = "On"
         else:
             state = "Off"
-        text = "Music: " + state
-        renderText = font.render (text, True, WHITE)
-        self.screen.blit (renderText, (WINDOWWIDTH - 100, WINDOWHEIGHT - 30))
+        self.hud.set_line ("music", "Music: " + state, WHITE, (WINDOWWIDTH - 100, WINDOWHEIGHT - 30))
+
+        return self.hud.draw (self.screen)
+
+    # draw a text of one of the start/win/game over screens
+    def draw_screen_text(self, text, size, y_pos):
+        self.screen.blit (self.hud.render_text (text, WHITE, size), (WINDOWWIDTH / 2 - 75, y_pos))
 
 
     def update_all_objects(self):
-        for asteroid in self.asteroids:
-            asteroid.update()
-        for star in self.background_stars:
-            star.update(self.myShip.x_speed/10, self.myShip.y_speed/10)
-        for laser in self.lasers_fired:
-            laser.update_laser()
-        self.myShip.update()
+        if self.array_world:
+            self.asteroid_arrays.update()
+            self.laser_arrays.update_laser()
+        else:
+            width = self.world_width
+            height = self.world_height
+            for asteroid in self.asteroids:
+                asteroid.update(None, None, width, height)
+            for laser in self.lasers_fired:
+                laser.update_laser()
+        self.starfield.update(self.myShip.x_speed/10, self.myShip.y_speed/10)
+        self.myShip.update(self.sim_time, self.world_width, self.world_height)
+
+        if self.particles is not None:
+            self.particles.update ()
+            ship = self.myShip
+            if ship.boost:
+                # out of the back of the ship, which points to (-sin (angle), -cos (angle)) on screen
+                rad_angle = math.radians (ship.angle)
+                self.particles.emit ("exhaust", ship.x_pos + math.sin (rad_angle) * 12, ship.y_pos + math.cos (rad_angle) * 12,
+                                     6, ship.x_speed, -ship.y_speed, math.atan2 (math.cos (rad_angle), math.sin (rad_angle)), 0.6)
 
 
     def fire_laser(self):
-        laser = Laser(self.myShip.x_pos, self.myShip.y_pos, self.myShip.angle, self.myShip.x_speed, self.myShip.y_speed)
+        laser = self.new_laser(self.myShip.x_pos, self.myShip.y_pos, self.myShip.angle, self.myShip.x_speed, self.myShip.y_speed,
+                               self.laser_life, self.laser_speed)
+        laser.slot = len (self.lasers_fired)
         self.lasers_fired.append(laser)
-        if self.sound_on:
-            pygame.mixer.Sound.play (self.laser_sound)
-            #pygame.mixer.music.stop ()
-
+        self.audio.emit ("laser")
+
+
+    def check_collisions(self):
+        self.prepare_collisions ()
+        self.ship_asteroid_collision()
+        self.laser_asteroid_collision()
+        if self.profiler is not None:
+            self.profiler.count ("mask tests", self.mask_tests)
+
+    def prepare_collisions(self):
+        # asteroids moved since the last frame, so the grid is rebuilt once per frame
+        # and then kept up to date while asteroids split or get destroyed. The rebuild costs
+        # about as much as testing every asteroid against a few lasers and a query as much as
+        # testing a few dozen asteroids, so the grid is only used with enough of both
+        # (lasers are tested against the asteroids' motion as well, the tests have to
+        # reach as far as the fastest asteroid moves)
+        max_speed = 0
+        count = len (self.asteroids)
+        self.grid_active = (self.use_spatial_grid and count >= self.grid_min_asteroids and
+                            count * len (self.lasers_fired) >= self.grid_min_pairs)
+        if self.grid_active:
+            self.collision_grid.clear ()
+        if self.array_world:
+            # all at once from the arrays, views are ordered like the array rows
+            arrays = self.asteroid_arrays
+            count = arrays.count
+            if count:
+                max_speed = max (float (np.abs (arrays.x_speed[:count]).max ()), float (np.abs (arrays.y_speed[:count]).max ()))
+            if self.grid_active:
+                self.collision_grid.insert_many (arrays.views, arrays.x_pos[:count], arrays.y_pos[:count], arrays.size[:count])
+        elif self.grid_active and np is not None:
+            fields = np.array ([(asteroid.x_pos, asteroid.y_pos, asteroid.size, asteroid.x_speed, asteroid.y_speed)
+                                for asteroid in self.asteroids])
+            max_speed = float (np.abs (fields[:, 3:]).max ())
+            self.collision_grid.insert_many (self.asteroids, fields[:, 0], fields[:, 1], fields[:, 2])
+        elif self.grid_active:
+            for asteroid in self.asteroids:
+                self.collision_grid.insert (asteroid, asteroid.x_pos, asteroid.y_pos, asteroid.size)
+                max_speed = max (max_speed, abs (asteroid.x_speed), abs (asteroid.y_speed))
+        else:
+            for asteroid in self.asteroids:
+                max_speed = max (max_speed, abs (asteroid.x_speed), abs (asteroid.y_speed))
+        self.max_asteroid_speed = max_speed
+
+        self.mask_tests = 0
+        self.mask_fallbacks = 0
+
+    # asteroids that might be within half_size of (x_pos, y_pos), in the same order as self.asteroids
+    def collision_candidates(self, x_pos, y_pos, half_size):
+        if self.grid_active:
+            return self.collision_grid.query (x_pos, y_pos, half_size)
+        return self.asteroids
+
+    def add_asteroid(self, asteroid):
+        asteroid.slot = len (self.asteroids)
+        self.asteroids.append (asteroid)
+        if self.grid_active:
+            self.collision_grid.insert (asteroid, asteroid.x_pos, asteroid.y_pos, asteroid.size)
+        self.track_speed (asteroid)
+
+    def track_speed(self, asteroid):
+        self.max_asteroid_speed = max (self.max_asteroid_speed, abs (asteroid.x_speed), abs (asteroid.y_speed))
+
+    def remove_asteroid(self, asteroid):
+        swap_remove (self.asteroids, asteroid)
+        if self.array_world:
+            self.asteroid_arrays.remove (asteroid)
+        if self.grid_active:
+            self.collision_grid.remove (asteroid)
+        self.asteroid_pool.release (asteroid)
 
     def ship_asteroid_collision(self):
-        for asteroid in self.asteroids:
-            if abs(self.myShip.x_pos - asteroid.x_pos) < asteroid.size/2 + self.myShip.size/2 and abs(self.myShip.y_pos - asteroid.y_pos) < asteroid.size/2 + self.myShip.size/2:
+        # without pixel collisions ship and asteroids are circles, the ship's radius is half its
+        # image size (the sprite is about as wide), an asteroid's radius is its size
+        ship_radius = self.myShip.size/2
+        if self.pixel_collisions:
+            ship_radius = collision_masks.radius (self.myShip.ship_image)
+        candidates = self.collision_candidates (self.myShip.x_pos, self.myShip.y_pos, ship_radius + self.mask_overhang)
+        # the pixel radius is only looked up for asteroids within size + mask_overhang (see laser_asteroid_collision)
+        overhang = self.mask_overhang + 1e-6
+        for asteroid in candidates:
+            x_dist = self.myShip.x_pos - asteroid.x_pos
+            y_dist = self.myShip.y_pos - asteroid.y_pos
+            distance = x_dist * x_dist + y_dist * y_dist
+            if self.pixel_collisions:
+                hit = (distance < (asteroid.size + overhang + ship_radius) ** 2 and
+                       distance < (collision_masks.radius (asteroid.image) + ship_radius) ** 2 and
+                       self.ship_mask_hit (asteroid))
+            else:
+                hit = distance < (asteroid.size + ship_radius) ** 2
+            if hit:
                 if not self.myShip.has_been_hit: # only count new hits after timeout (has_been_hitz flasg is reset in Asteroids.update method)
                     self.lifes -= 1
 
-                    if self.sound_on:
-                        pygame.mixer.Sound.play (self.explosion_sound)
+                    self.audio.emit ("explosion")
+                    if self.particles is not None:
+                        self.particles.emit ("explosion", self.myShip.x_pos, self.myShip.y_pos, 150,
+                                             self.myShip.x_speed, -self.myShip.y_speed)
 
                     # change speed and dir of parent asteroid
                     asteroid.x_speed = asteroid.x_speed + self.myShip.x_speed
                     asteroid.y_speed = asteroid.y_speed + self.myShip.y_speed
+                    self.track_speed (asteroid)
 
                     asteroid.change_image ()
 
                 self.myShip.has_been_hit = True
-                self.myShip.hit_time = time.time ()
+                self.myShip.hit_time = self.sim_time
 
                 if asteroid.size > 8:
                     asteroid.size /= 2
                     # change size,
                     # create new child asteroid and
-                    new_asteroid = Asteroid (size=asteroid.size, x_pos=asteroid.x_pos, y_pos=asteroid.y_pos)
-                    self.asteroids.append (new_asteroid)
+                    new_asteroid = self.new_asteroid (size=asteroid.size, x_pos=asteroid.x_pos, y_pos=asteroid.y_pos)
+                    self.add_asteroid (new_asteroid)
+                    # children spawn on top of the ship and are checked in this frame as well
+                    # (the plain path gets this for free by iterating self.asteroids itself)
+                    if candidates is not self.asteroids:
+                        candidates.append (new_asteroid)
 
                     # change asteroids image according to size
                     asteroid.change_image ()
 
 
+    # Swept test: the path the laser's tip took during the last step (relative to the asteroid,
+    # which moved as well) is tested against the asteroid's circle, so fast lasers can't pass
+    # through small asteroids. A laser that was just fired is tested along its whole length.
     def laser_asteroid_collision(self):
-        for laser in self.lasers_fired:
-            for asteroid in self.asteroids:
-                if abs (laser.x_end_pos - asteroid.x_pos) < asteroid.size and abs (laser.y_end_pos - asteroid.y_pos) < asteroid.size:
+        # all lasers' fields at once in the array world (removing a laser only moves one that
+        # has been checked already, so the slots of the remaining ones stay valid)
+        sweeps = self.laser_arrays.sweeps () if self.array_world and self.lasers_fired else None
+        radii = collision_masks.radii if self.pixel_collisions else None
+        # a pixel radius is at most size + mask_overhang (a little more, so that rounding can't make it tighter)
+        overhang = self.mask_overhang + 1e-6 if self.pixel_collisions else 0
+        # and the broad phase for all of them with the fields of the asteroids they found (see
+        # laser_candidates). It holds as long as no asteroid gets faster than boxed_speed (a hit adds
+        # at most a tenth of the laser's length, 1, to an asteroid's speed), asteroids that were split
+        # or added by hits are tested on top
+        boxed = None
+        known = None
+        if sweeps is not None:
+            boxed_speed = self.max_asteroid_speed + 2
+            boxed, known = self.laser_candidates (boxed_speed)
+            changed = {} # the same for split and added asteroids, in the order they changed
+
+        # backwards, so that removing (which moves the last laser into the gap) doesn't skip any
+        lasers = self.lasers_fired
+        for i in range (len (lasers) - 1, -1, -1):
+            laser = lasers[i]
+            if sweeps is None:
+                x_pos, y_pos, x_end, y_end, life = laser.x_pos, laser.y_pos, laser.x_end_pos, laser.y_end_pos, laser.life
+            else:
+                index = laser.index
+                x_pos, y_pos, x_end, y_end, life = (sweeps[0][index], sweeps[1][index], sweeps[2][index],
+                                                    sweeps[3][index], sweeps[4][index])
+            if life == self.laser_life:
+                x_move = x_end - x_pos
+                y_move = y_end - y_pos
+                moving = False
+                slack = 0
+            else:
+                if sweeps is None:
+                    x_move = laser.x_move
+                    y_move = laser.y_move
+                else:
+                    x_move = sweeps[5][index]
+                    y_move = sweeps[6][index]
+                moving = True
+                slack = self.max_asteroid_speed
+            half_size = max (abs (x_move), abs (y_move)) / 2 + slack + self.mask_overhang
+            # the swept segment doesn't reach further than this from its end
+            reach = abs (x_move) + abs (y_move) + 2 * slack
+            if boxed is not None and self.max_asteroid_speed > boxed_speed:
+                boxed = None
+            if boxed is not None:
+                candidates = [asteroid for asteroid in boxed[index] if asteroid in known]
+                candidates.extend (changed)
+                candidates.sort (key=slot_of)
+            else:
+                candidates = self.collision_candidates (x_end - x_move / 2, y_end - y_move / 2, half_size)
+            for asteroid in candidates:
+                values = (known.get (asteroid) or changed.get (asteroid)) if known is not None else None
+                if values is None:
+                    x_asteroid, y_asteroid, radius = asteroid.x_pos, asteroid.y_pos, asteroid.size
+                else:
+                    x_asteroid, y_asteroid, radius, x_speed, y_speed = values
+                # cheap rejection first, before looking up the pixel radius
+                limit = reach + radius + overhang
+                x_dist = x_asteroid - x_end
+                if x_dist > limit or -x_dist > limit:
+                    continue
+                y_dist = y_asteroid - y_end
+                if y_dist > limit or -y_dist > limit:
+                    continue
+                if radii is not None:
+                    radius = radii.get (asteroid.image) or collision_masks.radius (asteroid.image)
+                if moving:
+                    if values is None:
+                        x_speed, y_speed = asteroid.x_speed, asteroid.y_speed
+                    x_sweep = x_move - x_speed
+                    y_sweep = y_move + y_speed
+                else:
+                    x_sweep = x_move
+                    y_sweep = y_move
+                if (segment_hits_circle (x_end, y_end, x_sweep, y_sweep, x_asteroid, y_asteroid, radius) and
+                        (not self.pixel_collisions or self.laser_mask_hit (asteroid, x_end, y_end, x_sweep, y_sweep))):
                     self.score += 1000
-                    pygame.mixer.Sound.play (self.crack_sound)
+                    self.audio.emit ("crack")
+                    if self.particles is not None:
+                        self.particles.emit ("debris", asteroid.x_pos, asteroid.y_pos, asteroid.size * 4,
+                                             asteroid.x_speed, -asteroid.y_speed)
+                        self.particles.emit ("spark", x_end, y_end, 16)
+                    if known is not None:
+                        known.pop (asteroid, None)
+                        changed.pop (asteroid, None)
                     if asteroid.size < 16:
-                        self.asteroids.remove(asteroid)
+                        self.remove_asteroid (asteroid)
                     else:
                         # change size, speed and dir of parent asteroid
                         asteroid.size /= 2
-                        asteroid.x_speed = asteroid.x_speed + (laser.x_end_pos - laser.x_pos) / 10
-                        asteroid.y_speed = asteroid.y_speed - (laser.y_end_pos - laser.y_pos) / 10
+                        asteroid.x_speed = asteroid.x_speed + (x_end - x_pos) / 10
+                        asteroid.y_speed = asteroid.y_speed - (y_end - y_pos) / 10
+                        self.track_speed (asteroid)
 
                         # change image
                         asteroid.change_image ()
 
                         # create new child asteroid and
-                        new_asteroid = Asteroid(size=asteroid.size, x_pos=asteroid.x_pos, y_pos=asteroid.y_pos)
-                        self.asteroids.append(new_asteroid)
-
-                    self.lasers_fired.remove (laser)
+                        new_asteroid = self.new_asteroid(size=asteroid.size, x_pos=asteroid.x_pos, y_pos=asteroid.y_pos)
+                        self.add_asteroid (new_asteroid)
+                        if known is not None:
+                            # (the child may be a pooled object that was hit before)
+                            for changed_asteroid in (asteroid, new_asteroid):
+                                known.pop (changed_asteroid, None)
+                                changed[changed_asteroid] = (changed_asteroid.x_pos, changed_asteroid.y_pos, changed_asteroid.size,
+                                                             changed_asteroid.x_speed, changed_asteroid.y_speed)
+
+                    self.remove_laser (laser)
                     break
 
+    # Array world: the asteroids each laser's cheap rejection test in laser_asteroid_collision can
+    # pass (with asteroids up to `speed` fast), for all lasers at once. The asteroids are sorted by
+    # x, each laser takes the ones in its x range and its box test is done on these pairs in one go
+    # (a pixel radius is at most size + mask_overhang, so this finds a superset). Returns the lists
+    # of asteroids per laser array slot and asteroid -> (x, y, size, x speed, y speed) of the found ones.
+    def laser_candidates(self, speed):
+        asteroids = self.asteroid_arrays
+        lasers = self.laser_arrays
+        count = asteroids.count
+        laser_count = lasers.count
+        candidates = [[] for i in range (laser_count)]
+        if not count:
+            return candidates, {}
+        x_end = lasers.x_end_pos[:laser_count]
+        y_end = lasers.y_end_pos[:laser_count]
+        fired = lasers.life[:laser_count] == self.laser_life
+        x_move = np.where (fired, x_end - lasers.x_pos[:laser_count], lasers.x_move[:laser_count])
+        y_move = np.where (fired, y_end - lasers.y_pos[:laser_count], lasers.y_move[:laser_count])
+        reach = np.abs (x_move) + np.abs (y_move) + np.where (fired, 0.0, 2 * speed)
+        # a little more, so that rounding can't make it tighter than the exact test
+        bound = asteroids.size[:count] + ((self.mask_overhang if self.pixel_collisions else 0) + 1e-6)
+
+        x_pos = asteroids.x_pos[:count]
+        y_pos = asteroids.y_pos[:count]
+        order = np.argsort (x_pos)
+        sorted_x = x_pos[order]
+        widest = bound.max ()
+        low = np.searchsorted (sorted_x, x_end - reach - widest, "left")
+        high = np.searchsorted (sorted_x, x_end + reach + widest, "right")
+        counts = high - low
+        owners = np.repeat (np.arange (laser_count), counts)
+        rows = order[np.arange (int (counts.sum ())) - np.repeat (np.cumsum (counts) - counts - low, counts)]
+        limit = reach[owners] + bound[rows]
+        inside = (np.abs (x_pos[rows] - x_end[owners]) <= limit) & (np.abs (y_pos[rows] - y_end[owners]) <= limit)
+        owners = owners[inside]
+        rows = rows[inside]
+
+        views = asteroids.views
+        for owner, row in zip (owners.tolist (), rows.tolist ()):
+            candidates[owner].append (views[row])
+        found = np.unique (rows)
+        known = dict (zip ([views[row] for row in found.tolist ()],
+                           zip (*[getattr (asteroids, name)[found].tolist () for name in ('x_pos', 'y_pos', 'size', 'x_speed', 'y_speed')])))
+        return candidates, known
+
+    # counts a mask test, False if the budget of this step is used up
+    def take_mask_test(self):
+        if self.mask_tests >= self.max_mask_tests:
+            self.mask_fallbacks += 1
+            return False
+        self.mask_tests += 1
+        return True
+
+    # whether the ship's and the asteroid's sprites overlap, as drawn
+    def ship_mask_hit(self, asteroid):
+        ship = self.myShip
+        if not self.take_mask_test ():
+            x_dist = ship.x_pos - asteroid.x_pos
+            y_dist = ship.y_pos - asteroid.y_pos
+            return x_dist * x_dist + y_dist * y_dist < (asteroid.size + ship.size/2) ** 2
+        ship_mask, (ship_x_offset, ship_y_offset) = collision_masks.get (ship.ship_image, ship.angle)
+        mask, (x_offset, y_offset) = collision_masks.get (asteroid.image, asteroid.angle)
+        offset = (int (asteroid.x_pos) + x_offset - int (ship.x_pos) - ship_x_offset,
+                  int (asteroid.y_pos) + y_offset - int (ship.y_pos) - ship_y_offset)
+        return ship_mask.overlap (mask, offset) is not None
+
+    # whether the segment from (x_end - x_sweep, y_end - y_sweep) to (x_end, y_end) crosses
+    # a pixel of the asteroid, it is walked in steps of at most one pixel
+    def laser_mask_hit(self, asteroid, x_end, y_end, x_sweep, y_sweep):
+        if not self.take_mask_test ():
+            return segment_hits_circle (x_end, y_end, x_sweep, y_sweep, asteroid.x_pos, asteroid.y_pos, asteroid.size)
+        mask, (x_offset, y_offset) = collision_masks.get (asteroid.image, asteroid.angle)
+        width, height = mask.get_size ()
+        # segment end relative to the mask's top left corner
+        x_end -= int (asteroid.x_pos) + x_offset
+        y_end -= int (asteroid.y_pos) + y_offset
+        steps = int (max (abs (x_sweep), abs (y_sweep))) + 1
+        for i in range (steps + 1):
+            back = (steps - i) / steps
+            x_pos = x_end - x_sweep * back
+            y_pos = y_end - y_sweep * back
+            if 0 <= x_pos < width and 0 <= y_pos < height and mask.get_at ((int (x_pos), int (y_pos))):
+                return True
+        return False
+
     def game_start_up(self):
         self.screen.fill (BLACK)
-        for star in self.background_stars:
-            pygame.draw.ellipse (self.screen, star.color,
-                                 [star.x_pos, star.y_pos, star.size, star.size])
+        self.draw_stars (self.screen)
 
-        font = pygame.font.SysFont ("Serif", 36)
-        text = "ASTEROIDS v1.0"
-        renderText = font.render (text, True, WHITE)
-        self.screen.blit (renderText, (WINDOWWIDTH / 2 - 75, WINDOWHEIGHT / 2 - 50))
+        self.draw_screen_text ("ASTEROIDS v1.0", 36, WINDOWHEIGHT / 2 - 50)
 
-        font = pygame.font.SysFont ("Serif", 18)
-        text = "Press any key to start"
-        renderText = font.render (text, True, WHITE)
-        self.screen.blit (renderText, (WINDOWWIDTH / 2 - 75, WINDOWHEIGHT / 2))
+        self.draw_screen_text ("Press any key to start", 18, WINDOWHEIGHT / 2)
 
         pygame.draw.lines (self.screen, WHITE, True,
                            [(0, 0), (WINDOWWIDTH, 0), (WINDOWWIDTH, WINDOWHEIGHT), (0, WINDOWHEIGHT)], 5)
 
-        pygame.display.update ()
+        self.present ()
         while (self.game_not_started):
-            for event in pygame.event.get ():
-                if event.type == pygame.KEYDOWN:
-                    self.game_not_started=False
+            event = pygame.event.wait ()
+            if event.type == QUIT:
+                self.quit_game ()
+            elif event.type == pygame.KEYDOWN:
+                self.game_not_started=False
+            elif event.type == VIDEOEXPOSE:
+                pygame.display.update ()
 
 
     def game_win_screen(self):
         self.screen.fill (BLACK)
-        for star in self.background_stars:
-            pygame.draw.ellipse (self.screen, star.color,
-                                 [star.x_pos, star.y_pos, star.size, star.size])
+        self.draw_stars (self.screen)
 
-        font = pygame.font.SysFont ("Serif", 36)
-        text = "YOU WIN"
-        renderText = font.render (text, True, WHITE)
-        self.screen.blit (renderText, (WINDOWWIDTH / 2 - 75, WINDOWHEIGHT / 2 - 50))
+        self.draw_screen_text ("YOU WIN", 36, WINDOWHEIGHT / 2 - 50)
 
-        font = pygame.font.SysFont ("Serif", 18)
-        text = "Score: " + str (self.score)
-        renderText = font.render (text, True, WHITE)
-        self.screen.blit (renderText, (WINDOWWIDTH / 2 - 75, WINDOWHEIGHT / 2))
-
-        font = pygame.font.SysFont ("Serif", 18)
-        text = "Play again? Press <R>."
-        renderText = font.render (text, True, WHITE)
-        self.screen.blit (renderText, (WINDOWWIDTH / 2 - 75, WINDOWHEIGHT / 2 + 50))
+        self.draw_screen_text ("Score: " + str (self.score), 18, WINDOWHEIGHT / 2)
+        self.draw_screen_text ("Play again? Press <R>.", 18, WINDOWHEIGHT / 2 + 50)
 
         pygame.draw.lines (self.screen, GREEN, True,
                            [(0, 0), (WINDOWWIDTH, 0), (WINDOWWIDTH, WINDOWHEIGHT), (0, WINDOWHEIGHT)], 5)
 
-        pygame.display.update ()
+        self.present ()
 
 
     def restart_game(self):
         self.score = 0
         self.lifes = self.initial_lifes
+        self.collision_grid.clear () # the released asteroids are reused
+        for asteroid in self.asteroids:
+            self.asteroid_pool.release (asteroid)
+        for laser in self.lasers_fired:
+            self.laser_pool.release (laser)
         self.asteroids = []
-        self.background_stars = []
         self.lasers_fired = []
+        self.firing = False
+        self.held_keys.clear () # keys still held down are pressed again for the new ship
 
         self.init_objects()
+        if self.dirty_renderer is not None:
+            self.dirty_renderer.invalidate ()
+        if self.particles is not None:
+            self.particles.clear ()
+        if self.snapshots is not None:
+            self.snapshots.clear ()
+            self.take_snapshot ()
 
 
     def game_over_screen(self):
         self.screen.fill (BLACK)
-        for star in self.background_stars:
-            pygame.draw.ellipse (self.screen, star.color,
-                                 [star.x_pos, star.y_pos, star.size, star.size])
-
-        font = pygame.font.SysFont ("Serif", 36)
-        text = "GAME OVER"
-        renderText = font.render (text, True, WHITE)
-        self.screen.blit (renderText, (WINDOWWIDTH / 2 - 75, WINDOWHEIGHT / 2 - 50))
+        self.draw_stars (self.screen)
 
-        font = pygame.font.SysFont ("Serif", 18)
-        text = "Score: " + str (self.score)
-        renderText = font.render (text, True, WHITE)
-        self.screen.blit (renderText, (WINDOWWIDTH / 2 - 75, WINDOWHEIGHT / 2))
+        self.draw_screen_text ("GAME OVER", 36, WINDOWHEIGHT / 2 - 50)
 
-        font = pygame.font.SysFont ("Serif", 18)
-        text = "Play again? Press <R>."
-        renderText = font.render (text, True, WHITE)
-        self.screen.blit (renderText, (WINDOWWIDTH / 2 - 75, WINDOWHEIGHT / 2 + 50))
+        self.draw_screen_text ("Score: " + str (self.score), 18, WINDOWHEIGHT / 2)
+        self.draw_screen_text ("Play again? Press <R>.", 18, WINDOWHEIGHT / 2 + 50)
 
         pygame.draw.lines (self.screen, RED, True,
                            [(0, 0), (WINDOWWIDTH, 0), (WINDOWWIDTH, WINDOWHEIGHT), (0, WINDOWHEIGHT)], 5)
 
-        pygame.display.update ()
+        self.present ()
 
 
     def toggle_sound(self):
@@ -496,32 +1650,42 @@ class AsteroidsGame():
             self.sound_on=True
         else:
             self.sound_on=False
+        self.audio.enabled = self.sound_on
 
     def toggle_music(self):
-        if self.music_on==False:
+        if self.headless or not pygame.mixer.get_init (): # nothing to play on
+            self.music_on = not self.music_on
+        elif self.music_on==False:
             self.music_on=True
-            pygame.mixer.music.load ('media/base.wav')
+            pygame.mixer.music.load (assets.music ())
             pygame.mixer.music.play (-1)
         else:
             self.music_on=False
             pygame.mixer.music.stop()
 
 class Asteroid():
-    def __init__(self, x_pos=None, y_pos=None, size=None, color=None, x_speed=None, y_speed=None):
+    __slots__ = ('x_pos', 'y_pos', 'size', 'color', 'x_speed', 'y_speed', 'image', 'angle', 'angle_speed', 'slot')
+
+    def __init__(self, *args, **kwargs):
+        self.reset (*args, **kwargs)
+
+    # (re-)initialize, pooled asteroids are reset instead of newly created
+    def reset(self, x_pos=None, y_pos=None, size=None, color=None, x_speed=None, y_speed=None, angle=0,
+              angle_speed=None, rng=random):
         if x_pos==None:
-            self.x_pos = random.randint (0, WINDOWWIDTH)
+            self.x_pos = rng.randint (0, WINDOWWIDTH)
         else:
             self.x_pos = x_pos
         if y_pos == None:
             if color==WHITE: # this is a background star (therefore place it anywhere)
-                self.y_pos = random.randint (0, WINDOWHEIGHT)
+                self.y_pos = rng.randint (0, WINDOWHEIGHT)
             else: #this is an asteroid (avoid placing on top of ship)
-                self.y_pos = random.choice([random.randint (0, WINDOWHEIGHT/2-100), random.randint (WINDOWHEIGHT/2+100, WINDOWHEIGHT)])
+                self.y_pos = rng.choice([rng.randint (0, WINDOWHEIGHT//2-100), rng.randint (WINDOWHEIGHT//2+100, WINDOWHEIGHT)])
         else:
             self.y_pos = y_pos
         if size == None:
             #self.size = random.randint(4, 8)  # 1-5
-            self.size = random.choice ([8, 16, 32])
+            self.size = rng.choice ([8, 16, 32])
             #self.size = 32
         else:
             self.size = size
@@ -532,12 +1696,12 @@ class Asteroid():
             self.color = color
         if x_speed==None:
             #self.x_speed = 0
-            self.x_speed = random.randint (-3, 3)
+            self.x_speed = rng.randint (-3, 3)
         else:
             self.x_speed = x_speed
         if y_speed==None:
             #self.y_speed = 0
-            self.y_speed = random.randint (-3, 3)
+            self.y_speed = rng.randint (-3, 3)
         else:
             self.y_speed = y_speed
 
@@ -545,18 +1709,22 @@ class Asteroid():
         self.image = None
         self.change_image()
 
-        self.angle = 0
-        self.angle_speed = random.randint(1, 5)
+        self.angle = angle
+        if angle_speed == None:
+            self.angle_speed = rng.randint(1, 5)
+        else:
+            self.angle_speed = angle_speed
 
     def change_image (self):
         if self.size == 32:
-            self.image = img_a2
+            self.image = assets.image ("a2")
         elif self.size == 16:
-            self.image = img_a1
+            self.image = assets.image ("a1")
         else:
-            self.image = img_a0
+            self.image = assets.image ("a0")
 
-    def update(self, ship_x_speed=None, ship_y_speed=None):
+    # width and height of the world, objects wrap around at its edges
+    def update(self, ship_x_speed=None, ship_y_speed=None, width=WINDOWWIDTH, height=WINDOWHEIGHT):
         if not ship_x_speed == None: #speeds are modified given a collision
             self.x_speed = -ship_x_speed
             self.y_speed = -ship_y_speed
@@ -566,37 +1734,42 @@ class Asteroid():
 
         # leaving screen left
         if self.x_pos < -self.size:
-            self.x_pos = WINDOWWIDTH
+            self.x_pos = width
         # leaving screen right
-        if self.x_pos > WINDOWWIDTH:
+        if self.x_pos > width:
             self.x_pos = 0
         # leaving screen top
         if self.y_pos < -self.size :
-            self.y_pos = WINDOWHEIGHT
+            self.y_pos = height
         # leaving screen bottom
-        if self.y_pos > WINDOWHEIGHT:
+        if self.y_pos > height:
             self.y_pos = 0
 
         #update rotation angel
-        self.angle += self.angle_speed
+        self.angle = (self.angle + self.angle_speed) % 360
 
 
 class SpaceShip():
+    __slots__ = ('x_pos', 'y_pos', 'x_speed', 'y_speed', 'angle', 'boost', 'is_turning_left', 'is_turning_right',
+                 'ship_image', 'has_been_hit', 'hit_time', 'laser_shots', 'size', 'x_move', 'y_move')
+
     def __init__(self):
         self.x_pos = WINDOWWIDTH / 2
         self.y_pos = WINDOWHEIGHT / 2
         self.x_speed = 0
         self.y_speed = 0
+        self.x_move = 0 # distance moved in the last update (the speed changes afterwards)
+        self.y_move = 0
 
         self.angle = 0
         self.boost = False
         self.is_turning_left = False
         self.is_turning_right = False
 
-        self.ship_image = ship
+        self.ship_image = assets.image ("ship")
 
         self.has_been_hit = False
-        self.hit_time = time.time()
+        self.hit_time = 0
 
         self.laser_shots = []
 
@@ -619,35 +1792,37 @@ class SpaceShip():
         self.is_turning_left = False
         self.is_turning_right = False
 
-    def update(self):
-        # reset hit timer (ship can be hit again by asteroids)
-        if self.hit_time + 1 < time.time():
+    def update(self, now, width=WINDOWWIDTH, height=WINDOWHEIGHT):
+        # reset hit timer (ship can be hit again by asteroids), now is the game time in seconds
+        if self.hit_time + HIT_TIMEOUT < now:
             self.has_been_hit = False
 
         # update ship image
         if self.boost:
-            self.ship_image = ship_boost
+            self.ship_image = assets.image ("ship_boost")
         else:
-            self.ship_image = ship
+            self.ship_image = assets.image ("ship")
         if self.has_been_hit:
-            self.ship_image = ship_hit
+            self.ship_image = assets.image ("ship_hit")
             self.boost = False
 
         #  position
+        self.x_move = self.x_speed
+        self.y_move = -self.y_speed
         self.x_pos += self.x_speed
         self.y_pos -= self.y_speed
 
         # leaving screen left
         if self.x_pos < -10:
-            self.x_pos = WINDOWWIDTH
+            self.x_pos = width
         # leaving screen right
-        if self.x_pos > WINDOWWIDTH:
+        if self.x_pos > width:
             self.x_pos = 0
         # leaving screen top
         if self.y_pos < -10:
-            self.y_pos = WINDOWHEIGHT
+            self.y_pos = height
         # leaving screen bottom
-        if self.y_pos > WINDOWHEIGHT:
+        if self.y_pos > height:
             self.y_pos = 0
 
         # update angle
@@ -675,13 +1850,20 @@ class SpaceShip():
 
 
 class Laser():
-    def __init__(self, x_pos, y_pos, angle, ship_x_speed, ship_y_speed):
+    __slots__ = ('x_pos', 'y_pos', 'angle', 'color', 'life', 'laser_speed', 'ship_x_speed', 'ship_y_speed',
+                 'x_end_pos', 'y_end_pos', 'x_move', 'y_move', 'slot')
+
+    def __init__(self, *args):
+        self.reset (*args)
+
+    # (re-)initialize, pooled lasers are reset instead of newly created
+    def reset(self, x_pos, y_pos, angle, ship_x_speed, ship_y_speed, life=LASER_LIFE, laser_speed=LASER_SPEED):
         self.x_pos = x_pos
         self.y_pos = y_pos
         self.angle = angle
         self.color = BLUE
-        self.life = 100 #number of frames the laser will be visible
-        self.laser_speed = 15
+        self.life = life #number of frames the laser will be visible
+        self.laser_speed = laser_speed
 
         self.ship_x_speed = ship_x_speed
         self.ship_y_speed = ship_y_speed
@@ -692,17 +1874,1412 @@ class Laser():
         self.x_end_pos = x_pos + x_incr * 10
         self.y_end_pos = y_pos - y_incr * 10
 
+        # distance moved per step, doesn't change during the laser's life
+        self.x_move = (x_incr + ship_x_speed/10) * laser_speed
+        self.y_move = -(y_incr + ship_y_speed/10) * laser_speed
+
     def update_laser(self):
         self.life -= 1
 
-        rad_angle = (self.angle / 180) * math.pi
-        x_incr = -math.sin (rad_angle) + self.ship_x_speed/10
-        y_incr = math.cos (rad_angle) + self.ship_y_speed/10
-        self.x_pos = self.x_pos + x_incr * self.laser_speed
-        self.y_pos = self.y_pos - y_incr * self.laser_speed
-        self.x_end_pos = self.x_end_pos + x_incr * self.laser_speed
-        self.y_end_pos = self.y_end_pos - y_incr * self.laser_speed
+        self.x_pos = self.x_pos + self.x_move
+        self.y_pos = self.y_pos + self.y_move
+        self.x_end_pos = self.x_end_pos + self.x_move
+        self.y_end_pos = self.y_end_pos + self.y_move
+
+
+# Sprites rotated once into quantized angles (every `step` degrees) together with the
+# offset from the sprite center to the top left corner of the rotated surface.
+# Images that would not fit into the memory budget are rotated with a coarser step (one
+# that divides 360, up to 90 degrees), or not cached at all and rotated on the fly (counted
+# as misses).
+class RotationCache():
+    def __init__(self, step=3, budget=32*1024*1024):
+        self.step = step
+        self.budget = budget
+        self.bytes_used = 0
+        self.entries = {} # image -> (step, list of (surface, offset))
+        self.hits = 0
+        self.misses = 0
+
+    def _rotate(self, image, angle):
+        rotated = pygame.transform.rotate (image, angle)
+        width, height = rotated.get_size ()
+        return rotated, (-(width // 2), -(height // 2))
+
+    def add(self, image):
+        if self.step <= 0 or image in self.entries:
+            return
+        step = self.step
+        while step <= 90:
+            frames = [self._rotate (image, angle) for angle in range (0, 360, step)]
+            size = sum (surf.get_height () * surf.get_pitch () for surf, offset in frames)
+            if self.bytes_used + size <= self.budget:
+                self.entries[image] = (step, frames)
+                self.bytes_used += size
+                return
+            # the next coarser step that still divides 360, so that the frames are evenly spaced all around
+            step = next (coarser for coarser in range (2 * step, 361) if 360 % coarser == 0)
+
+    # use frames rotated elsewhere, e.g. loaded from the asset cache
+    def put(self, image, step, frames):
+        self.entries[image] = (step, frames)
+        self.bytes_used += sum (surf.get_height () * surf.get_pitch () for surf, offset in frames)
+
+    def get(self, image, angle):
+        entry = self.entries.get (image)
+        if entry is None:
+            self.misses += 1
+            return self._rotate (image, angle)
+        self.hits += 1
+        step, frames = entry
+        return frames[int (round (angle % 360 / step)) % len (frames)]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"images": len (self.entries),
+                "bytes": self.bytes_used,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+# Collision masks of sprites rotated into quantized angles (every `step` degrees), each with the
+# offset from the sprite center to its top left corner like in RotationCache. They are built the
+# first time an image is tested at an angle and kept, and don't depend on the render settings or
+# a display (the simulation needs them). Per image the radius of the smallest circle around the
+# center that holds all of its pixels at any rotation is used for the broad phase.
+class MaskCache():
+    def __init__(self, step=3):
+        self.step = step
+        self.entries = {} # image -> (radius, list of (mask, offset) per angle, None until needed)
+        self.radii = {} # image -> radius, for quick lookups
+
+    def entry(self, image):
+        entry = self.entries.get (image)
+        if entry is None:
+            mask = pygame.mask.from_surface (image)
+            width, height = image.get_size ()
+            radius = max ((math.hypot (x + 0.5 - width / 2, y + 0.5 - height / 2)
+                           for y in range (height) for x in range (width) if mask.get_at ((x, y))), default=0)
+            # plus the rounding of rotated pixels
+            entry = (radius + 1.5, [None] * len (range (0, 360, self.step)))
+            self.entries[image] = entry
+            self.radii[image] = entry[0]
+        return entry
+
+    def radius(self, image):
+        return self.entry (image)[0]
+
+    def get(self, image, angle):
+        frames = self.entry (image)[1]
+        index = int (round (angle % 360 / self.step)) % len (frames)
+        frame = frames[index]
+        if frame is None:
+            rotated = pygame.transform.rotate (image, index * self.step)
+            width, height = rotated.get_size ()
+            frame = (pygame.mask.from_surface (rotated), (-(width // 2), -(height // 2)))
+            frames[index] = frame
+        return frame
+
+
+collision_masks = MaskCache ()
+
+
+# Struct-of-arrays storage for the array backed world (see AsteroidsGame.array_world).
+# Every entity owns one slot, removed entities are swap-removed so that the first
+# self.count entries are always the live ones and can be updated in one go.
+class EntityArrays():
+    fields = ()
+
+    def __init__(self, capacity=64):
+        self.count = 0
+        self.views = [] # view objects by slot, needed to fix up the index after a swap-remove
+        for name in self.fields:
+            setattr (self, name, np.zeros (capacity))
+
+    def add(self, view):
+        if self.count == len (getattr (self, self.fields[0])):
+            self._grow ()
+        index = self.count
+        self.views.append (view)
+        self.count += 1
+        return index
+
+    def remove(self, view):
+        index = view.index
+        last = self.count - 1
+        if index != last:
+            for name in self.fields:
+                array = getattr (self, name)
+                array[index] = array[last]
+            moved = self.views[last]
+            moved.index = index
+            self.views[index] = moved
+        self.views.pop ()
+        self.count -= 1
+        view.index = None
+
+    def shift_x(self, delta):
+        self.x_pos[:self.count] += delta
+
+    def _grow(self):
+        for name in self.fields:
+            array = getattr (self, name)
+            bigger = np.zeros (max (2 * len (array), 16))
+            bigger[:len (array)] = array
+            setattr (self, name, bigger)
+
+
+class AsteroidArrays(EntityArrays):
+    fields = ('x_pos', 'y_pos', 'x_speed', 'y_speed', 'size', 'angle', 'angle_speed')
+
+    def __init__(self, capacity=64, width=WINDOWWIDTH, height=WINDOWHEIGHT):
+        EntityArrays.__init__ (self, capacity)
+        self.width = width
+        self.height = height
+
+    # vectorized version of Asteroid.update
+    def update(self, ship_x_speed=None, ship_y_speed=None):
+        n = self.count
+        x_pos = self.x_pos[:n]
+        y_pos = self.y_pos[:n]
+        size = self.size[:n]
+
+        if not ship_x_speed == None: #speeds are modified given a collision
+            self.x_speed[:n] = -ship_x_speed
+            self.y_speed[:n] = -ship_y_speed
+
+        x_pos += self.x_speed[:n]
+        y_pos -= self.y_speed[:n]
+
+        # wrap around screen edges (same order as in Asteroid.update)
+        x_pos[x_pos < -size] = self.width
+        x_pos[x_pos > self.width] = 0
+        y_pos[y_pos < -size] = self.height
+        y_pos[y_pos > self.height] = 0
+
+        self.angle[:n] += self.angle_speed[:n]
+        self.angle[:n] %= 360
 
 
+class LaserArrays(EntityArrays):
+    fields = ('x_pos', 'y_pos', 'x_end_pos', 'y_end_pos', 'angle', 'life', 'laser_speed',
+              'ship_x_speed', 'ship_y_speed', 'x_move', 'y_move')
+
+    # vectorized version of Laser.update_laser
+    def update_laser(self):
+        n = self.count
+        self.life[:n] -= 1
+        self.x_pos[:n] += self.x_move[:n]
+        self.y_pos[:n] += self.y_move[:n]
+        self.x_end_pos[:n] += self.x_move[:n]
+        self.y_end_pos[:n] += self.y_move[:n]
+
+    # the fields the collision checks read of every laser, as lists per array slot
+    def sweeps(self):
+        n = self.count
+        return tuple (getattr (self, name)[:n].tolist () for name in ('x_pos', 'y_pos', 'x_end_pos', 'y_end_pos', 'life',
+                                                                       'x_move', 'y_move'))
+
+
+# attribute of a view object that lives in the arrays of its store
+def array_field(name):
+    def get(self):
+        return getattr (self.store, name).item (self.index)
+
+    def set(self, value):
+        getattr (self.store, name)[self.index] = value
+
+    return property (get, set)
+
+
+# Asteroid whose numeric attributes are stored in an AsteroidArrays instance
+class ArrayAsteroid(Asteroid):
+    x_pos = array_field ('x_pos')
+    y_pos = array_field ('y_pos')
+    x_speed = array_field ('x_speed')
+    y_speed = array_field ('y_speed')
+    size = array_field ('size')
+    angle = array_field ('angle')
+    angle_speed = array_field ('angle_speed')
+
+    __slots__ = ('store', 'index')
+
+    def reset(self, store, **kwargs):
+        self.store = store
+        self.index = store.add (self)
+        Asteroid.reset (self, **kwargs)
+
+
+# Laser whose numeric attributes are stored in a LaserArrays instance
+class ArrayLaser(Laser):
+    x_pos = array_field ('x_pos')
+    y_pos = array_field ('y_pos')
+    x_end_pos = array_field ('x_end_pos')
+    y_end_pos = array_field ('y_end_pos')
+    angle = array_field ('angle')
+    life = array_field ('life')
+    laser_speed = array_field ('laser_speed')
+    ship_x_speed = array_field ('ship_x_speed')
+    ship_y_speed = array_field ('ship_y_speed')
+    x_move = array_field ('x_move')
+    y_move = array_field ('y_move')
+
+    __slots__ = ('store', 'index')
+
+    def reset(self, store, *args):
+        self.store = store
+        self.index = store.add (self)
+        Laser.reset (self, *args)
+
+
+# Free list of entity objects. Released objects are handed out again by acquire() and
+# have to be (re-)initialized with their reset() method. Starts with `capacity` objects
+# and only allocates new ones when all of them are in use.
+class ObjectPool():
+    def __init__(self, cls, capacity):
+        self.cls = cls
+        self.free = [cls.__new__ (cls) for i in range (capacity)]
+        self.allocated = capacity
+
+    def acquire(self):
+        if self.free:
+            return self.free.pop ()
+        self.allocated += 1
+        return self.cls.__new__ (self.cls)
+
+    def release(self, obj):
+        self.free.append (obj)
+
+
+slot_of = attrgetter ('slot')
+
+# remove obj from items in O(1) by moving the last item into its slot (items have to keep their slot up to date)
+def swap_remove(items, obj):
+    last = items.pop ()
+    if last is not obj:
+        items[obj.slot] = last
+        last.slot = obj.slot
+
+
+# whether the segment from (x_end - x_sweep, y_end - y_sweep) to (x_end, y_end) comes
+# closer than radius to (x_center, y_center)
+def segment_hits_circle(x_end, y_end, x_sweep, y_sweep, x_center, y_center, radius):
+    # center relative to the start of the segment
+    x_dist = x_center - x_end + x_sweep
+    y_dist = y_center - y_end + y_sweep
+    length = x_sweep * x_sweep + y_sweep * y_sweep
+    t = (x_dist * x_sweep + y_dist * y_sweep) / length if length else 0.0
+    if t < 0.0:
+        t = 0.0
+    elif t > 1.0:
+        t = 1.0
+    x_dist -= t * x_sweep
+    y_dist -= t * y_sweep
+    return x_dist * x_dist + y_dist * y_dist < radius * radius
+
+
+# Text rendering with fonts loaded once and rendered strings cached by (size, text, color).
+# HUD lines are composed into one surface which is only rebuilt when a line changes.
+class Hud():
+    def __init__(self, font_name="Serif", max_cached_texts=256):
+        pygame.font.init ()
+        self.font_name = font_name
+        self.fonts = {} # size -> font
+        self.texts = {} # (size, text, color) -> rendered surface
+        self.max_cached_texts = max_cached_texts
+        self.lines = {} # name -> (text, color, pos, size)
+        self.surface = None
+        self.pos = (0, 0)
+        self.changed = True
+
+    def font(self, size):
+        font = self.fonts.get (size)
+        if font is None:
+            font = pygame.font.SysFont (self.font_name, size)
+            self.fonts[size] = font
+        return font
+
+    def render_text(self, text, color, size=18):
+        key = (size, text, color)
+        surface = self.texts.get (key)
+        if surface is None:
+            if len (self.texts) >= self.max_cached_texts: # e.g. many different scores
+                self.texts = {}
+            surface = self.font (size).render (text, True, color)
+            self.texts[key] = surface
+        return surface
+
+    def set_line(self, name, text, color, pos, size=18):
+        line = (text, color, pos, size)
+        if self.lines.get (name) != line:
+            self.lines[name] = line
+            self.changed = True
+
+    def compose(self):
+        rendered = [(self.render_text (text, color, size), pos) for text, color, pos, size in self.lines.values ()]
+        rect = rendered[0][0].get_rect (topleft=rendered[0][1])
+        rect.unionall_ip ([surf.get_rect (topleft=pos) for surf, pos in rendered[1:]])
+
+        self.surface = pygame.Surface (rect.size, pygame.SRCALPHA)
+        for surf, (x_pos, y_pos) in rendered:
+            self.surface.blit (surf, (x_pos - rect.x, y_pos - rect.y))
+        self.pos = rect.topleft
+        self.changed = False
+
+    def draw(self, screen):
+        if not self.lines:
+            return None
+        if self.changed:
+            self.compose ()
+        return screen.blit (self.surface, self.pos)
+
+
+# Plays the sound events of the simulation. emit() only counts the events of the current
+# frame, flush() hands them to a background thread which plays every sound at most once
+# per frame (a bit louder when it was emitted several times), keeps the number of voices
+# per sound within its limit and takes the channel of a less important sound when all
+# channels are busy. Without sounds (headless, no audio device) everything is a no-op.
+class AudioScheduler():
+    # name -> (priority, max voices, volume)
+    sound_settings = {"explosion": (3, 1, 1.0),
+                      "rocket": (2, 1, 0.8),
+                      "crack": (1, 3, 0.7),
+                      "laser": (0, 3, 0.6)}
+    channels = 8
+
+    def __init__(self, sounds):
+        self.sounds = sounds
+        self.enabled = sounds is not None
+        self.pending = {} # name -> number of events in the current frame
+        self.played = 0
+        self.merged = 0
+        self.dropped = 0
+        self.queue = None
+        self.thread = None
+        if sounds is not None:
+            pygame.mixer.set_num_channels (self.channels)
+            self.voices = [] # (channel, name) started by us, oldest first
+            self.queue = queue.Queue ()
+            self.thread = threading.Thread (target=self.run, name="audio", daemon=True)
+            self.thread.start ()
+
+    def emit(self, name):
+        if self.enabled:
+            self.pending[name] = self.pending.get (name, 0) + 1
+
+    def flush(self):
+        if self.pending:
+            if self.queue is not None:
+                self.queue.put (self.pending)
+            self.pending = {}
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put (None)
+            self.thread.join (1)
+            self.thread = None
+
+    def run(self):
+        while True:
+            frame = self.queue.get ()
+            if frame is None:
+                return
+            # most important sounds first, they may take channels from the others
+            for name in sorted (frame, key=lambda name: -self.sound_settings[name][0]):
+                self.merged += frame[name] - 1
+                self.play (name, frame[name])
+
+    def play(self, name, count):
+        priority, max_voices, volume = self.sound_settings[name]
+        self.voices = [(channel, voice) for channel, voice in self.voices if channel.get_busy ()]
+        if sum (1 for channel, voice in self.voices if voice == name) >= max_voices:
+            self.dropped += 1
+            return
+
+        channel = pygame.mixer.find_channel ()
+        if channel is None:
+            # steal the oldest voice of the least important sound below this one
+            victims = [(self.sound_settings[voice][0], i) for i, (channel, voice) in enumerate (self.voices)
+                       if self.sound_settings[voice][0] < priority]
+            if not victims:
+                self.dropped += 1
+                return
+            channel = self.voices.pop (min (victims)[1])[0]
+            channel.stop ()
+
+        channel.set_volume (min (1.0, volume * (1 + 0.25 * math.log2 (count))))
+        channel.play (self.sounds[name])
+        self.voices.append ((channel, name))
+        self.played += 1
+
+
+# Records the presented frames to the directory `path` in a background thread. The game
+# thread only copies the pixels of the screen into one of `buffers` preallocated frames (one
+# memcpy through the surface's buffer, no conversion, no allocation) and queues it, the writer
+# thread stores it and hands the buffer back. When all buffers are still waiting to be written
+# the frame is dropped instead, so a slow disk never stalls the game.
+# Formats: "raw" appends the pixels as they are in memory to frames.raw (layout in capture.json,
+# e.g. for ffmpeg -f rawvideo -pixel_format bgr0), "png" writes frame_000000.png, ... (encoded with
+# zlib, which unlike pygame.image.save lets the game thread run meanwhile). frames.csv has the
+# number of each written frame (gaps are dropped frames), the step it shows and its time in seconds
+# since the first frame. capture.json also gets the frame counts and the time spent on both threads.
+class FrameCapture():
+    formats = ("raw", "png")
+
+    def __init__(self, path, surface, format="raw", buffers=8):
+        if format not in self.formats:
+            raise ValueError ("unknown capture format %r" % format)
+        self.path = path
+        self.format = format
+        self.size = surface.get_size ()
+        self.pitch = surface.get_pitch ()
+        self.bytesize = surface.get_bytesize ()
+        self.channels = self.channel_order (surface)
+        if format == "png" and not set ("rgb") <= set (self.channels):
+            raise ValueError ("can't write %d bit surfaces as png" % surface.get_bitsize ())
+        os.makedirs (path, exist_ok=True)
+
+        self.frames = 0 # presented frames, including the dropped ones
+        self.written = 0
+        self.dropped = 0
+        self.grab_time = 0.0 # on the game thread
+        self.max_grab_time = 0.0
+        self.write_time = 0.0 # on the writer thread
+        self.error = None # first error of the writer, frames are only recycled after it
+        self.start = None
+
+        # all buffers are in `free` or on their way through `filled`, so puts never block
+        self.free = queue.Queue ()
+        for i in range (buffers):
+            self.free.put (bytearray (self.pitch * self.size[1]))
+        self.filled = queue.Queue ()
+        self.index = open (os.path.join (path, "frames.csv"), "w")
+        self.index.write ("frame,step,time_s\n")
+        self.stream = open (os.path.join (path, "frames.raw"), "wb") if format == "raw" else None
+        self.thread = threading.Thread (target=self.run, name="capture", daemon=True)
+        self.thread.start ()
+
+    # bytes of a pixel in memory order, "r", "g", "b", "a" or "0" (unused), like "bgr0"
+    @staticmethod
+    def channel_order(surface):
+        masks = dict (zip ("rgba", surface.get_masks ()))
+        order = ""
+        for i in range (surface.get_bytesize ()):
+            shift = 8 * i if sys.byteorder == "little" else 8 * (surface.get_bytesize () - 1 - i)
+            order += next ((name for name, mask in masks.items () if mask == 0xff << shift), "0")
+        return order
+
+    # called on the game thread after the frame was presented
+    def grab(self, surface, step):
+        start = time.perf_counter ()
+        if self.start is None:
+            self.start = start
+        frame = self.frames
+        self.frames += 1
+        try:
+            buffer = self.free.get_nowait ()
+        except queue.Empty:
+            self.dropped += 1
+        else:
+            pixels = surface.get_buffer () # locks the surface until released
+            memoryview (buffer)[:] = pixels
+            del pixels
+            self.filled.put ((buffer, frame, step, start - self.start))
+        elapsed = time.perf_counter () - start
+        self.grab_time += elapsed
+        self.max_grab_time = max (self.max_grab_time, elapsed)
+        return elapsed
+
+    def run(self):
+        while True:
+            item = self.filled.get ()
+            if item is None:
+                return
+            buffer, frame, step, seconds = item
+            if self.error is None:
+                start = time.perf_counter ()
+                try:
+                    if self.stream is not None:
+                        self.stream.write (buffer)
+                    else:
+                        self.write_png (os.path.join (self.path, "frame_%06d.png" % frame), buffer)
+                    self.index.write ("%d,%d,%.6f\n" % (frame, step, seconds))
+                    self.written += 1
+                except OSError as error:
+                    self.error = error
+                self.write_time += time.perf_counter () - start
+            self.free.put (buffer)
+
+    # 8 bit RGB, no filtering, zlib level 1 (fast, the frames are mostly black anyway)
+    def write_png(self, path, buffer):
+        width, height = self.size
+        row_bytes = 3 * width + 1
+        raw = bytearray (row_bytes * height) # the first byte of each row is its filter type (0)
+        source = memoryview (buffer)
+        for y_pos in range (height):
+            row = source[y_pos * self.pitch:y_pos * self.pitch + width * self.bytesize]
+            start = y_pos * row_bytes + 1
+            for channel, name in enumerate ("rgb"):
+                raw[start + channel:start + row_bytes - 1:3] = row[self.channels.index (name)::self.bytesize]
+        def chunk(kind, data):
+            return struct.pack (">I", len (data)) + kind + data + struct.pack (">I", zlib.crc32 (kind + data))
+        with open (path, "wb") as f:
+            f.write (b"\x89PNG\r\n\x1a\n" + chunk (b"IHDR", struct.pack (">IIBBBBB", width, height, 8, 2, 0, 0, 0)) +
+                     chunk (b"IDAT", zlib.compress (raw, 1)) + chunk (b"IEND", b""))
+
+    def stats(self):
+        grabbed = max (1, self.frames - self.dropped)
+        return {"frames": self.frames,
+                "written": self.written,
+                "dropped": self.dropped,
+                "grab_mean_ms": 1000 * self.grab_time / max (1, self.frames),
+                "grab_max_ms": 1000 * self.max_grab_time,
+                "write_mean_ms": 1000 * self.write_time / grabbed,
+                "error": None if self.error is None else str (self.error)}
+
+    # waits for the queued frames to be written and adds the layout and stats to capture.json
+    def close(self):
+        if self.thread is None:
+            return self.stats ()
+        self.filled.put (None)
+        self.thread.join ()
+        self.thread = None
+        self.index.close ()
+        if self.stream is not None:
+            self.stream.close ()
+        stats = self.stats ()
+        info = {"format": self.format, "width": self.size[0], "height": self.size[1], "pitch": self.pitch,
+                "pixel_format": self.channels + ("24" if self.bytesize == 3 else ""), "tick_rate": TICK_RATE}
+        info.update (stats)
+        with open (os.path.join (self.path, "capture.json"), "w") as f:
+            json.dump (info, f, indent=1)
+        return stats
+
+
+# Background stars, drawn once into a tile per parallax layer. Moving the stars only moves
+# the offset the tile is blitted at (wrapping around), so the cost doesn't depend on the
+# number of stars. Deeper layers move slower and are drawn dimmer.
+class Starfield():
+    def __init__(self, star_count=100, layers=1, width=WINDOWWIDTH, height=WINDOWHEIGHT, rng=random):
+        self.width = width
+        self.height = height
+        self.stars = [] # per layer: list of star positions on the tile
+        self.parallax = [] # per layer: fraction of the ship speed the layer moves with
+        self.offsets = [] # per layer: [x, y] position of the tile
+        for layer in range (layers):
+            count = star_count // layers + (1 if layer < star_count % layers else 0)
+            self.stars.append ([(rng.randint (0, width - 1), rng.randint (0, height - 1)) for i in range (count)])
+            self.parallax.append (0.5 ** layer)
+            self.offsets.append ([0.0, 0.0])
+        self.tiles = None
+
+    # same movement as the former star objects: against the ship's direction
+    def update(self, ship_x_speed, ship_y_speed):
+        for parallax, offset in zip (self.parallax, self.offsets):
+            offset[0] = (offset[0] - ship_x_speed * parallax) % self.width
+            offset[1] = (offset[1] + ship_y_speed * parallax) % self.height
+
+    def shift_x(self, delta):
+        for offset in self.offsets:
+            offset[0] = (offset[0] + delta) % self.width
+
+    # changes whenever the drawn starfield changes
+    def key(self):
+        return [(int (x_offset), int (y_offset)) for x_offset, y_offset in self.offsets]
+
+    def render_tiles(self):
+        self.tiles = []
+        for layer, stars in enumerate (self.stars):
+            tile = pygame.Surface ((self.width, self.height))
+            tile.fill (BLACK)
+            if layer > 0: # deeper layers are drawn on top of the first one
+                tile.set_colorkey (BLACK)
+            brightness = int (255 * self.parallax[layer] ** 0.5)
+            color = (brightness, brightness, brightness)
+            for star in stars:
+                tile.set_at (star, color)
+            self.tiles.append (tile)
+
+    def draw(self, surface):
+        if self.tiles is None:
+            self.render_tiles ()
+        for tile, (x_offset, y_offset) in zip (self.tiles, self.offsets):
+            x_pos = int (x_offset)
+            y_pos = int (y_offset)
+            # the tile wraps around, so it has to be blitted up to four times
+            surface.blit (tile, (x_pos, y_pos))
+            surface.blit (tile, (x_pos - self.width, y_pos))
+            surface.blit (tile, (x_pos, y_pos - self.height))
+            surface.blit (tile, (x_pos - self.width, y_pos - self.height))
+
+
+# Short lived particles (explosions, asteroid debris, laser sparks, thruster exhaust) in
+# preallocated numpy arrays, moved and culled in one vectorized update per step and drawn by
+# writing all their pixels into the screen at once. They are only for show: they have their
+# own random generator and aren't part of the game state. Particles emitted while `capacity`
+# are alive are dropped.
+class ParticleSystem():
+    # name -> (colors from new to old, life in steps (min, max), speed (min, max), drag per step, size in pixels)
+    kinds = {"explosion": (((255, 255, 200), (255, 200, 60), (230, 110, 20), (150, 40, 10), (60, 20, 10)), (10, 30), (1.0, 6.0), 0.92, 2),
+             "debris": (((200, 190, 180), (160, 140, 120), (110, 90, 70), (60, 50, 40)), (15, 40), (0.5, 3.0), 0.97, 1),
+             "spark": (((255, 255, 255), (150, 200, 255), (40, 80, 255)), (4, 10), (2.0, 7.0), 0.85, 1),
+             "exhaust": (((255, 240, 150), (255, 150, 40), (180, 60, 20), (80, 30, 20)), (5, 12), (2.0, 4.0), 0.9, 1)}
+    palette_steps = 8 # colors per kind, by age
+    cell_size = 32 # areas reported for dirty rect rendering
+
+    def __init__(self, capacity=20000, seed=None):
+        self.capacity = capacity
+        self.count = 0
+        self.dropped = 0
+        self.rng = np.random.default_rng (seed)
+        self.x_pos = np.zeros (capacity, dtype=np.float32)
+        self.y_pos = np.zeros (capacity, dtype=np.float32)
+        self.x_speed = np.zeros (capacity, dtype=np.float32) # screen direction, y downwards
+        self.y_speed = np.zeros (capacity, dtype=np.float32)
+        self.drag = np.zeros (capacity, dtype=np.float32)
+        self.life = np.zeros (capacity, dtype=np.int16)
+        self.max_life = np.zeros (capacity, dtype=np.int16)
+        self.kind = np.zeros (capacity, dtype=np.uint8)
+        self.arrays = (self.x_pos, self.y_pos, self.x_speed, self.y_speed, self.drag, self.life, self.max_life, self.kind)
+
+        self.names = list (self.kinds)
+        self.large = np.array ([self.kinds[name][4] > 1 for name in self.names])
+        self.palettes = {} # pixel format -> (kinds x palette_steps) mapped colors
+
+    def clear(self):
+        self.count = 0
+
+    # count particles at (x_pos, y_pos) flying into direction (radians, on screen) +- spread / 2,
+    # in all directions without one, on top of the speed of their source
+    def emit(self, name, x_pos, y_pos, count, x_speed=0.0, y_speed=0.0, direction=None, spread=0.0):
+        start = self.count
+        count = int (count)
+        if start + count > self.capacity:
+            self.dropped += start + count - self.capacity
+            count = self.capacity - start
+        if count <= 0:
+            return
+        colors, (min_life, max_life), (min_speed, max_speed), drag, size = self.kinds[name]
+        rng = self.rng
+        end = start + count
+        if direction is None:
+            angles = rng.uniform (0.0, 2 * math.pi, count)
+        else:
+            angles = rng.uniform (direction - spread / 2, direction + spread / 2, count)
+        speeds = rng.uniform (min_speed, max_speed, count)
+        self.x_pos[start:end] = x_pos
+        self.y_pos[start:end] = y_pos
+        self.x_speed[start:end] = np.cos (angles) * speeds + x_speed
+        self.y_speed[start:end] = np.sin (angles) * speeds + y_speed
+        self.drag[start:end] = drag
+        lifes = rng.integers (min_life, max_life + 1, count)
+        self.life[start:end] = lifes
+        self.max_life[start:end] = lifes
+        self.kind[start:end] = self.names.index (name)
+        self.count = end
+
+    def update(self):
+        count = self.count
+        if not count:
+            return
+        x_speed = self.x_speed[:count]
+        y_speed = self.y_speed[:count]
+        self.x_pos[:count] += x_speed
+        self.y_pos[:count] += y_speed
+        x_speed *= self.drag[:count]
+        y_speed *= self.drag[:count]
+        life = self.life[:count]
+        life -= 1
+        # move the living ones to the front, keeping their order
+        alive = life > 0
+        if not alive.all ():
+            keep = np.flatnonzero (alive)
+            for values in self.arrays:
+                values[:len (keep)] = values[keep]
+            self.count = len (keep)
+
+    # the screen shakes (see AsteroidsGame.shake_screen)
+    def shift_x(self, delta):
+        self.x_pos[:self.count] += delta
+
+    def palette(self, surface):
+        key = (surface.get_bitsize (), surface.get_masks ())
+        palette = self.palettes.get (key)
+        if palette is None:
+            steps = self.palette_steps
+            palette = np.zeros ((len (self.names), steps), dtype=np.int64)
+            for kind, name in enumerate (self.names):
+                colors = self.kinds[name][0]
+                for step in range (steps):
+                    palette[kind, step] = surface.map_rgb (colors[step * len (colors) // steps])
+            self.palettes[key] = palette
+        return palette
+
+    # draws the particles `back` of a step before their current position, in a big world
+    # relative to its view; with rects the areas drawn to are returned (cells of cell_size)
+    def draw(self, surface, back=0.0, world=None, rects=False):
+        count = self.count
+        if not count:
+            return []
+        x_pos = self.x_pos[:count]
+        y_pos = self.y_pos[:count]
+        if back:
+            x_pos = x_pos - self.x_speed[:count] * back
+            y_pos = y_pos - self.y_speed[:count] * back
+        if world is not None:
+            x_pos = (x_pos - world.x_view) % world.width
+            y_pos = (y_pos - world.y_view) % world.height
+        width, height = surface.get_size ()
+        x_pos = x_pos.astype (np.int32)
+        y_pos = y_pos.astype (np.int32)
+        # large particles are 2x2 pixels, so one pixel less room on the right and at the bottom
+        visible = (x_pos >= 0) & (x_pos < width - 1) & (y_pos >= 0) & (y_pos < height - 1)
+        x_pos = x_pos[visible]
+        y_pos = y_pos[visible]
+        kind = self.kind[:count][visible]
+        steps = self.palette_steps
+        age = steps - 1 - (self.life[:count][visible].astype (np.int32) * steps - 1) // self.max_life[:count][visible]
+        values = self.palette (surface)[kind, np.clip (age, 0, steps - 1)]
+
+        try:
+            pixels = pygame.surfarray.pixels2d (surface)
+        except ValueError: # 24 bit surfaces can't be accessed as integers
+            return []
+        pixels[x_pos, y_pos] = values
+        large = self.large[kind]
+        if large.any ():
+            x_large = x_pos[large]
+            y_large = y_pos[large]
+            values = values[large]
+            pixels[x_large + 1, y_large] = values
+            pixels[x_large, y_large + 1] = values
+            pixels[x_large + 1, y_large + 1] = values
+        del pixels
+
+        if not rects or not len (x_pos):
+            return []
+        size = self.cell_size
+        columns = width // size + 1
+        cells = np.unique ((y_pos // size) * columns + x_pos // size)
+        return [pygame.Rect (cell % columns * size, cell // columns * size, size + 1, size + 1) for cell in cells.tolist ()]
+
+
+# Renders only the parts of the screen that changed: the areas covered by objects and the
+# HUD in the previous frame are restored from a cached background with the stars, then
+# everything is drawn again and only the old and new areas are pushed to the display.
+# Falls back to a full redraw when the starfield moved and while the screen shakes.
+class DirtyRectRenderer():
+    def __init__(self, size):
+        self.background = pygame.Surface (size)
+        self.background_key = None
+        self.previous_rects = []
+        self.previous_hit = False
+
+    # force a full redraw in the next frame (e.g. after something else has been drawn to the screen)
+    def invalidate(self):
+        self.background_key = None
+
+    def render(self, game):
+        screen = game.screen
+        key = game.starfield.key ()
+        if key != self.background_key:
+            self.background.fill (BLACK)
+            game.draw_stars (self.background)
+            self.background_key = key
+            full = True
+        else:
+            # the hit frame covers the whole screen (and shaking moves everything)
+            full = game.myShip.has_been_hit or self.previous_hit
+
+        if full:
+            screen.blit (self.background, (0, 0))
+        else:
+            for rect in self.previous_rects:
+                screen.blit (self.background, rect, rect)
+
+        rects = game.draw_objects ()
+        hud_rect = game.draw_infos ()
+        if hud_rect is not None:
+            rects.append (hud_rect)
+        if game.myShip.has_been_hit:
+            game.draw_hit_frame ()
+            full = True
+        rects.extend (game.draw_overlays ())
+
+        changed = None if full else self.previous_rects + rects
+        self.previous_rects = rects
+        self.previous_hit = game.myShip.has_been_hit
+        return changed
+
+
+# Shows frames drawn at `size` on a display of another size, software scaled straight into the
+# display surface (pygame.SCALED does the same on the GPU). Modes:
+# - integer: scaled by the largest whole factor that fits, every pixel becomes a block of pixels
+#   (cheapest, and only the changed areas of a frame have to be scaled)
+# - fit: as big as fits, keeping the aspect ratio, same as integer if the factor is a whole number
+# - smooth: like fit, but filtered (smoothscale) instead of repeating pixels
+# The frame is centered, the rest of the display stays black.
+class ScaledDisplay():
+    modes = ("integer", "fit", "smooth")
+
+    def __init__(self, display, size, mode="fit"):
+        self.display = display
+        width, height = display.get_size ()
+        scale = min (width / size[0], height / size[1])
+        if mode == "integer" and scale >= 1:
+            scale = int (scale)
+        self.scale = scale
+        self.integer = scale == int (scale)
+        self.smooth = mode == "smooth" and not self.integer
+        scaled_size = (int (size[0] * scale), int (size[1] * scale))
+        self.rect = pygame.Rect (((width - scaled_size[0]) // 2, (height - scaled_size[1]) // 2), scaled_size)
+        self.target = display.subsurface (self.rect)
+        display.fill (BLACK)
+        self.shown = False # the black bars haven't been pushed to the display yet
+
+    # scales the frame (or only the given areas of it) into the display, returns the changed
+    # areas of the display (None for all of it)
+    def present(self, frame, rects=None):
+        if rects is None or not self.integer or not self.shown:
+            if self.scale == 1:
+                self.target.blit (frame, (0, 0))
+            elif self.smooth:
+                pygame.transform.smoothscale (frame, self.rect.size, self.target)
+            else:
+                pygame.transform.scale (frame, self.rect.size, self.target)
+            self.shown = True
+            return None
+
+        scale = int (self.scale)
+        bounds = frame.get_rect ()
+        scaled_rects = []
+        for rect in rects:
+            rect = rect.clip (bounds)
+            if not rect.width or not rect.height:
+                continue
+            target = pygame.Rect (self.rect.x + rect.x * scale, self.rect.y + rect.y * scale, rect.width * scale, rect.height * scale)
+            if scale == 1:
+                self.display.blit (frame, target, rect)
+            else:
+                pygame.transform.scale (frame.subsurface (rect), target.size, self.display.subsurface (target))
+            scaled_rects.append (target)
+        return scaled_rects
+
+
+# Snapshots of a game (see AsteroidsGame.state_sections) taken every `interval` ticks, the
+# newest ones that fit into max_bytes (Python object sizes included). A section equal to the
+# one of the previous snapshot is shared with it instead of copied, so the memory per snapshot
+# grows with what changed since the previous one, not with the size of the state.
+class SnapshotRing():
+    def __init__(self, interval=5, max_bytes=16*1024*1024):
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.snapshots = deque () # (ticks, sections), oldest first
+        self.refs = {} # id of a section -> [section, number of uses]
+        self.bytes_used = 0
+        self.push_times = deque (maxlen=256) # seconds per snapshot
+        self.push_bytes = deque (maxlen=256) # bytes added per snapshot
+
+    def clear(self):
+        while self.snapshots:
+            self.drop (self.snapshots.pop ())
+
+    def push(self, game):
+        start = time.perf_counter ()
+        previous = self.snapshots[-1][1] if self.snapshots else None
+        sections = game.state_sections (previous)
+        added = sys.getsizeof (sections)
+        refs = self.refs
+        for section in sections:
+            ref = refs.get (id (section))
+            if ref is None:
+                refs[id (section)] = [section, 1]
+                added += sys.getsizeof (section)
+            else:
+                ref[1] += 1
+        self.bytes_used += added
+        self.snapshots.append ((game.ticks, sections))
+        while self.bytes_used > self.max_bytes and self.snapshots:
+            self.drop (self.snapshots.popleft ())
+        self.push_times.append (time.perf_counter () - start)
+        self.push_bytes.append (added)
+
+    def drop(self, snapshot):
+        ticks, sections = snapshot
+        self.bytes_used -= sys.getsizeof (sections)
+        refs = self.refs
+        for section in sections:
+            ref = refs[id (section)]
+            ref[1] -= 1
+            if not ref[1]:
+                del refs[id (section)]
+                self.bytes_used -= sys.getsizeof (section)
+
+    # sections of the newest snapshot older than ticks (None if there is none), newer ones
+    # are dropped, the oldest snapshot is always kept
+    def rewind(self, ticks):
+        while len (self.snapshots) > 1 and self.snapshots[-1][0] >= ticks:
+            self.drop (self.snapshots.pop ())
+        if self.snapshots and self.snapshots[-1][0] < ticks:
+            return self.snapshots[-1][1]
+        return None
+
+    def stats(self):
+        pushes = max (1, len (self.push_times))
+        return {"snapshots": len (self.snapshots),
+                "bytes_used": self.bytes_used,
+                "max_bytes": self.max_bytes,
+                "push_mean_us": 1e6 * sum (self.push_times) / pushes,
+                "push_max_us": 1e6 * max (self.push_times, default=0.0),
+                "bytes_per_tick": sum (self.push_bytes) / pushes / self.interval}
+
+
+# Frame time profiler: sums up the time spent in each phase of a frame and keeps the
+# last `history` frames to compute rolling percentiles, plus a histogram of all frame times.
+# Can be drawn as an overlay and exported as CSV (one row per frame) or JSON (summary and frames).
+class FrameProfiler():
+    phases = ("events", "ship collision", "laser collision", "update objects", "snapshot", "draw stars",
+              "draw objects", "draw infos", "display update", "capture")
+    counters = ("mask tests", "particles") # counted per frame instead of timed
+    histogram_bounds = (2, 4, 8, 16, 25, 33, 50, 100) # upper bounds of the frame time buckets in ms
+
+    def __init__(self, history=600, overlay_interval=10):
+        self.current = dict.fromkeys (self.phases + self.counters, 0.0)
+        self.samples = dict ((name, deque (maxlen=history)) for name in self.phases + self.counters + ("frame",))
+        self.histogram = [0] * (len (self.histogram_bounds) + 1)
+        self.frames = 0
+        self.last_frame_end = None
+        self.overlay_interval = overlay_interval
+        self.overlay = None
+
+    def wrap(self, phase, method):
+        current = self.current
+        perf_counter = time.perf_counter
+        def timed(*args, **kwargs):
+            start = perf_counter ()
+            result = method (*args, **kwargs)
+            current[phase] += perf_counter () - start
+            return result
+        return timed
+
+    def add(self, phase, seconds):
+        self.current[phase] += seconds
+
+    def count(self, counter, value):
+        self.current[counter] += value
+
+    def end_frame(self):
+        now = time.perf_counter ()
+        if self.last_frame_end is not None:
+            frame = now - self.last_frame_end
+            self.samples["frame"].append (frame)
+            for phase in self.phases + self.counters:
+                self.samples[phase].append (self.current[phase])
+            bucket = 0
+            while bucket < len (self.histogram_bounds) and frame * 1000 > self.histogram_bounds[bucket]:
+                bucket += 1
+            self.histogram[bucket] += 1
+            self.frames += 1
+        for phase in self.phases + self.counters:
+            self.current[phase] = 0.0
+        self.last_frame_end = now
+
+    # p50, p95 and p99 of the recent samples of a phase in ms (of a counter as they are)
+    def percentiles(self, name):
+        values = sorted (self.samples[name])
+        if not values:
+            return (0.0, 0.0, 0.0)
+        last = len (values) - 1
+        scale = 1 if name in self.counters else 1000
+        return tuple (values[int (round (q * last))] * scale for q in (0.5, 0.95, 0.99))
+
+    def summary(self):
+        return {"frames": self.frames,
+                "percentiles_ms": dict ((name, self.percentiles (name)) for name in ("frame",) + self.phases),
+                "percentiles": dict ((name, self.percentiles (name)) for name in self.counters),
+                "histogram_ms": dict (zip ([str (bound) for bound in self.histogram_bounds] + ["inf"], self.histogram))}
+
+    def export(self, path):
+        names = ("frame",) + self.phases
+        rows = list (zip (*[self.samples[name] for name in names + self.counters]))
+        timed = len (names)
+        with open (path, "w") as f:
+            if path.endswith (".csv"):
+                f.write (",".join ([name.replace (" ", "_") + "_ms" for name in names] +
+                                   [name.replace (" ", "_") for name in self.counters]) + "\n")
+                for row in rows:
+                    f.write (",".join (["%.4f" % (value * 1000) for value in row[:timed]] +
+                                       ["%d" % value for value in row[timed:]]) + "\n")
+            else:
+                summary = self.summary ()
+                summary["frames_ms"] = [dict (zip (names, [value * 1000 for value in row[:timed]])) for row in rows]
+                summary["frame_counts"] = [dict (zip (self.counters, row[timed:])) for row in rows]
+                json.dump (summary, f, indent=1)
+
+    def render_overlay(self, font):
+        rows = [("ms", "p50", "p95", "p99")]
+        for name in ("frame",) + self.phases:
+            rows.append ((name,) + tuple ("%.2f" % value for value in self.percentiles (name)))
+        for name in self.counters:
+            rows.append ((name,) + tuple ("%d" % value for value in self.percentiles (name)))
+        line_height = font.get_linesize ()
+        name_width = max (font.size (row[0])[0] for row in rows) + 10
+        column_width = font.size ("000.00")[0] + 10
+        graph_height = 40
+        width = name_width + 3 * column_width + 10
+        height = line_height * len (rows) + graph_height + 15
+        surface = pygame.Surface ((width, height))
+        surface.fill ((20, 20, 20))
+        for i, row in enumerate (rows):
+            y_pos = 5 + i * line_height
+            surface.blit (font.render (row[0], True, WHITE), (5, y_pos))
+            for column, text in enumerate (row[1:]):
+                rendered = font.render (text, True, WHITE)
+                surface.blit (rendered, (5 + name_width + (column + 1) * column_width - rendered.get_width (), y_pos))
+
+        # recent frame times as a bar graph, the yellow line marks 40 ms (one step at the default tick rate)
+        bottom = height - 5
+        frames = list (self.samples["frame"])[-(width - 10):]
+        for x_pos, frame in enumerate (frames):
+            bar = min (graph_height, int (frame * 1000 * graph_height / 80))
+            color = RED if frame > 0.040 else GREEN
+            surface.fill (color, (5 + x_pos, bottom - bar, 1, bar))
+        surface.fill (YELLOW, (5, bottom - graph_height // 2, width - 10, 1))
+        self.overlay = surface
+
+    def draw(self, screen, font):
+        if self.overlay is None or self.frames % self.overlay_interval == 0:
+            self.render_overlay (font)
+        return screen.blit (self.overlay, (10, 10))
+
+
+# Uniform grid over the playfield used as broad phase for the collision checks.
+# Every object is registered in all cells its box (center +- half_size) touches and
+# cell indices wrap around at the screen edges, just like the objects do.
+# A query returns a superset of the objects whose boxes could overlap, ordered by their
+# slot (index in the game's list), the exact box test is still done by the caller.
+class SpatialGrid():
+    def __init__(self, cell_size=64, width=WINDOWWIDTH, height=WINDOWHEIGHT):
+        self.cell_size = cell_size
+        self.cols = max (1, int (math.ceil (width / cell_size)))
+        self.rows = max (1, int (math.ceil (height / cell_size)))
+        self.cells = [[] for i in range (self.cols * self.rows)]
+        self.cells_of = {} # object -> list of cell indices it has been inserted into
+        # objects of the last insert_many -> their number in it, their cells are kept as the
+        # first and last column and row (numpy arrays) instead of in cells_of
+        self.bulk = {}
+        self.bulk_ranges = None
+
+    # empties all cells (not only the ones in cells_of: an object that was inserted again without
+    # being removed would leave entries behind)
+    def clear(self):
+        for cell in self.cells:
+            cell.clear ()
+        self.cells_of.clear ()
+        self.bulk = {}
+        self.bulk_ranges = None
+
+    def _axis_range(self, low, high, count):
+        return self._axis_cells (int (math.floor (low / self.cell_size)), int (math.floor (high / self.cell_size)), count)
+
+    @staticmethod
+    def _axis_cells(first, last, count):
+        if last - first + 1 >= count:
+            return range (count)
+        return [i % count for i in range (first, last + 1)]
+
+    def _cell_indices(self, x_pos, y_pos, half_size):
+        cols = self._axis_range (x_pos - half_size, x_pos + half_size, self.cols)
+        rows = self._axis_range (y_pos - half_size, y_pos + half_size, self.rows)
+        return [row * self.cols + col for row in rows for col in cols]
+
+    def insert(self, obj, x_pos, y_pos, half_size):
+        index = self._cell_indices (x_pos, y_pos, half_size)
+        for i in index:
+            self.cells[i].append (obj)
+        self.cells_of[obj] = index
+
+    # inserts all objects at once, the same as insert () for each of them (in this order) but
+    # the cells are computed with numpy: x_pos, y_pos and half_size are arrays, one entry per object
+    def insert_many(self, objects, x_pos, y_pos, half_size):
+        count = len (objects)
+        if not count:
+            return
+        first_col = np.floor ((x_pos - half_size) / self.cell_size).astype (np.int64)
+        last_col = np.floor ((x_pos + half_size) / self.cell_size).astype (np.int64)
+        first_row = np.floor ((y_pos - half_size) / self.cell_size).astype (np.int64)
+        last_row = np.floor ((y_pos + half_size) / self.cell_size).astype (np.int64)
+
+        # boxes as wide as the grid cover every column once (_axis_cells)
+        col_span = last_col - first_col + 1
+        row_span = last_row - first_row + 1
+        col_start = np.where (col_span >= self.cols, 0, first_col)
+        row_start = np.where (row_span >= self.rows, 0, first_row)
+        np.minimum (col_span, self.cols, out=col_span)
+        np.minimum (row_span, self.rows, out=row_span)
+
+        numbers = np.arange (count)
+        cells = []
+        owners = []
+        for row in range (int (row_span.max ())):
+            for col in range (int (col_span.max ())):
+                inside = (row < row_span) & (col < col_span)
+                cells.append (((row_start[inside] + row) % self.rows) * self.cols + (col_start[inside] + col) % self.cols)
+                owners.append (numbers[inside])
+        cells = np.concatenate (cells)
+        owners = np.concatenate (owners)
+        order = np.argsort (cells * count + owners) # by cell, then like the objects
+        cells = cells[order]
+        owners = owners[order]
+
+        table = np.empty (count, dtype=object)
+        table[:] = objects
+        ends = np.cumsum (np.bincount (cells, minlength=len (self.cells))).tolist ()
+        start = 0
+        for cell, end in enumerate (ends):
+            if end > start:
+                self.cells[cell].extend (table[owners[start:end]].tolist ())
+            start = end
+        self.bulk.update (zip (objects, range (count)))
+        self.bulk_ranges = (first_col, last_col, first_row, last_row)
+
+    def remove(self, obj):
+        number = self.bulk.pop (obj, None)
+        if number is not None:
+            first_col, last_col, first_row, last_row = self.bulk_ranges
+            cols = self._axis_cells (int (first_col[number]), int (last_col[number]), self.cols)
+            rows = self._axis_cells (int (first_row[number]), int (last_row[number]), self.rows)
+            for i in [row * self.cols + col for row in rows for col in cols]:
+                self.cells[i].remove (obj)
+            return
+        for i in self.cells_of.pop (obj, ()):
+            self.cells[i].remove (obj)
+
+    def query(self, x_pos, y_pos, half_size):
+        index = self._cell_indices (x_pos, y_pos, half_size)
+        if len (index) == 1:
+            found = list (self.cells[index[0]])
+        else:
+            found = []
+            seen = set ()
+            for i in index:
+                for obj in self.cells[i]:
+                    if obj not in seen:
+                        seen.add (obj)
+                        found.append (obj)
+        found.sort (key=slot_of)
+        return found
+
+
+# World bigger than the screen, split into square chunks of chunk_size pixels. The asteroids in
+# the chunks the view touches and in the ring of chunks around them are active: normal game
+# objects that move, collide and are drawn every step. All others are dormant and stored per
+# chunk as rows of a flat array (position, speed, size, angle, angle speed and the tick the row
+# is up to date at). Nothing can hit a dormant asteroid, it only moves in a straight line, so a
+# chunk is brought up to date in one go and its asteroids are moved to the chunks they are in
+# now, the ones reaching an active chunk are woken up. Every chunk is advanced before its
+# fastest asteroid can get further than half a chunk away, so waking up the chunks around the
+# active ones finds all asteroids that moved in, and most chunks are only touched every few
+# dozen steps. Active asteroids leaving the active chunks are put to sleep again.
+# The world wraps around at its edges like the screen does.
+class ChunkedWorld():
+    row_size = 8
+
+    def __init__(self, width, height, chunk_size=512):
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.cols = max (1, int (math.ceil (width / chunk_size)))
+        self.rows = max (1, int (math.ceil (height / chunk_size)))
+        # the active chunks cover at most this much of the world
+        self.active_width = min (width, (int (math.ceil (WINDOWWIDTH / chunk_size)) + 3) * chunk_size)
+        self.active_height = min (height, (int (math.ceil (WINDOWHEIGHT / chunk_size)) + 3) * chunk_size)
+        self.x_view = 0.0 # top left corner of the view, set by look_at
+        self.y_view = 0.0
+        self.clear ()
+
+    def clear(self):
+        count = self.cols * self.rows
+        self.chunks = [array.array ('d') for i in range (count)]
+        self.dormant = 0
+        self.x_shake = 0
+        self.due = [None] * count # per chunk: tick it has to be advanced at
+        self.schedule = [] # heap of (due tick, chunk index), entries not matching self.due are outdated
+        self.active = set () # indices of the active chunks
+        self.bounds = None # first and last column and row of the active chunks
+        self.changed = set (range (count)) # chunks changed since the last take_changed
+
+    def chunk_of(self, x_pos, y_pos):
+        size = self.chunk_size
+        return int (y_pos // size) % self.rows * self.cols + int (x_pos // size) % self.cols
+
+    def indices(self, first_col, last_col, first_row, last_row):
+        return set (row % self.rows * self.cols + col % self.cols
+                    for row in range (first_row, last_row + 1) for col in range (first_col, last_col + 1))
+
+    def add(self, x_pos, y_pos, x_speed, y_speed, size, angle, angle_speed, tick):
+        self.store (self.chunk_of (x_pos, y_pos), (x_pos, y_pos, x_speed, y_speed, size, angle, angle_speed, tick))
+
+    # row: x_pos, y_pos, x_speed, y_speed, size, angle, angle_speed, tick
+    def store(self, index, row):
+        self.chunks[index].extend (row)
+        self.dormant += 1
+        self.changed.add (index)
+
+        # due before the asteroid gets half a chunk away
+        speed = abs (row[2])
+        if abs (row[3]) > speed:
+            speed = abs (row[3])
+        due = row[7] + (int (self.chunk_size / 2 / speed) or 1 if speed else self.chunk_size)
+        if self.due[index] is None or due < self.due[index]:
+            self.due[index] = due
+            heapq.heappush (self.schedule, (due, index))
+
+    # count dormant asteroids anywhere but close to the ship
+    def spawn(self, count, ship, rng, tick):
+        for i in range (count):
+            while True:
+                x_pos = rng.randint (0, self.width)
+                y_pos = rng.randint (0, self.height)
+                if abs (x_pos - ship.x_pos) > 150 or abs (y_pos - ship.y_pos) > 150:
+                    break
+            self.add (x_pos, y_pos, rng.randint (-3, 3), rng.randint (-3, 3), rng.choice ([8, 16, 32]), 0,
+                      rng.randint (1, 5), tick)
+
+        # spread the first updates out, so the chunks don't all come due at the same step
+        self.schedule = []
+        for index, due in enumerate (self.due):
+            if due is not None:
+                self.due[index] = tick + 1 + index % (due - tick)
+                self.schedule.append ((self.due[index], index))
+        heapq.heapify (self.schedule)
+
+    # called after every step of the game
+    def update(self, game):
+        tick = game.ticks
+        ship = game.myShip
+        size = self.chunk_size
+        bounds = (int ((ship.x_pos - WINDOWWIDTH / 2) // size) - 1, int ((ship.x_pos + WINDOWWIDTH / 2) // size) + 1,
+                  int ((ship.y_pos - WINDOWHEIGHT / 2) // size) - 1, int ((ship.y_pos + WINDOWHEIGHT / 2) // size) + 1)
+        if bounds != self.bounds:
+            self.bounds = bounds
+            first_col, last_col, first_row, last_row = bounds
+            previous = self.active
+            self.active = self.indices (first_col, last_col, first_row, last_row)
+            # asteroids now in the new active chunks can still be stored in their neighbours
+            for index in self.indices (first_col - 1, last_col + 1, first_row - 1, last_row + 1) - previous:
+                self.advance (game, index, tick)
+
+        # backwards, so that removing (which moves the last asteroid into the gap) doesn't skip any
+        asteroids = game.asteroids
+        active = self.active
+        for i in range (len (asteroids) - 1, -1, -1):
+            asteroid = asteroids[i]
+            if self.chunk_of (asteroid.x_pos, asteroid.y_pos) not in active:
+                self.sleep (game, asteroid, tick)
+
+        schedule = self.schedule
+        while schedule and schedule[0][0] <= tick:
+            due, index = heapq.heappop (schedule)
+            if due == self.due[index]:
+                self.advance (game, index, tick)
+
+    # bring the asteroids of a chunk up to tick, moving them to the chunks they are in now
+    def advance(self, game, index, tick):
+        rows = self.chunks[index]
+        self.due[index] = None
+        if not rows:
+            return
+        self.chunks[index] = array.array ('d')
+        self.changed.add (index)
+        self.dormant -= len (rows) // self.row_size
+        width = self.width
+        height = self.height
+        chunk_size = self.chunk_size
+        cols = self.cols
+        row_count = self.rows
+        active = self.active
+        for i in range (0, len (rows), self.row_size):
+            x_pos, y_pos, x_speed, y_speed, size, angle, angle_speed, since = rows[i:i + self.row_size]
+            steps = tick - since
+            x_pos = (x_pos + x_speed * steps) % width
+            y_pos = (y_pos - y_speed * steps) % height
+            angle = (angle + angle_speed * steps) % 360
+            target = int (y_pos // chunk_size) % row_count * cols + int (x_pos // chunk_size) % cols # chunk_of
+            if target in active:
+                asteroid = game.new_asteroid (x_pos=x_pos, y_pos=y_pos, size=size, x_speed=x_speed, y_speed=y_speed,
+                                              angle=angle, angle_speed=angle_speed)
+                game.add_asteroid (asteroid)
+            else:
+                self.store (target, (x_pos, y_pos, x_speed, y_speed, size, angle, angle_speed, tick))
+
+    def sleep(self, game, asteroid, tick):
+        self.add (asteroid.x_pos % self.width, asteroid.y_pos % self.height, asteroid.x_speed, asteroid.y_speed,
+                  asteroid.size, asteroid.angle, asteroid.angle_speed, tick)
+        game.remove_asteroid (asteroid)
+
+    def take_changed(self):
+        changed = self.changed
+        self.changed = set ()
+        return changed
+
+    # shake, active chunks and schedule (the due tick per chunk, -1: none) as bytes
+    def state(self):
+        bounds = self.bounds or (0, 0, 0, 0)
+        due = array.array ('q', [-1 if due is None else due for due in self.due])
+        return struct.pack ("<dB4i", self.x_shake, self.bounds is not None, *bounds) + due.tobytes ()
+
+    def load(self, state, chunks):
+        x_shake, has_bounds, first_col, last_col, first_row, last_row = struct.unpack_from ("<dB4i", state)
+        self.x_shake = x_shake
+        self.bounds = None
+        self.active = set ()
+        if has_bounds:
+            self.bounds = (first_col, last_col, first_row, last_row)
+            self.active = self.indices (first_col, last_col, first_row, last_row)
+        due = array.array ('q', state[struct.calcsize ("<dB4i"):])
+        self.due = [None if value < 0 else value for value in due]
+        self.schedule = [(value, index) for index, value in enumerate (self.due) if value is not None]
+        heapq.heapify (self.schedule)
+        self.chunks = [array.array ('d', rows) for rows in chunks]
+        self.dormant = sum (len (rows) for rows in self.chunks) // self.row_size
+        self.changed = set (range (len (self.chunks)))
+
+    # center the view on (x_pos, y_pos)
+    def look_at(self, x_pos, y_pos):
+        self.x_view = x_pos - WINDOWWIDTH / 2 - self.x_shake
+        self.y_view = y_pos - WINDOWHEIGHT / 2
+
+    # screen position of a world position, None if it is further than margin outside of the view
+    def view_position(self, x_pos, y_pos, margin=64):
+        x_pos = (x_pos - self.x_view + margin) % self.width - margin
+        if x_pos > WINDOWWIDTH + margin:
+            return None
+        y_pos = (y_pos - self.y_view + margin) % self.height - margin
+        if y_pos > WINDOWHEIGHT + margin:
+            return None
+        return x_pos, y_pos
+
 if __name__ == "__main__":
-    myfire = AsteroidsGame (asteroid_count=20, lifes=3, sound_on=True)
+    if sys.argv[1:2] == ["batch"]: # python PyAsteroids.py batch --help
+        import batch
+        sys.exit (batch.main (sys.argv[2:]))
+
+    import argparse
+
+    parser = argparse.ArgumentParser (description="Asteroids")
+    parser.add_argument ("--display", metavar="WIDTHxHEIGHT", help="window size, the game is scaled up to it")
+    parser.add_argument ("--fullscreen", action="store_true", help="fullscreen at the desktop resolution")
+    parser.add_argument ("--scaling", default="hardware", choices=("hardware",) + ScaledDisplay.modes)
+    parser.add_argument ("--capture", metavar="DIR", help="record the game to this directory")
+    parser.add_argument ("--capture-format", default="raw", choices=FrameCapture.formats)
+    args = parser.parse_args ()
+
+    display_size = None
+    if args.fullscreen:
+        display_size = (0, 0)
+    elif args.display:
+        display_size = tuple (int (value) for value in args.display.lower ().split ("x"))
+    myfire = AsteroidsGame (asteroid_count=20, lifes=3, sound_on=True, display_size=display_size, scaling=args.scaling,
+                            capture_to=args.capture, capture_format=args.capture_format)
@@ -0,0 +1,243 @@
+"""
+Batch simulation runner for PyAsteroids
+
+Runs many headless games in a process pool to tune game parameters without playing by hand.
+Every game gets a seed, a parameter set (keyword arguments of AsteroidsGame) and an input
+policy that plays it through handle_key, just like key presses. Per game the survival time,
+score and step (frame) costs are collected and streamed to a CSV or JSON lines table, in task
+order. The simulation results (everything but the timings) only depend on the seeds, not on the
+number of workers.
+
+Usage:
+python batch.py --games 8 --param asteroid_count=10,20,40 --param laser_speed=15,25 --out sweep.csv
+python batch.py --games 100 --policy aim --workers 4 --out runs.jsonl
+python PyAsteroids.py batch ...                          same as python batch.py ...
+
+--games is the number of seeds per parameter set, every combination of the --param values is
+a parameter set. All parameter sets are played with the same seeds (--seed, --seed + 1, ...), so
+they are compared on the same games. Policies: idle, random, spin (turn and fire), aim (aim at the nearest asteroid).
+"""
+
+import csv
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault ("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault ("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault ("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+from PyAsteroids import AsteroidsGame
+
+RESULT_FIELDS = ("ticks", "survival_s", "score", "lifes", "asteroids", "won", "checksum",
+                 "step_mean_ms", "step_p95_ms", "step_max_ms")
+
+
+# Input policies: policy(seed) returns a function that is called with the game before every
+# step and presses and releases keys through game.handle_key. Their randomness comes from
+# their own generator so the game's random sequence isn't touched.
+
+# sets the held keys to `keys`, sending the key events for the changes
+def hold(game, held, keys):
+    for key in held - keys:
+        game.handle_key (pygame.KEYUP, key)
+    for key in keys - held:
+        game.handle_key (pygame.KEYDOWN, key)
+    held.clear ()
+    held.update (keys)
+
+
+def fire(game):
+    game.handle_key (pygame.KEYDOWN, pygame.K_SPACE)
+    game.handle_key (pygame.KEYUP, pygame.K_SPACE)
+
+
+def idle_policy(seed):
+    def act(game):
+        pass
+    return act
+
+
+# changes the held keys every few steps and fires now and then
+def random_policy(seed):
+    rng = random.Random (seed)
+    held = set ()
+    def act(game):
+        if rng.random () < 0.2:
+            keys = set ()
+            turn = rng.choice ((None, pygame.K_LEFT, pygame.K_RIGHT))
+            if turn is not None:
+                keys.add (turn)
+            if rng.random () < 0.3:
+                keys.add (pygame.K_UP)
+            hold (game, held, keys)
+        if rng.random () < 0.3:
+            fire (game)
+    return act
+
+
+def spin_policy(seed):
+    held = set ()
+    def act(game):
+        hold (game, held, {pygame.K_LEFT})
+        if game.ticks % 3 == 0:
+            fire (game)
+    return act
+
+
+# turns towards the nearest asteroid and fires when roughly facing it
+def aim_policy(seed):
+    held = set ()
+    def act(game):
+        ship = game.myShip
+        if not game.asteroids:
+            hold (game, held, set ())
+            return
+        target = min (game.asteroids, key=lambda asteroid: (asteroid.x_pos - ship.x_pos) ** 2 + (asteroid.y_pos - ship.y_pos) ** 2)
+        # the ship points to (-sin (angle), -cos (angle)) on screen
+        angle = math.degrees (math.atan2 (ship.x_pos - target.x_pos, ship.y_pos - target.y_pos))
+        difference = (angle - ship.angle + 180) % 360 - 180
+        if difference > 6:
+            hold (game, held, {pygame.K_LEFT})
+        elif difference < -6:
+            hold (game, held, {pygame.K_RIGHT})
+        else:
+            hold (game, held, set ())
+            if game.ticks % 2 == 0:
+                fire (game)
+    return act
+
+
+POLICIES = {"idle": idle_policy, "random": random_policy, "spin": spin_policy, "aim": aim_policy}
+
+
+def percentile(values, q):
+    values = sorted (values)
+    if not values:
+        return 0.0
+    return values[int (round (q * (len (values) - 1)))]
+
+
+# runs one game, task is (index, seed, policy name, parameters, max ticks); module level so
+# that the pool can pickle it
+def run_task(task):
+    index, seed, policy, params, max_ticks = task
+    game = AsteroidsGame (headless=True, sound_on=False, seed=seed, **params)
+    act = POLICIES[policy] (seed)
+    times = []
+    while not game.is_finished () and game.ticks < max_ticks:
+        act (game)
+        start = time.perf_counter ()
+        game.step ()
+        times.append (time.perf_counter () - start)
+
+    return {"index": index, "seed": seed, "policy": policy, "params": params,
+            "ticks": game.ticks,
+            "survival_s": round (game.sim_time, 6),
+            "score": game.score,
+            "lifes": game.lifes,
+            "asteroids": game.asteroids_left (),
+            "won": int (game.asteroids_left () < 1 and game.lifes > 0),
+            "checksum": game.state_checksum (),
+            "step_mean_ms": 1000 * sum (times) / max (1, len (times)),
+            "step_p95_ms": 1000 * percentile (times, 0.95),
+            "step_max_ms": 1000 * max (times, default=0.0)}
+
+
+# "name=1,2,3" -> ("name", [1, 2, 3]), values are JSON (numbers, true/false) or plain strings
+def parse_param(text):
+    name, sep, values = text.partition ("=")
+    if not sep:
+        raise ValueError ("expected name=value[,value...], got %r" % text)
+    parsed = []
+    for value in values.split (","):
+        try:
+            parsed.append (json.loads (value))
+        except ValueError:
+            parsed.append (value)
+    return name.strip (), parsed
+
+
+# one task per parameter combination and game, the games of every combination have the
+# seeds seed, seed + 1, ...
+def make_tasks(params, games, seed, policy, max_ticks):
+    names = sorted (params)
+    tasks = []
+    for values in itertools.product (*[params[name] for name in names]):
+        for game in range (games):
+            tasks.append ((len (tasks), seed + game, policy, dict (zip (names, values)), max_ticks))
+    return tasks
+
+
+def run_tasks(tasks, workers):
+    if workers <= 1:
+        for task in tasks:
+            yield run_task (task)
+        return
+    with multiprocessing.Pool (workers) as pool:
+        # imap keeps the task order, so the output doesn't depend on the scheduling
+        for result in pool.imap (run_task, tasks, chunksize=max (1, len (tasks) // (workers * 8))):
+            yield result
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser (description="Run many headless PyAsteroids games")
+    parser.add_argument ("--games", type=int, default=10, help="games (seeds) per parameter set")
+    parser.add_argument ("--param", action="append", default=[], metavar="NAME=V1,V2",
+                         help="AsteroidsGame argument and the values to try, can be repeated")
+    parser.add_argument ("--policy", default="random", choices=list (POLICIES))
+    parser.add_argument ("--seed", type=int, default=1, help="seed of the first game")
+    parser.add_argument ("--max-ticks", type=int, default=25 * 60 * 5, help="stop games after this many steps")
+    parser.add_argument ("--workers", type=int, default=os.cpu_count () or 1)
+    parser.add_argument ("--out", help="write the table to this .csv or .jsonl file (default: CSV to stdout)")
+    args = parser.parse_args (argv)
+
+    params = dict (parse_param (text) for text in args.param)
+    tasks = make_tasks (params, args.games, args.seed, args.policy, args.max_ticks)
+    names = sorted (params)
+
+    out = open (args.out, "w", newline="") if args.out else sys.stdout
+    jsonl = args.out is not None and args.out.endswith (".jsonl")
+    writer = None
+    if not jsonl:
+        writer = csv.writer (out)
+        writer.writerow (["index", "seed", "policy"] + names + list (RESULT_FIELDS))
+
+    # per parameter set: games, survival and score sums
+    totals = {}
+    start = time.perf_counter ()
+    try:
+        for result in run_tasks (tasks, args.workers):
+            if jsonl:
+                out.write (json.dumps (result) + "\n")
+            else:
+                writer.writerow ([result["index"], result["seed"], result["policy"]] +
+                                 [result["params"][name] for name in names] +
+                                 [result[field] for field in RESULT_FIELDS])
+            out.flush ()
+            key = tuple (result["params"][name] for name in names)
+            games, survival, score = totals.get (key, (0, 0.0, 0))
+            totals[key] = (games + 1, survival + result["survival_s"], score + result["score"])
+    finally:
+        if out is not sys.stdout:
+            out.close ()
+
+    print ("%d games in %.1f s with %d workers" % (len (tasks), time.perf_counter () - start, args.workers),
+           file=sys.stderr)
+    for key, (games, survival, score) in totals.items ():
+        label = " ".join ("%s=%s" % item for item in zip (names, key)) or "defaults"
+        print ("%-40s survival %7.1f s  score %8.0f" % (label, survival / games, score / games), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit (main ())
@@ -0,0 +1,291 @@
+"""
+Benchmarks for PyAsteroids
+
+Runs scripted stress scenarios on headless games with fixed seeds and measures
+- simulation steps per second (plain step() calls, nothing else)
+- time per frame of the main phases (collisions, object updates, drawing) and of render()
+- memory allocated per frame by these phases (tracemalloc) and garbage collections per frame
+- pixel mask tests (narrow phase of the collision checks) per step
+- cost of the rewind snapshots: microseconds per snapshot and bytes added per tick
+- the particle system with 10000 live particles (particles_10000, needs numpy)
+- the collision grid against the plain all-against-all checks (grid_400_lasers_50, no_grid_400_lasers_50)
+
+Usage:
+python benchmark.py                                   run all scenarios, print JSON
+python benchmark.py --out results.json                write results to a file
+python benchmark.py --compare baseline.json           flag regressions against a stored run
+python benchmark.py --scenarios asteroids_20 lasers_300 --ticks 200
+
+With --compare the exit code is 1 if any metric got worse by more than --threshold
+(relative, default 0.15). Phases below --min-ms in the baseline are not compared.
+"""
+
+import gc
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault ("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault ("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+from PyAsteroids import AsteroidsGame, WINDOWWIDTH, WINDOWHEIGHT
+
+# methods whose time and allocations are reported separately
+PHASES = ("check_collisions", "ship_asteroid_collision", "laser_asteroid_collision", "update_all_objects", "draw_objects", "render")
+
+
+# keep about `count` lasers in flight, fired in a rotating fan
+def keep_lasers(count):
+    def drive(game):
+        while len (game.lasers_fired) < count:
+            game.myShip.angle = (game.myShip.angle + 7) % 360
+            game.fire_laser ()
+    return drive
+
+
+# big asteroids around the ship which is firing in all directions, refilled when most are destroyed
+def splitting_cascade(game):
+    if len (game.asteroids) < 50:
+        for i in range (200):
+            angle = game.rng.uniform (0, 2 * math.pi)
+            distance = game.rng.uniform (120, 250)
+            game.add_asteroid (game.new_asteroid (size=32, x_pos=WINDOWWIDTH / 2 + math.cos (angle) * distance,
+                                                  y_pos=WINDOWHEIGHT / 2 + math.sin (angle) * distance))
+    for i in range (12):
+        game.myShip.angle = (game.myShip.angle + 30) % 360
+        game.fire_laser ()
+
+
+def idle(game):
+    pass
+
+
+# keep at least `count` particles alive with explosions around the screen (no particles without numpy)
+def keep_particles(count):
+    rng = random.Random (count) # not the game's generator, the runs without a renderer have no particles
+    def drive(game):
+        particles = game.particles
+        while particles is not None and particles.count < count:
+            particles.emit ("explosion", rng.uniform (0, WINDOWWIDTH), rng.uniform (0, WINDOWHEIGHT), 500)
+    return drive
+
+
+# name -> (game settings, function called before every tick)
+SCENARIOS = {
+    "asteroids_20": ({"asteroid_count": 20}, idle),
+    "asteroids_200": ({"asteroid_count": 200}, idle),
+    "asteroids_2000": ({"asteroid_count": 2000}, idle),
+    "lasers_300": ({"asteroid_count": 20}, keep_lasers (300)),
+    # the collision grid against the all-against-all checks, where the grid is used
+    "grid_400_lasers_50": ({"asteroid_count": 400}, keep_lasers (50)),
+    "no_grid_400_lasers_50": ({"asteroid_count": 400, "spatial_grid": False}, keep_lasers (50)),
+    "splitting_cascade": ({"asteroid_count": 0}, splitting_cascade),
+    "starfield_10000": ({"asteroid_count": 20, "star_count": 10000, "star_layers": 3}, idle),
+    "world_20000": ({"asteroid_count": 20000, "world_size": (20000, 20000)}, keep_lasers (30)),
+    "particles_10000": ({"asteroid_count": 20}, keep_particles (10000)),
+}
+
+
+def new_game(settings, seed, extra):
+    kwargs = dict (settings)
+    kwargs.update (extra)
+    # lots of lifes so that the scenarios don't end, snapshots like in a game with a window
+    return AsteroidsGame (lifes=10**6, sound_on=False, headless=True, seed=seed, snapshot_interval=5, **kwargs)
+
+
+def percentile(values, q):
+    values = sorted (values)
+    if not values:
+        return 0.0
+    return values[int (round (q * (len (values) - 1)))]
+
+
+# replaces the given methods of a game by wrappers that call `measure` around them
+def instrument(game, measure):
+    for name in PHASES:
+        method = getattr (game, name)
+        setattr (game, name, measure (name, method))
+
+
+def time_phases(game, drive, ticks):
+    samples = dict ((name, [0.0] * ticks) for name in PHASES)
+    frame = [0]
+    def measure(name, method):
+        def timed(*args, **kwargs):
+            start = time.perf_counter ()
+            result = method (*args, **kwargs)
+            samples[name][frame[0]] += time.perf_counter () - start
+            return result
+        return timed
+    instrument (game, measure)
+    for frame[0] in range (ticks):
+        drive (game)
+        game.step ()
+        game.render ()
+    return dict ((name, {"mean_ms": 1000 * sum (values) / ticks,
+                         "p50_ms": 1000 * percentile (values, 0.5),
+                         "p95_ms": 1000 * percentile (values, 0.95)}) for name, values in samples.items ())
+
+
+def measure_allocations(game, drive, ticks):
+    allocated = dict.fromkeys (PHASES, 0)
+    # phases nest (render calls draw_objects, check_collisions the collision checks), resetting the
+    # peak for an inner phase would lose the outer one's peak so far: every running phase keeps its
+    # peak so far on this stack and an inner phase's peak is combined into the outer one when it ends
+    peaks = []
+    def measure(name, method):
+        def traced(*args, **kwargs):
+            current, peak = tracemalloc.get_traced_memory ()
+            if peaks:
+                peaks[-1] = max (peaks[-1], peak)
+            peaks.append (current)
+            tracemalloc.reset_peak ()
+            result = method (*args, **kwargs)
+            peak = max (peaks.pop (), tracemalloc.get_traced_memory ()[1])
+            if peaks:
+                peaks[-1] = max (peaks[-1], peak)
+            allocated[name] += peak - current
+            return result
+        return traced
+    instrument (game, measure)
+    collections = gc.get_stats ()[0]["collections"]
+    tracemalloc.start ()
+    try:
+        for i in range (ticks):
+            drive (game)
+            game.step ()
+            game.render ()
+    finally:
+        tracemalloc.stop ()
+    result = dict ((name, {"peak_bytes_per_frame": allocated[name] / ticks}) for name in PHASES)
+    result["gc_gen0_per_frame"] = (gc.get_stats ()[0]["collections"] - collections) / ticks
+    return result
+
+
+def run_scenario(name, ticks, warmup, seed, extra):
+    settings, drive = SCENARIOS[name]
+    screen = pygame.Surface ((WINDOWWIDTH, WINDOWHEIGHT))
+
+    # simulation only, as fast as possible
+    game = new_game (settings, seed, extra)
+    for i in range (warmup):
+        drive (game)
+        game.step ()
+    mask_tests = []
+    start = time.perf_counter ()
+    for i in range (ticks):
+        drive (game)
+        game.step ()
+        mask_tests.append (game.mask_tests)
+    elapsed = time.perf_counter () - start
+    snapshots = game.snapshots.stats ()
+
+    # per phase timings with rendering
+    game = new_game (settings, seed, extra)
+    game.init_renderer (screen)
+    for i in range (warmup):
+        drive (game)
+        game.step ()
+        game.render ()
+    phases = time_phases (game, drive, ticks)
+
+    # allocations (separate run, tracemalloc slows everything down)
+    game = new_game (settings, seed, extra)
+    game.init_renderer (screen)
+    for i in range (warmup):
+        drive (game)
+        game.step ()
+        game.render ()
+    allocations = measure_allocations (game, drive, max (1, ticks // 4))
+
+    return {"steps_per_sec": ticks / elapsed,
+            "asteroids": game.asteroids_left (),
+            "lasers": len (game.lasers_fired),
+            "mask_tests_per_step": {"mean": sum (mask_tests) / ticks, "max": max (mask_tests)},
+            "snapshots": snapshots,
+            "phases": phases,
+            "allocations": allocations}
+
+
+# metrics of a result as (name, value, higher is better), phases that take less
+# than min_ms are left out since their relative changes are mostly noise
+def metrics(result, min_ms=0.0):
+    yield "steps_per_sec", result["steps_per_sec"], True
+    for phase, values in result["phases"].items ():
+        if values["mean_ms"] >= min_ms:
+            yield phase + ".mean_ms", values["mean_ms"], False
+            yield phase + ".p50_ms", values["p50_ms"], False
+
+
+def compare(results, baseline, threshold, min_ms):
+    regressions = []
+    for name, result in results["scenarios"].items ():
+        if name not in baseline["scenarios"]:
+            continue
+        old = dict ((metric, value) for metric, value, higher in metrics (baseline["scenarios"][name], min_ms))
+        for metric, value, higher in metrics (result):
+            if metric not in old or old[metric] <= 0:
+                continue
+            change = (value - old[metric]) / old[metric]
+            if (higher and change < -threshold) or (not higher and change > threshold):
+                regressions.append ({"scenario": name, "metric": metric, "baseline": old[metric],
+                                     "current": value, "change": change})
+    return regressions
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser (description="PyAsteroids benchmarks")
+    parser.add_argument ("--scenarios", nargs="*", default=list (SCENARIOS), choices=list (SCENARIOS))
+    parser.add_argument ("--ticks", type=int, default=300, help="measured ticks per scenario")
+    parser.add_argument ("--warmup", type=int, default=30)
+    parser.add_argument ("--seed", type=int, default=1)
+    parser.add_argument ("--array-world", action="store_true", help="use the numpy array backed world")
+    parser.add_argument ("--out", help="write the results to this JSON file")
+    parser.add_argument ("--compare", help="baseline JSON file to compare against")
+    parser.add_argument ("--threshold", type=float, default=0.15, help="relative change counted as regression")
+    parser.add_argument ("--min-ms", type=float, default=0.05, help="ignore phases faster than this in the baseline")
+    args = parser.parse_args (argv)
+
+    pygame.init ()
+    pygame.display.set_mode ((1, 1))
+
+    extra = {"array_world": True} if args.array_world else {}
+    results = {"meta": {"python": platform.python_version (), "pygame": pygame.version.ver,
+                        "platform": platform.platform (), "ticks": args.ticks, "seed": args.seed,
+                        "array_world": args.array_world},
+               "scenarios": {}}
+    for name in args.scenarios:
+        results["scenarios"][name] = run_scenario (name, args.ticks, args.warmup, args.seed, extra)
+        print ("%-20s %10.0f steps/s" % (name, results["scenarios"][name]["steps_per_sec"]), file=sys.stderr)
+
+    status = 0
+    if args.compare:
+        with open (args.compare) as f:
+            baseline = json.load (f)
+        results["regressions"] = compare (results, baseline, args.threshold, args.min_ms)
+        for regression in results["regressions"]:
+            print ("REGRESSION %(scenario)s %(metric)s: %(baseline).4g -> %(current).4g (%(change)+.0f%%)" %
+                   dict (regression, change=regression["change"] * 100), file=sys.stderr)
+        if results["regressions"]:
+            status = 1
+
+    output = json.dumps (results, indent=1)
+    if args.out:
+        with open (args.out, "w") as f:
+            f.write (output)
+    else:
+        print (output)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit (main ())
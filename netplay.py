@@ -0,0 +1,848 @@
+"""
+Networked multiplayer for PyAsteroids
+
+An authoritative server runs one game with a ship per player (asyncio, UDP) at the normal tick
+rate. Clients only send their input, the held keys of every tick with a sequence number. Each
+packet carries the last few inputs, so a lost packet doesn't lose any. The server applies one
+input per player and step and sends every client one snapshot per step.
+
+Snapshots are quantized (positions in 1/8 pixel, speeds in 1/64 pixel per step, lasers only
+once as their start and velocity) and delta encoded against the newest snapshot the client
+has acknowledged. Unchanged objects cost nothing, changed fields are sent as small
+differences. Lost snapshots are not resent: the next one is relative to the last acknowledged
+snapshot, and the encoding is shared by all clients that acknowledged the same one.
+
+The client predicts its own ship: every input is applied to a local copy of the ship right
+away. When a snapshot arrives, the copy is reset to the server's ship and the inputs the
+server hasn't applied yet are applied again.
+
+Usage:
+python netplay.py server --port 9999 --asteroids 20
+python netplay.py client 127.0.0.1:9999                   LEFT/RIGHT/UP/SPACE, R to rejoin after game over
+python netplay.py bench --players 2 4 8 16 32 --seconds 5 --latency 0.05 --jitter 0.01 --loss 0.05
+
+bench runs a server and bot clients in one process on loopback and reports, per number of
+players: snapshot bytes per tick and client, server tick time and prediction error. --latency,
+--jitter and --loss simulate a bad network on every packet (see LossyLink), also for server
+and client.
+
+Packets (little endian, varint: 7 bits per byte, signed values zigzag encoded):
+join      0
+welcome   1, player id (B)
+input     2, ack: newest snapshot received (I), newest input sequence number (I), count (B),
+          count inputs (B each, oldest first, bits: left, right, thrust, fire, restart)
+snapshot  3, snapshot id (I), baseline id (I, 0: none), sequence number of the last input applied (I),
+          then for asteroids, ships, lasers and players: number of changed objects (varint), per
+          object its id (varint, difference to the previous one), a field mask (varint) and the
+          changed fields (signed varint, difference to the baseline), number of removed objects
+          and their ids (varints, differences)
+leave     4
+"""
+
+import asyncio
+import math
+import os
+import random
+import struct
+import sys
+import time
+from collections import deque
+
+os.environ.setdefault ("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+from PyAsteroids import (AsteroidsGame, SpaceShip, RotationCache, Hud, assets, TICK_RATE, FIRE_INTERVAL,
+                         WINDOWWIDTH, WINDOWHEIGHT, BLACK, WHITE, BLUE, YELLOW)
+from replay import write_varint, read_varint
+
+MSG_JOIN = 0
+MSG_WELCOME = 1
+MSG_INPUT = 2
+MSG_SNAPSHOT = 3
+MSG_LEAVE = 4
+
+INPUT_HEADER = struct.Struct ("<BIIB")
+SNAPSHOT_HEADER = struct.Struct ("<BIII")
+
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_THRUST = 4
+INPUT_FIRE = 8
+INPUT_RESTART = 16
+
+INPUT_REDUNDANCY = 8 # inputs per packet
+INPUT_BUFFER = 4 # inputs the server keeps queued per player, older ones are skipped to catch up
+MAX_PLAYERS = 32
+HISTORY = 64 # snapshots kept as baselines, clients with older acknowledgements get a full one
+TIMEOUT = 5.0 # seconds without packets after which a player is dropped
+
+POSITION_SCALE = 8
+SPEED_SCALE = 64
+
+# object kinds of a snapshot and their fields
+ASTEROIDS, SHIPS, LASERS, PLAYERS = range (4)
+FIELD_COUNTS = (4, # x, y, angle, size
+                6, # x, y, angle, x speed, y speed, flags
+                6, # x, y of the tip at tick, x and y move per step, angle, tick
+                2) # score, lifes
+
+SHIP_BOOST = 1
+SHIP_HIT = 2
+SHIP_OUT = 4 # no lifes left
+
+
+def write_signed(buffer, value):
+    write_varint (buffer, value << 1 if value >= 0 else (-value << 1) - 1)
+
+
+def read_signed(data, pos):
+    value, pos = read_varint (data, pos)
+    return (value >> 1) ^ -(value & 1), pos
+
+
+# A snapshot state is a list of one dict per kind, object id -> tuple of ints. Objects are
+# encoded when they differ from the baseline (a state, None for a full snapshot), objects
+# that are new to the baseline relative to all zero fields.
+def encode_delta(state, baseline):
+    buffer = bytearray ()
+    for kind, objects in enumerate (state):
+        old = baseline[kind] if baseline is not None else {}
+        zeros = (0,) * FIELD_COUNTS[kind]
+        changed = sorted (object_id for object_id, fields in objects.items () if old.get (object_id) != fields)
+        write_varint (buffer, len (changed))
+        previous = 0
+        for object_id in changed:
+            write_varint (buffer, object_id - previous)
+            previous = object_id
+            fields = objects[object_id]
+            base = old.get (object_id, zeros)
+            mask = 0
+            for field, value in enumerate (fields):
+                if value != base[field]:
+                    mask |= 1 << field
+            write_varint (buffer, mask)
+            for field, value in enumerate (fields):
+                if mask >> field & 1:
+                    write_signed (buffer, value - base[field])
+
+        removed = sorted (object_id for object_id in old if object_id not in objects)
+        write_varint (buffer, len (removed))
+        previous = 0
+        for object_id in removed:
+            write_varint (buffer, object_id - previous)
+            previous = object_id
+    return bytes (buffer)
+
+
+def decode_delta(data, pos, baseline):
+    state = []
+    for kind, field_count in enumerate (FIELD_COUNTS):
+        objects = dict (baseline[kind]) if baseline is not None else {}
+        zeros = (0,) * field_count
+        count, pos = read_varint (data, pos)
+        object_id = 0
+        for i in range (count):
+            delta, pos = read_varint (data, pos)
+            object_id += delta
+            mask, pos = read_varint (data, pos)
+            fields = list (objects.get (object_id, zeros))
+            for field in range (field_count):
+                if mask >> field & 1:
+                    value, pos = read_signed (data, pos)
+                    fields[field] += value
+            objects[object_id] = tuple (fields)
+
+        count, pos = read_varint (data, pos)
+        object_id = 0
+        for i in range (count):
+            delta, pos = read_varint (data, pos)
+            object_id += delta
+            objects.pop (object_id, None)
+        state.append (objects)
+    return state
+
+
+# turning and thrust of an input, previous is the input of the step before (thrust reacts
+# to the key going down or up, like the key events of the single player game)
+def steer(ship, bits, previous):
+    ship.is_turning_left = bool (bits & INPUT_LEFT)
+    ship.is_turning_right = bool (bits & INPUT_RIGHT)
+    if (bits ^ previous) & INPUT_THRUST:
+        ship.boost = bool (bits & INPUT_THRUST)
+
+
+class Player():
+    def __init__(self, player_id, address, ship, lifes):
+        self.id = player_id
+        self.address = address
+        self.ship = ship
+        self.lasers = []
+        self.score = 0
+        self.lifes = lifes
+        self.firing = False
+        self.next_fire_tick = 0
+
+        self.inputs = {} # sequence number -> input, received but not applied yet
+        self.last_input = 0 # applied last, repeated while the next one hasn't arrived
+        self.last_sequence = 0
+        self.acked = 0 # newest snapshot the client has received
+        self.last_heard = time.monotonic ()
+
+
+# The server's game: every player has a ship, lasers, a score and lifes. The single player
+# methods of AsteroidsGame (firing, collisions, expiring lasers) are run once per player with
+# myShip, lasers_fired, score and lifes switched to the player's (see use and keep).
+class ServerGame(AsteroidsGame):
+    def __init__(self, asteroid_count=10, lifes=3, seed=None):
+        self.players = {} # id -> Player
+        self.object_ids = {} # asteroid or laser -> id in the snapshots
+        self.next_object_id = 1
+        self.laser_fields = {} # laser id -> snapshot fields, they don't change during its life
+        AsteroidsGame.__init__ (self, asteroid_count=asteroid_count, lifes=lifes, sound_on=False, headless=True,
+                                seed=seed, star_count=0, snapshot_interval=0)
+
+    def add_player(self, address):
+        player_id = min (set (range (1, MAX_PLAYERS + 1)) - set (self.players))
+        ship = SpaceShip ()
+        ship.x_pos = self.rng.uniform (0, WINDOWWIDTH)
+        ship.y_pos = self.rng.uniform (0, WINDOWHEIGHT)
+        player = Player (player_id, address, ship, self.initial_lifes)
+        self.players[player_id] = player
+        return player
+
+    def remove_player(self, player):
+        self.use (player)
+        while player.lasers:
+            self.remove_laser (player.lasers[-1])
+        del self.players[player.id]
+
+    def use(self, player):
+        self.myShip = player.ship
+        self.lasers_fired = player.lasers
+        self.score = player.score
+        self.lifes = player.lifes
+        self.firing = player.firing
+        self.next_fire_tick = player.next_fire_tick
+
+    def keep(self, player):
+        player.score = self.score
+        player.lifes = self.lifes
+        player.firing = self.firing
+        player.next_fire_tick = self.next_fire_tick
+
+    # the oldest input that hasn't been applied, or the last one again
+    def next_input(self, player):
+        inputs = player.inputs
+        if not inputs:
+            return player.last_input
+        # a client that got ahead (e.g. after a lag spike) catches up by skipping inputs
+        while len (inputs) > INPUT_BUFFER:
+            del inputs[min (inputs)]
+        player.last_sequence = min (inputs)
+        return inputs.pop (player.last_sequence)
+
+    # with the player in use
+    def apply_input(self, player):
+        bits = self.next_input (player)
+        previous = player.last_input
+        player.last_input = bits
+        if self.lifes < 1:
+            if bits & INPUT_RESTART:
+                self.lifes = self.initial_lifes
+                self.score = 0
+                self.myShip.has_been_hit = False
+            return
+        steer (self.myShip, bits, previous)
+        if (bits ^ previous) & INPUT_FIRE:
+            self.set_fire (bool (bits & INPUT_FIRE))
+        elif self.firing and self.ticks >= self.next_fire_tick:
+            self.fire_laser ()
+            self.next_fire_tick = self.ticks + FIRE_INTERVAL
+
+    def step(self):
+        players = list (self.players.values ())
+        for player in players:
+            self.use (player)
+            self.apply_input (player)
+            self.keep (player)
+
+        # ships without lifes left are out of the game, their lasers still fly
+        self.prepare_collisions ()
+        for player in players:
+            self.use (player)
+            if self.lifes > 0:
+                self.ship_asteroid_collision ()
+            self.laser_asteroid_collision ()
+            self.expire_lasers ()
+            self.keep (player)
+
+        for asteroid in self.asteroids:
+            asteroid.update ()
+        for player in players:
+            for laser in player.lasers:
+                laser.update_laser ()
+            if player.lifes > 0:
+                player.ship.update (self.sim_time)
+
+        self.ticks += 1
+        self.sim_time += self.dt
+
+        # a new wave when all asteroids are destroyed
+        if not self.asteroids:
+            for i in range (self.asteroids_count):
+                self.add_asteroid (self.new_asteroid ())
+
+    # the ships get hit one by one, the screen doesn't shake
+    def shake_screen(self):
+        pass
+
+    def new_object_id(self):
+        self.next_object_id += 1
+        return self.next_object_id - 1
+
+    def add_asteroid(self, asteroid):
+        AsteroidsGame.add_asteroid (self, asteroid)
+        self.object_ids[asteroid] = self.new_object_id ()
+
+    def remove_asteroid(self, asteroid):
+        del self.object_ids[asteroid]
+        AsteroidsGame.remove_asteroid (self, asteroid)
+
+    def new_laser(self, *args):
+        laser = AsteroidsGame.new_laser (self, *args)
+        self.object_ids[laser] = self.new_object_id ()
+        return laser
+
+    def remove_laser(self, laser):
+        self.laser_fields.pop (self.object_ids.pop (laser), None)
+        AsteroidsGame.remove_laser (self, laser)
+
+    # quantized state of the game (see FIELD_COUNTS)
+    def snapshot(self):
+        ids = self.object_ids
+        asteroids = {}
+        for asteroid in self.asteroids:
+            asteroids[ids[asteroid]] = (round (asteroid.x_pos * POSITION_SCALE), round (asteroid.y_pos * POSITION_SCALE),
+                                        round (asteroid.angle) % 360, int (asteroid.size))
+        ships = {}
+        lasers = {}
+        players = {}
+        laser_fields = self.laser_fields
+        for player in self.players.values ():
+            ship = player.ship
+            flags = ((SHIP_BOOST if ship.boost else 0) | (SHIP_HIT if ship.has_been_hit else 0) |
+                     (SHIP_OUT if player.lifes < 1 else 0))
+            ships[player.id] = (round (ship.x_pos * POSITION_SCALE), round (ship.y_pos * POSITION_SCALE), ship.angle % 360,
+                                round (ship.x_speed * SPEED_SCALE), round (ship.y_speed * SPEED_SCALE), flags)
+            players[player.id] = (player.score, player.lifes)
+            for laser in player.lasers:
+                laser_id = ids[laser]
+                fields = laser_fields.get (laser_id)
+                if fields is None:
+                    fields = (round (laser.x_end_pos * POSITION_SCALE), round (laser.y_end_pos * POSITION_SCALE),
+                              round (laser.x_move * SPEED_SCALE), round (laser.y_move * SPEED_SCALE),
+                              round (laser.angle) % 360, self.ticks)
+                    laser_fields[laser_id] = fields
+                lasers[laser_id] = fields
+        return [asteroids, ships, lasers, players]
+
+
+# Stands in for a real network on loopback: every packet is dropped with probability loss or
+# sent after latency plus up to jitter seconds (so packets can arrive out of order).
+class LossyLink():
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random (seed)
+        self.transport = None
+        self.sent = 0
+        self.dropped = 0
+
+    def attach(self, transport):
+        self.transport = transport
+        return self
+
+    def sendto(self, data, address=None):
+        self.sent += 1
+        if self.loss and self.rng.random () < self.loss:
+            self.dropped += 1
+            return
+        delay = self.latency + (self.rng.uniform (0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            asyncio.get_running_loop ().call_later (delay, self.deliver, data, address)
+        else:
+            self.deliver (data, address)
+
+    def deliver(self, data, address):
+        if not self.transport.is_closing ():
+            self.transport.sendto (data, address)
+
+    def close(self):
+        self.transport.close ()
+
+
+def percentile(values, q):
+    values = sorted (values)
+    if not values:
+        return 0.0
+    return values[int (round (q * (len (values) - 1)))]
+
+
+class GameServer(asyncio.DatagramProtocol):
+    def __init__(self, asteroid_count=10, lifes=3, seed=None, link=None):
+        self.game = ServerGame (asteroid_count=asteroid_count, lifes=lifes, seed=seed)
+        self.link = link
+        self.transport = None
+        self.players = {} # address -> Player
+        self.history = {} # snapshot id -> state
+        self.running = True
+
+        # per tick: (seconds, snapshot bytes sent, clients, input bytes received, bytes of a full
+        # snapshot (0 unless measure_full), objects in the snapshot)
+        self.tick_records = deque (maxlen=TICK_RATE * 600)
+        self.input_bytes = 0
+        self.measure_full = False # also encode every snapshot without a baseline (not timed)
+
+    def connection_made(self, transport):
+        self.transport = transport if self.link is None else self.link.attach (transport)
+
+    def datagram_received(self, data, address):
+        # anything malformed is ignored
+        try:
+            self.receive (data, address)
+        except (struct.error, IndexError):
+            pass
+
+    def receive(self, data, address):
+        kind = data[0]
+        player = self.players.get (address)
+        if kind == MSG_JOIN:
+            if player is None:
+                if len (self.players) >= MAX_PLAYERS:
+                    return
+                player = self.game.add_player (address)
+                self.players[address] = player
+                print ("player %d joined from %s:%d" % ((player.id,) + address[:2]), file=sys.stderr)
+            self.transport.sendto (bytes ((MSG_WELCOME, player.id)), address)
+        elif player is None:
+            return
+        elif kind == MSG_INPUT:
+            tag, ack, sequence, count = INPUT_HEADER.unpack_from (data)
+            self.input_bytes += len (data)
+            if ack > player.acked:
+                player.acked = ack
+            inputs = data[INPUT_HEADER.size:INPUT_HEADER.size + count]
+            first = sequence - len (inputs) + 1
+            for i, bits in enumerate (inputs):
+                if first + i > player.last_sequence:
+                    player.inputs[first + i] = bits
+        elif kind == MSG_LEAVE:
+            self.drop (player)
+            return
+        player.last_heard = time.monotonic ()
+
+    def drop(self, player):
+        self.game.remove_player (player)
+        del self.players[player.address]
+        print ("player %d left" % player.id, file=sys.stderr)
+
+    # one step of the game and a snapshot for every client
+    def tick(self):
+        start = time.perf_counter ()
+        now = time.monotonic ()
+        for player in list (self.players.values ()):
+            if now - player.last_heard > TIMEOUT:
+                self.drop (player)
+
+        game = self.game
+        game.step ()
+        snapshot_id = game.ticks
+        state = game.snapshot ()
+        self.history[snapshot_id] = state
+        self.history.pop (snapshot_id - HISTORY, None)
+
+        # clients that acknowledged the same snapshot get the same delta
+        bodies = {}
+        sent = 0
+        for player in self.players.values ():
+            baseline_id = player.acked if player.acked in self.history else 0
+            body = bodies.get (baseline_id)
+            if body is None:
+                body = encode_delta (state, self.history.get (baseline_id))
+                bodies[baseline_id] = body
+            packet = SNAPSHOT_HEADER.pack (MSG_SNAPSHOT, snapshot_id, baseline_id, player.last_sequence) + body
+            self.transport.sendto (packet, player.address)
+            sent += len (packet)
+
+        elapsed = time.perf_counter () - start
+        full = 0
+        if self.measure_full:
+            full = SNAPSHOT_HEADER.size + (len (bodies[0]) if 0 in bodies else len (encode_delta (state, None)))
+        objects = len (game.asteroids) + sum (len (player.lasers) for player in game.players.values ())
+        self.tick_records.append ((elapsed, sent, len (self.players), self.input_bytes, full, objects))
+        self.input_bytes = 0
+
+    # steps at the tick rate, for duration seconds or until stopped
+    async def run(self, duration=None):
+        loop = asyncio.get_running_loop ()
+        next_tick = loop.time ()
+        end = None if duration is None else next_tick + duration
+        while self.running and (end is None or next_tick < end):
+            self.tick ()
+            next_tick += self.game.dt
+            delay = next_tick - loop.time ()
+            if delay < -1: # far behind, don't try to catch up
+                next_tick = loop.time ()
+            await asyncio.sleep (max (0.0, delay))
+
+
+# averages over tick records of the server (only ticks with clients)
+def summarize(records):
+    records = [record for record in records if record[2]]
+    times = [record[0] for record in records]
+    client_ticks = max (1, sum (record[2] for record in records))
+    return {"ticks": len (records),
+            "snapshot_bytes_per_tick": sum (record[1] for record in records) / client_ticks,
+            "full_snapshot_bytes": sum (record[4] for record in records) / max (1, len (records)),
+            "objects": sum (record[5] for record in records) / max (1, len (records)),
+            "input_bytes_per_tick": sum (record[3] for record in records) / client_ticks,
+            "tick_mean_ms": 1000 * sum (times) / max (1, len (times)),
+            "tick_p95_ms": 1000 * percentile (times, 0.95),
+            "tick_max_ms": 1000 * max (times, default=0.0)}
+
+
+class GameClient(asyncio.DatagramProtocol):
+    def __init__(self, link=None):
+        self.link = link
+        self.transport = None
+        self.player_id = None
+
+        self.states = {} # snapshot id -> state, baselines of the next snapshots
+        self.latest = 0 # newest snapshot id
+        self.state = None # newest state
+
+        # own ship predicted from the inputs
+        self.ship = None
+        self.out = False
+        self.sequence = 0
+        self.last_bits = 0
+        self.inputs = {} # sequence number -> input, not yet confirmed by the server (and the last confirmed one)
+        self.predicted = {} # sequence number -> (x, y) of the ship after the input
+        self.errors = [] # distance between predicted and confirmed ship position per snapshot
+
+    def connection_made(self, transport):
+        self.transport = transport if self.link is None else self.link.attach (transport)
+
+    def datagram_received(self, data, address):
+        try:
+            if data[0] == MSG_WELCOME and self.player_id is None:
+                self.player_id = data[1]
+                self.ship = SpaceShip ()
+            elif data[0] == MSG_SNAPSHOT and self.player_id is not None:
+                self.receive_snapshot (data)
+        except (struct.error, IndexError):
+            pass
+
+    def receive_snapshot(self, data):
+        tag, snapshot_id, baseline_id, last_sequence = SNAPSHOT_HEADER.unpack_from (data)
+        if snapshot_id <= self.latest: # arrived out of order, a newer one is there already
+            return
+        baseline = None
+        if baseline_id:
+            baseline = self.states.get (baseline_id)
+            if baseline is None:
+                return
+        state = decode_delta (data, SNAPSHOT_HEADER.size, baseline)
+
+        # the server only uses baselines we acknowledged, and never older ones than this one
+        for old in [old for old in self.states if old < baseline_id or old <= snapshot_id - HISTORY]:
+            del self.states[old]
+        self.states[snapshot_id] = state
+        self.latest = snapshot_id
+        self.state = state
+        self.reconcile (state, last_sequence)
+
+    # reset the ship to the server's and apply the inputs the server hasn't applied yet again
+    def reconcile(self, state, last_sequence):
+        fields = state[SHIPS].get (self.player_id)
+        if fields is None:
+            return
+        x_pos, y_pos, angle, x_speed, y_speed, flags = fields
+        predicted = self.predicted.get (last_sequence)
+        if predicted is not None:
+            self.errors.append (math.hypot (predicted[0] - x_pos / POSITION_SCALE, predicted[1] - y_pos / POSITION_SCALE))
+
+        ship = self.ship
+        ship.x_pos = x_pos / POSITION_SCALE
+        ship.y_pos = y_pos / POSITION_SCALE
+        ship.angle = angle
+        ship.x_speed = x_speed / SPEED_SCALE
+        ship.y_speed = y_speed / SPEED_SCALE
+        ship.boost = bool (flags & SHIP_BOOST)
+        ship.has_been_hit = bool (flags & SHIP_HIT)
+        self.out = bool (flags & SHIP_OUT)
+
+        for sequence in [sequence for sequence in self.inputs if sequence < last_sequence]:
+            del self.inputs[sequence]
+            self.predicted.pop (sequence, None)
+        previous = self.inputs.get (last_sequence, 0)
+        for sequence in range (last_sequence + 1, self.sequence + 1):
+            bits = self.inputs.get (sequence, previous)
+            self.predict (bits, previous)
+            self.predicted[sequence] = (ship.x_pos, ship.y_pos)
+            previous = bits
+
+    # one step of the own ship, the hit timeout is left to the server
+    def predict(self, bits, previous):
+        if self.out:
+            return
+        steer (self.ship, bits, previous)
+        self.ship.update (0)
+
+    def send_input(self, bits):
+        if self.player_id is None:
+            self.transport.sendto (bytes ((MSG_JOIN,)))
+            return
+        self.sequence += 1
+        self.inputs[self.sequence] = bits
+        self.predict (bits, self.last_bits)
+        self.predicted[self.sequence] = (self.ship.x_pos, self.ship.y_pos)
+        self.last_bits = bits
+        # a server that stopped answering doesn't make them pile up
+        self.inputs.pop (self.sequence - 256, None)
+        self.predicted.pop (self.sequence - 256, None)
+
+        first = max (min (self.inputs), self.sequence - INPUT_REDUNDANCY + 1)
+        recent = bytes (self.inputs.get (sequence, 0) for sequence in range (first, self.sequence + 1))
+        self.transport.sendto (INPUT_HEADER.pack (MSG_INPUT, self.latest, self.sequence, len (recent)) + recent)
+
+    def leave(self):
+        if self.player_id is not None:
+            self.transport.sendto (bytes ((MSG_LEAVE,)))
+
+    # sends controls (self) at the tick rate, until it returns None or for duration seconds
+    async def run(self, controls, duration=None):
+        loop = asyncio.get_running_loop ()
+        next_tick = loop.time ()
+        end = None if duration is None else next_tick + duration
+        while end is None or next_tick < end:
+            bits = controls (self)
+            if bits is None:
+                break
+            self.send_input (bits)
+            next_tick += 1.0 / TICK_RATE
+            delay = next_tick - loop.time ()
+            if delay < -1:
+                next_tick = loop.time ()
+            await asyncio.sleep (max (0.0, delay))
+        self.leave ()
+
+
+# random held keys for the benchmark, like the random policy of batch.py
+def bot_controls(seed):
+    rng = random.Random (seed)
+    held = [0]
+    def controls(client):
+        if rng.random () < 0.2:
+            bits = rng.choice ((0, INPUT_LEFT, INPUT_RIGHT))
+            if rng.random () < 0.3:
+                bits |= INPUT_THRUST
+            if rng.random () < 0.5:
+                bits |= INPUT_FIRE
+            held[0] = bits
+        return held[0] | (INPUT_RESTART if client.out else 0)
+    return controls
+
+
+# window of the client, draws the newest snapshot with the predicted own ship
+class ClientView():
+    def __init__(self):
+        pygame.init ()
+        self.screen = pygame.display.set_mode ((WINDOWWIDTH, WINDOWHEIGHT))
+        pygame.display.set_caption ("Asteroids - Multiplayer")
+        self.rotation_cache = RotationCache ()
+        self.hud = Hud ()
+        self.asteroid_images = {8: assets.image ("a0"), 16: assets.image ("a1"), 32: assets.image ("a2")}
+        for name in assets.rotated:
+            self.rotation_cache.add (assets.image (name))
+
+    def controls(self, client):
+        for event in pygame.event.get ():
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                return None
+        keys = pygame.key.get_pressed ()
+        bits = ((INPUT_LEFT if keys[pygame.K_LEFT] else 0) | (INPUT_RIGHT if keys[pygame.K_RIGHT] else 0) |
+                (INPUT_THRUST if keys[pygame.K_UP] else 0) | (INPUT_FIRE if keys[pygame.K_SPACE] else 0) |
+                (INPUT_RESTART if keys[pygame.K_r] else 0))
+        self.draw (client)
+        return bits
+
+    def blit_rotated(self, image, angle, x_pos, y_pos):
+        surf, (x_offset, y_offset) = self.rotation_cache.get (image, angle)
+        self.screen.blit (surf, (int (x_pos) + x_offset, int (y_pos) + y_offset))
+
+    def draw(self, client):
+        screen = self.screen
+        screen.fill (BLACK)
+        state = client.state
+        if state is None:
+            screen.blit (self.hud.render_text ("Connecting...", WHITE, 30), (WINDOWWIDTH / 2 - 75, WINDOWHEIGHT / 2))
+            pygame.display.flip ()
+            return
+
+        for x_pos, y_pos, angle, size in state[ASTEROIDS].values ():
+            image = self.asteroid_images.get (size, self.asteroid_images[8])
+            self.blit_rotated (image, angle, x_pos / POSITION_SCALE, y_pos / POSITION_SCALE)
+
+        # lasers fly in straight lines from where they were at tick
+        for x_end, y_end, x_move, y_move, angle, tick in state[LASERS].values ():
+            steps = client.latest - tick
+            x_end = x_end / POSITION_SCALE + x_move / SPEED_SCALE * steps
+            y_end = y_end / POSITION_SCALE + y_move / SPEED_SCALE * steps
+            rad_angle = math.radians (angle)
+            pygame.draw.line (screen, BLUE, (x_end + math.sin (rad_angle) * 10, y_end + math.cos (rad_angle) * 10),
+                              (x_end, y_end))
+
+        for player_id, (x_pos, y_pos, angle, x_speed, y_speed, flags) in state[SHIPS].items ():
+            if flags & SHIP_OUT:
+                continue
+            x_pos /= POSITION_SCALE
+            y_pos /= POSITION_SCALE
+            color = WHITE
+            if player_id == client.player_id:
+                x_pos, y_pos, angle = client.ship.x_pos, client.ship.y_pos, client.ship.angle
+                color = YELLOW
+            name = "ship_hit" if flags & SHIP_HIT else "ship_boost" if flags & SHIP_BOOST else "ship"
+            self.blit_rotated (assets.image (name), angle, x_pos, y_pos)
+            screen.blit (self.hud.render_text (str (player_id), color, 14), (int (x_pos) + 12, int (y_pos) - 24))
+
+        for row, (player_id, (score, lifes)) in enumerate (sorted (state[PLAYERS].items ())):
+            color = YELLOW if player_id == client.player_id else WHITE
+            screen.blit (self.hud.render_text ("%d: %d  lifes %d" % (player_id, score, lifes), color, 14), (10, 10 + 16 * row))
+        if client.out:
+            screen.blit (self.hud.render_text ("GAME OVER - press R", WHITE, 30), (WINDOWWIDTH / 2 - 150, WINDOWHEIGHT / 2))
+        pygame.display.flip ()
+
+
+async def serve(args):
+    loop = asyncio.get_running_loop ()
+    link = LossyLink (args.latency, args.jitter, args.loss) if args.latency or args.jitter or args.loss else None
+    server = GameServer (asteroid_count=args.asteroids, lifes=args.lifes, seed=args.seed, link=link)
+    transport, protocol = await loop.create_datagram_endpoint (lambda: server, local_addr=(args.host, args.port))
+    print ("serving on %s:%d" % transport.get_extra_info ("sockname")[:2], file=sys.stderr)
+    task = asyncio.ensure_future (server.run ())
+    try:
+        while True:
+            await asyncio.sleep (args.report)
+            records = list (server.tick_records)[-int (args.report * TICK_RATE):]
+            stats = summarize (records)
+            if stats["ticks"]:
+                print ("%d players  %.0f snapshot bytes/tick/client  tick %.2f ms (p95 %.2f ms)" %
+                       (len (server.players), stats["snapshot_bytes_per_tick"], stats["tick_mean_ms"], stats["tick_p95_ms"]),
+                       file=sys.stderr)
+    finally:
+        server.running = False
+        await task
+        transport.close ()
+
+
+async def play(args):
+    loop = asyncio.get_running_loop ()
+    host, sep, port = args.server.rpartition (":")
+    link = LossyLink (args.latency, args.jitter, args.loss) if args.latency or args.jitter or args.loss else None
+    client = GameClient (link=link)
+    transport, protocol = await loop.create_datagram_endpoint (lambda: client, remote_addr=(host or "127.0.0.1", int (port)))
+    view = ClientView ()
+    await client.run (view.controls)
+    await asyncio.sleep (args.latency + args.jitter) # the simulated link delivers the leave packet
+    transport.close ()
+    pygame.quit ()
+
+
+# server and `players` bot clients for `seconds`, returns the statistics after the first second
+async def bench_players(players, seconds, latency, jitter, loss, seed, asteroid_count):
+    loop = asyncio.get_running_loop ()
+    server = GameServer (asteroid_count=asteroid_count, seed=seed, link=LossyLink (latency, jitter, loss, seed))
+    server.measure_full = True
+    server_transport, protocol = await loop.create_datagram_endpoint (lambda: server, local_addr=("127.0.0.1", 0))
+    address = server_transport.get_extra_info ("sockname")
+
+    clients = []
+    transports = []
+    for i in range (players):
+        client = GameClient (link=LossyLink (latency, jitter, loss, seed + 1 + i))
+        transport, protocol = await loop.create_datagram_endpoint (lambda client=client: client, remote_addr=address)
+        clients.append (client)
+        transports.append (transport)
+
+    tasks = [asyncio.ensure_future (client.run (bot_controls (seed + 1 + i), seconds)) for i, client in enumerate (clients)]
+    await server.run (seconds)
+    await asyncio.gather (*tasks)
+    await asyncio.sleep (latency + jitter)
+
+    stats = summarize (list (server.tick_records)[TICK_RATE:])
+    stats["players"] = players
+    errors = [error for client in clients for error in client.errors]
+    stats["prediction_error_px"] = sum (errors) / max (1, len (errors))
+    stats["prediction_error_p95_px"] = percentile (errors, 0.95)
+    stats["packets_lost"] = server.link.dropped + sum (client.link.dropped for client in clients)
+
+    for transport in transports:
+        transport.close ()
+    server_transport.close ()
+    return stats
+
+
+async def bench(args):
+    print ("players  bytes/tick/client  full snapshot  input bytes/tick  tick ms  p95 ms  max ms  prediction error px  objects")
+    for players in args.players:
+        stats = await bench_players (players, args.seconds, args.latency, args.jitter, args.loss, args.seed, args.asteroids)
+        print ("%7d  %17.1f  %13.0f  %16.1f  %7.2f  %6.2f  %6.2f  %19.2f  %7.0f" %
+               (players, stats["snapshot_bytes_per_tick"], stats["full_snapshot_bytes"], stats["input_bytes_per_tick"],
+                stats["tick_mean_ms"], stats["tick_p95_ms"], stats["tick_max_ms"], stats["prediction_error_px"],
+                stats["objects"]))
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser (description="PyAsteroids multiplayer over UDP")
+    commands = parser.add_subparsers (dest="command", required=True)
+
+    server_parser = commands.add_parser ("server", help="run a game server")
+    server_parser.add_argument ("--host", default="0.0.0.0")
+    server_parser.add_argument ("--port", type=int, default=9999)
+    server_parser.add_argument ("--asteroids", type=int, default=20)
+    server_parser.add_argument ("--lifes", type=int, default=3)
+    server_parser.add_argument ("--seed", type=int, default=None)
+    server_parser.add_argument ("--report", type=float, default=5.0, help="seconds between statistics lines")
+
+    client_parser = commands.add_parser ("client", help="join a game in a window")
+    client_parser.add_argument ("server", metavar="HOST:PORT")
+
+    bench_parser = commands.add_parser ("bench", help="server and bot clients on loopback")
+    bench_parser.add_argument ("--players", type=int, nargs="*", default=[2, 4, 8, 16, 32])
+    bench_parser.add_argument ("--seconds", type=float, default=5.0)
+    bench_parser.add_argument ("--asteroids", type=int, default=20)
+    bench_parser.add_argument ("--seed", type=int, default=1)
+
+    for command in (server_parser, client_parser, bench_parser):
+        command.add_argument ("--latency", type=float, default=0.0, help="simulated one way delay in seconds")
+        command.add_argument ("--jitter", type=float, default=0.0, help="simulated random extra delay up to this")
+        command.add_argument ("--loss", type=float, default=0.0, help="simulated packet loss (0..1)")
+    args = parser.parse_args (argv)
+
+    if args.command != "client":
+        os.environ.setdefault ("SDL_VIDEODRIVER", "dummy")
+        os.environ.setdefault ("SDL_AUDIODRIVER", "dummy")
+    try:
+        asyncio.run ({"server": serve, "client": play, "bench": bench}[args.command] (args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit (main ())
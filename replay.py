@@ -0,0 +1,222 @@
+"""
+Replays for PyAsteroids
+
+A replay holds the seed and settings of a game plus every key press and release together
+with the step it happened at (steps count on while rewinding sets the ticks back). Since the
+simulation only depends on its own random generator and on fixed time steps, re-running the
+key presses on a new game with the same seed reproduces the game exactly. A checksum of the
+final state is stored to verify this.
+
+Usage:
+python replay.py game.rep               re-simulate as fast as possible (no window)
+python replay.py game.rep --speed 4     show the game in a window at 4x speed
+
+Games are recorded with AsteroidsGame (record_to="game.rep").
+
+File format (all little endian):
+header  "PYAR", version (B), seed (I), asteroid count (I), lifes (B), star count (I),
+        star layers (B), flags (B, bit 0: array world, bit 1: circle collisions only), world width (I),
+        world height (I), snapshot interval (I), snapshot memory (Q)
+records tag (B) followed by
+        0: key event   step delta to the previous event (varint), key << 1 | released (varint)
+        1: end         step delta (varint), state checksum (I)
+        2: load        step delta (varint), size (varint), the loaded save (AsteroidsGame.save_state)
+
+Quick save and load keys aren't recorded, a load is recorded as the state it loaded.
+"""
+
+import struct
+import sys
+import time
+
+import pygame
+
+from PyAsteroids import AsteroidsGame, TICK_RATE, WINDOWWIDTH, WINDOWHEIGHT
+
+MAGIC = b"PYAR"
+VERSION = 6 # 2: holding fire repeats shots, 3: world size, 4: pixel collisions, 5: rewinding, 6: loaded states
+HEADER = struct.Struct ("<4sBIIBIBBIIIQ")
+
+TAG_KEY = 0
+TAG_END = 1
+TAG_STATE = 2
+
+
+def write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append ((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append (value)
+
+
+def read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+# Writes the key presses of a running game to a replay file
+class ReplayRecorder():
+    def __init__(self, path, game):
+        self.file = open (path, "wb")
+        self.game = game
+        self.last_tick = 0
+        self.buffer = bytearray ()
+        snapshots = game.snapshots
+        self.file.write (HEADER.pack (MAGIC, VERSION, game.seed, game.asteroids_count, game.initial_lifes,
+                                      game.star_count, game.star_layers,
+                                      (1 if game.array_world else 0) | (0 if game.pixel_collisions else 2),
+                                      game.world_width, game.world_height,
+                                      0 if snapshots is None else snapshots.interval,
+                                      0 if snapshots is None else snapshots.max_bytes))
+
+    def record_key(self, tick, event_type, key):
+        self.buffer.append (TAG_KEY)
+        write_varint (self.buffer, tick - self.last_tick)
+        write_varint (self.buffer, key << 1 | (1 if event_type == pygame.KEYUP else 0))
+        self.last_tick = tick
+        self.flush ()
+
+    def record_state(self, tick, data):
+        self.buffer.append (TAG_STATE)
+        write_varint (self.buffer, tick - self.last_tick)
+        write_varint (self.buffer, len (data))
+        self.buffer += data
+        self.last_tick = tick
+        self.flush ()
+
+    def flush(self):
+        if len (self.buffer) > 4096:
+            self.file.write (self.buffer)
+            self.buffer = bytearray ()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.buffer.append (TAG_END)
+        write_varint (self.buffer, self.game.steps - self.last_tick)
+        self.buffer += struct.pack ("<I", self.game.state_checksum ())
+        self.file.write (self.buffer)
+        self.file.close ()
+        self.file = None
+
+
+# Contents of a replay file
+class Replay():
+    def __init__(self, path):
+        with open (path, "rb") as f:
+            data = f.read ()
+        (magic, version, self.seed, self.asteroid_count, self.lifes, self.star_count,
+         self.star_layers, flags, self.world_width, self.world_height, self.snapshot_interval,
+         self.snapshot_memory) = HEADER.unpack_from (data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError ("%s is not a replay file" % path)
+        self.array_world = bool (flags & 1)
+        self.pixel_collisions = not flags & 2
+
+        self.events = [] # (step, event type, key), event type None for a loaded state (step, None, save data)
+        self.end_tick = None
+        self.checksum = None
+        pos = HEADER.size
+        tick = 0
+        while pos < len (data):
+            tag = data[pos]
+            delta, pos = read_varint (data, pos + 1)
+            tick += delta
+            if tag == TAG_KEY:
+                value, pos = read_varint (data, pos)
+                event_type = pygame.KEYUP if value & 1 else pygame.KEYDOWN
+                self.events.append ((tick, event_type, value >> 1))
+            elif tag == TAG_STATE:
+                size, pos = read_varint (data, pos)
+                self.events.append ((tick, None, data[pos:pos + size]))
+                pos += size
+            else:
+                self.end_tick = tick
+                self.checksum, = struct.unpack_from ("<I", data, pos)
+                break
+        if self.end_tick is None: # game didn't quit cleanly, replay what we have
+            self.end_tick = tick
+
+    def new_game(self):
+        return AsteroidsGame (asteroid_count=self.asteroid_count, lifes=self.lifes, sound_on=False,
+                              array_world=self.array_world, headless=True, seed=self.seed,
+                              star_count=self.star_count, star_layers=self.star_layers,
+                              world_size=(self.world_width, self.world_height), pixel_collisions=self.pixel_collisions,
+                              snapshot_interval=self.snapshot_interval, snapshot_memory=self.snapshot_memory)
+
+
+# Re-simulates a replay. Without speed the game runs as fast as possible and without
+# rendering, otherwise it is shown in a window at speed times the normal tick rate.
+# Returns the game and whether its final state matches the recorded one (None if the
+# replay has no checksum).
+def play(replay, speed=None):
+    game = replay.new_game ()
+
+    screen = None
+    if speed is not None:
+        pygame.init ()
+        screen = pygame.display.set_mode ((WINDOWWIDTH, WINDOWHEIGHT), 0, 32)
+        pygame.display.set_caption ("Asteroids - Replay")
+        game.init_renderer (screen)
+        clock = pygame.time.Clock ()
+
+    events = replay.events
+    i = 0
+    while True:
+        # same order as in AsteroidsGame.run_game: key events, then one step
+        while i < len (events) and events[i][0] == game.steps:
+            tick, event_type, key = events[i]
+            if event_type is None:
+                game.load_game (key)
+            elif not (event_type == pygame.KEYDOWN and (key == pygame.K_ESCAPE or key in game.unrecorded_keys)):
+                game.handle_key (event_type, key)
+            i += 1
+
+        # a paused or finished game only continues with key events at the same tick,
+        # which have all been handled above
+        if not game.game_run or game.steps >= replay.end_tick:
+            break
+        game.step ()
+
+        if game.is_finished ():
+            game.game_run = False
+
+        if screen is not None:
+            for event in pygame.event.get ():
+                if event.type == pygame.QUIT:
+                    return game, None
+            pygame.display.update (game.render ())
+            clock.tick (TICK_RATE * speed)
+
+    if replay.checksum is None:
+        return game, None
+    return game, game.state_checksum () == replay.checksum
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser (description="Re-simulate a recorded PyAsteroids game")
+    parser.add_argument ("replay")
+    parser.add_argument ("--speed", type=float, default=None,
+                        help="show the replay in a window at this multiple of the normal speed")
+    args = parser.parse_args ()
+
+    replay = Replay (args.replay)
+    start = time.perf_counter ()
+    game, matches = play (replay, args.speed)
+    elapsed = time.perf_counter () - start
+    print ("%d steps in %.2f s (%.0f steps/s), score %d, lifes %d" %
+           (game.steps, elapsed, game.steps / max (elapsed, 1e-9), game.score, game.lifes))
+    if matches is None:
+        print ("no checksum to verify")
+    else:
+        print ("final state matches recording" if matches else "final state DIFFERS from recording")
+        sys.exit (0 if matches else 1)
@@ -0,0 +1,53 @@
+"""
+Regression tests for the collision grid (python -m pytest or python -m unittest)
+"""
+
+import os
+import unittest
+
+os.environ.setdefault ("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault ("SDL_AUDIODRIVER", "dummy")
+
+import batch
+from PyAsteroids import AsteroidsGame
+
+
+class SpatialGridTest(unittest.TestCase):
+
+    # the grid has to hold every live asteroid exactly in the cells its box touches, nothing else
+    def assert_grid_matches(self, game):
+        grid = game.collision_grid
+        expected = [[] for cell in grid.cells]
+        for asteroid in game.asteroids:
+            for i in grid._cell_indices (asteroid.x_pos, asteroid.y_pos, asteroid.size):
+                expected[i].append (asteroid)
+        for cell, objects in zip (grid.cells, expected):
+            self.assertEqual (sorted (map (id, cell)), sorted (map (id, objects)))
+
+    # restart releases the asteroids to the pool and takes them again, entries of their old
+    # cells used to stay in the grid and a laser hit the same asteroid twice
+    def test_restart(self):
+        game = AsteroidsGame (asteroid_count=10, headless=True, seed=5, lifes=10**6)
+        game.grid_min_asteroids = game.grid_min_pairs = 0 # in every step
+        act = batch.random_policy (5)
+        for i in range (600):
+            if i and i % 150 == 0:
+                game.restart_game ()
+                game.prepare_collisions ()
+                self.assertTrue (game.grid_active)
+                self.assert_grid_matches (game)
+            act (game)
+            game.step ()
+
+    def test_clear(self):
+        game = AsteroidsGame (asteroid_count=10, headless=True, seed=1)
+        grid = game.collision_grid
+        asteroid = game.asteroids[0]
+        grid.insert (asteroid, 10, 10, 5)
+        grid.insert (asteroid, 300, 300, 5) # again without remove, cells_of only knows these cells
+        grid.clear ()
+        self.assertEqual (sum (len (cell) for cell in grid.cells), 0)
+
+
+if __name__ == "__main__":
+    unittest.main ()